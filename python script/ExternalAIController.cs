@@ -9,11 +9,14 @@ using UnityEngine;
 public class ExternalAIController : MonoBehaviour
 {
     [SerializeField] private HanabiManager manager;
+    // true: HanabiWireProtocol のバイナリ形式で送る（JSON より小さい。Python 側は自動判別）
+    [SerializeField] private bool useBinaryProtocol = false;
 
     private const string HOST = "127.0.0.1";
     private const int PORT_SEND = 9000;
 
     private bool awaiting = false; // 返信待ちの間は再送しない
+    private uint requestId = 0;    // バイナリ形式のリクエスト番号
 
     // Python(C++) 側に合わせた色順: R, Y, G, W, B
     private static readonly char[] COLOR_ORDER = { 'R','Y','G','W','B' };
@@ -45,8 +48,16 @@ public class ExternalAIController : MonoBehaviour
         // ★マスク（Python順 0/1）
         float[] legal01 = BuildLegalMaskPythonOrder(manager, playerIndex);
 
-        var msg = new HanabiMessage { observation = obs, legal_actions = legal01 };
-        string json = JsonUtility.ToJson(msg) + "\n";
+        byte[] data;
+        if (useBinaryProtocol)
+        {
+            data = HanabiWireProtocol.EncodeObservation(obs, legal01, ++requestId);
+        }
+        else
+        {
+            var msg = new HanabiMessage { observation = obs, legal_actions = legal01 };
+            data = Encoding.UTF8.GetBytes(JsonUtility.ToJson(msg) + "\n");
+        }
 
         try
         {
@@ -56,7 +67,6 @@ public class ExternalAIController : MonoBehaviour
                 await client.ConnectAsync(HOST, PORT_SEND);
                 using (var stream = client.GetStream())
                 {
-                    byte[] data = Encoding.UTF8.GetBytes(json);
                     await stream.WriteAsync(data, 0, data.Length);
                 }
             }
@@ -0,0 +1,120 @@
+// Assets/hanabi/python script/HanabiWireProtocol.cs
+using System;
+using System.IO;
+using System.Text;
+
+// python/wire_protocol.py と同じバイナリ形式（数値はすべてビッグエンディアン）
+//   フレーム = 長さ u32 + ヘッダ（magic, version, type, flags, request_id u32）+ ペイロード
+//   OBSERVATION : num_bits u16 / num_actions u8 / 観測ビット列（先頭ビットが MSB）/ 合法手 u32
+//   ACTION      : action i16
+//   ERROR       : UTF-8 メッセージ
+// 658 次元の観測 + 20 手のマスクで 102 バイト（JSON だと約 3KB）。
+public static class HanabiWireProtocol
+{
+    public const byte Magic = 0xB5;
+    public const byte Version = 1;
+
+    public const byte MsgObservation = 1;
+    public const byte MsgAction = 2;
+    public const byte MsgError = 3;
+
+    private const int LengthSize = 4;
+    private const int HeaderSize = 8;
+
+    // 観測（0/1）と合法手（1.0=合法 / 0.0=違法）→ 長さプレフィックス付きフレーム
+    public static byte[] EncodeObservation(float[] observation, float[] legal01, uint requestId)
+    {
+        if (legal01.Length > 32)
+            throw new ArgumentException($"legal mask holds at most 32 actions, got {legal01.Length}");
+
+        int numBits = observation.Length;
+        int packedBytes = (numBits + 7) / 8;
+        int bodyLength = HeaderSize + 3 + packedBytes + 4;
+        var buf = new byte[LengthSize + bodyLength];
+
+        WriteUInt32(buf, 0, (uint)bodyLength);
+        WriteHeader(buf, LengthSize, MsgObservation, requestId);
+
+        int offset = LengthSize + HeaderSize;
+        buf[offset] = (byte)(numBits >> 8);
+        buf[offset + 1] = (byte)numBits;
+        buf[offset + 2] = (byte)legal01.Length;
+        offset += 3;
+
+        for (int i = 0; i < numBits; i++)
+        {
+            if (observation[i] > 0.5f)
+                buf[offset + (i >> 3)] |= (byte)(0x80 >> (i & 7));
+        }
+        offset += packedBytes;
+
+        uint mask = 0;
+        for (int i = 0; i < legal01.Length; i++)
+        {
+            if (legal01[i] > 0.5f) mask |= 1u << i;
+        }
+        WriteUInt32(buf, offset, mask);
+        return buf;
+    }
+
+    // 応答フレームを 1 つ読み、行動 ID を返す（ERROR 応答なら例外）
+    public static int ReadAction(Stream stream, out uint requestId)
+    {
+        byte[] lengthBytes = ReadExactly(stream, LengthSize);
+        int bodyLength = (int)ReadUInt32(lengthBytes, 0);
+        byte[] body = ReadExactly(stream, bodyLength);
+
+        if (body.Length < HeaderSize || body[0] != Magic)
+            throw new InvalidDataException("not a binary wire protocol frame");
+        if (body[1] != Version)
+            throw new InvalidDataException($"unsupported version: {body[1]}");
+
+        requestId = ReadUInt32(body, 4);
+        switch (body[2])
+        {
+            case MsgAction:
+                return (short)((body[HeaderSize] << 8) | body[HeaderSize + 1]);
+            case MsgError:
+                throw new InvalidOperationException(
+                    "python error: " + Encoding.UTF8.GetString(body, HeaderSize, body.Length - HeaderSize));
+            default:
+                throw new InvalidDataException($"unexpected message type: {body[2]}");
+        }
+    }
+
+    private static void WriteHeader(byte[] buf, int offset, byte type, uint requestId)
+    {
+        buf[offset] = Magic;
+        buf[offset + 1] = Version;
+        buf[offset + 2] = type;
+        buf[offset + 3] = 0; // flags
+        WriteUInt32(buf, offset + 4, requestId);
+    }
+
+    private static void WriteUInt32(byte[] buf, int offset, uint value)
+    {
+        buf[offset] = (byte)(value >> 24);
+        buf[offset + 1] = (byte)(value >> 16);
+        buf[offset + 2] = (byte)(value >> 8);
+        buf[offset + 3] = (byte)value;
+    }
+
+    private static uint ReadUInt32(byte[] buf, int offset)
+    {
+        return ((uint)buf[offset] << 24) | ((uint)buf[offset + 1] << 16)
+             | ((uint)buf[offset + 2] << 8) | buf[offset + 3];
+    }
+
+    private static byte[] ReadExactly(Stream stream, int count)
+    {
+        var buf = new byte[count];
+        int read = 0;
+        while (read < count)
+        {
+            int n = stream.Read(buf, read, count - read);
+            if (n <= 0) throw new EndOfStreamException("connection closed mid-frame");
+            read += n;
+        }
+        return buf;
+    }
+}
@@ -18,6 +18,9 @@ public class HanabiResponse
 
 public class SendHanabiObservation : MonoBehaviour
 {
+    // true: HanabiWireProtocol のバイナリ形式で送受信する
+    public bool useBinaryProtocol = false;
+
     // この関数をボタンに割り当てる
     public void SendDataToPython()
     {
@@ -35,6 +38,20 @@ public class SendHanabiObservation : MonoBehaviour
             float[] legalActions = new float[20];
             for (int i = 0; i < legalActions.Length; i++) legalActions[i] = 0.0f;
 
+            if (useBinaryProtocol)
+            {
+                byte[] frame = HanabiWireProtocol.EncodeObservation(observation, legalActions, 1);
+                stream.Write(frame, 0, frame.Length);
+                Debug.Log($"Pythonにデータ送信済み(binary): {frame.Length} bytes");
+
+                int binaryAction = HanabiWireProtocol.ReadAction(stream, out uint requestId);
+                Debug.Log($"Pythonからのアクション受信(binary): {binaryAction} (request_id={requestId})");
+
+                stream.Close();
+                client.Close();
+                return;
+            }
+
             HanabiMessage msg = new HanabiMessage
             {
                 observation = observation,
@@ -1,5 +1,6 @@
 // Assets/hanabi/python script/TCPReceiver.cs
 using System;
+using System.IO;
 using System.Net;
 using System.Net.Sockets;
 using System.Text;
@@ -39,119 +40,123 @@ public class TCPReceiver : MonoBehaviour
 
             while (true)
             {
-                using (TcpClient client = listener.AcceptTcpClient())
-                using (NetworkStream stream = client.GetStream())
+                TcpClient client = listener.AcceptTcpClient();
+                // 常時接続（Python 側テレメトリ）が開いている間も、1 発送信の行動通知
+                // （predict_action の send_to_unity など）を待たせないよう接続ごとにスレッドを分ける
+                var clientThread = new Thread(() => HandleClient(client));
+                clientThread.IsBackground = true;
+                clientThread.Start();
+            }
+        }
+        catch (Exception e)
+        {
+            Debug.LogError("Error: " + e.Message);
+        }
+    }
+
+    void HandleClient(TcpClient client)
+    {
+        try
+        {
+            using (client)
+            using (NetworkStream stream = client.GetStream())
+            using (var reader = new StreamReader(stream, Encoding.UTF8))
+            {
+                // 1 接続 1 メッセージの送信側と、改行区切りで送り続ける常時接続
+                // （Python 側テレメトリ）の両方に対応するため、切断まで 1 行ずつ読む
+                string line;
+                while ((line = reader.ReadLine()) != null)
                 {
-                    var sb = new StringBuilder();
-                    byte[] buffer = new byte[4096];
-                    int bytesRead;
-                    do
-                    {
-                        bytesRead = stream.Read(buffer, 0, buffer.Length);
-                        if (bytesRead > 0)
-                            sb.Append(Encoding.UTF8.GetString(buffer, 0, bytesRead));
-                    } while (stream.DataAvailable);
-
-                    string received = sb.ToString();
-                    if (string.IsNullOrWhiteSpace(received))
-                    {
-                        Debug.Log("Empty payload");
-                        continue;
-                    }
-
-                    var messages = received.Split(new[] { '\n', '\r' }, StringSplitOptions.RemoveEmptyEntries);
-
-                    foreach (var raw in messages)
-                    {
-                        string jsonStr = raw.Trim();
-                        if (string.IsNullOrEmpty(jsonStr)) continue;
-
-                        // メインスレッドでゲーム進行
-                        UnityMainThreadDispatcher.Instance().Enqueue(() =>
-                        {
-                            UnityMessage message = null;
-                            try
-                            {
-                                message = JsonUtility.FromJson<UnityMessage>(jsonStr);
-                            }
-                            catch (Exception ex)
-                            {
-                                Debug.LogWarning($"[AI] JSON parse failed: {ex.Message}");
-                                return;
-                            }
-
-                            if (message == null)
-                            {
-                                Debug.LogWarning("[AI] Empty message");
-                                return;
-                            }
-
-                            var hanabiManager = FindObjectOfType<HanabiManager>();
-                            if (hanabiManager == null) return;
-
-                            // 終局なら何もしない（安全弁）
-                            if (hanabiManager.IsTerminalLikeHLE())
-                                return;
-
-                            int actionId = message.action;
-                            if (actionId < 0 || actionId > 19)
-                            {
-                                Debug.LogWarning($"[AI] Invalid action id: {actionId}");
-                                return;
-                            }
-
-                            int currentPlayer = hanabiManager.turnManager.GetCurrentPlayer();
-
-                            // HLE順 → Unity実行
-                            if (actionId >= 0 && actionId <= 4)
-                            {
-                                int cardIndex = actionId; // Discard
-                                hanabiManager.playManager.ExecuteAction(
-                                    currentPlayer, "discard", cardIndex, null,
-                                    hanabiManager.handManager, hanabiManager.scoreManager,
-                                    hanabiManager.shuffleManager, hanabiManager.fireworkDisplayManager);
-                            }
-                            else if (actionId >= 5 && actionId <= 9)
-                            {
-                                int cardIndex = actionId - 5; // Play
-                                hanabiManager.playManager.ExecuteAction(
-                                    currentPlayer, "play", cardIndex, null,
-                                    hanabiManager.handManager, hanabiManager.scoreManager,
-                                    hanabiManager.shuffleManager, hanabiManager.fireworkDisplayManager);
-                            }
-                            else if (actionId >= 10 && actionId <= 14)
-                            {
-                                char colorChar = HanabiSpec.ColorOrder[actionId - 10];
-                                int targetPlayer = (currentPlayer + 1) % 2;
-                                hanabiManager.playManager.ExecuteAction(
-                                    currentPlayer, "hint", targetPlayer, colorChar.ToString(),
-                                    hanabiManager.handManager, hanabiManager.scoreManager,
-                                    hanabiManager.shuffleManager, hanabiManager.fireworkDisplayManager);
-                            }
-                            else if (actionId >= 15 && actionId <= 19)
-                            {
-                                int number = actionId - 14; // 1..5
-                                int targetPlayer = (currentPlayer + 1) % 2;
-                                hanabiManager.playManager.ExecuteAction(
-                                    currentPlayer, "hint", targetPlayer, number.ToString(),
-                                    hanabiManager.handManager, hanabiManager.scoreManager,
-                                    hanabiManager.shuffleManager, hanabiManager.fireworkDisplayManager);
-                            }
-
-                            // ★ここで「返信を受けて適用した」ことを通知（次の手を送れるようにする）
-                            hanabiManager.NotifyActionAppliedFromTCP();
-
-                            // ターン完了（内部で終局チェック＆停止）
-                            hanabiManager.CompletePlayerTurn();
-                        });
-                    }
+                    string jsonStr = line.Trim();
+                    if (string.IsNullOrEmpty(jsonStr)) continue;
+
+                    // メインスレッドでゲーム進行
+                    UnityMainThreadDispatcher.Instance().Enqueue(() => ApplyMessage(jsonStr));
                 }
             }
         }
         catch (Exception e)
         {
-            Debug.LogError("Error: " + e.Message);
+            Debug.LogWarning("[TCPReceiver] client error: " + e.Message);
+        }
+    }
+
+    void ApplyMessage(string jsonStr)
+    {
+        UnityMessage message = null;
+        try
+        {
+            message = JsonUtility.FromJson<UnityMessage>(jsonStr);
+        }
+        catch (Exception ex)
+        {
+            Debug.LogWarning($"[AI] JSON parse failed: {ex.Message}");
+            return;
+        }
+
+        if (message == null)
+        {
+            Debug.LogWarning("[AI] Empty message");
+            return;
         }
+
+        var hanabiManager = FindObjectOfType<HanabiManager>();
+        if (hanabiManager == null) return;
+
+        // 終局なら何もしない（安全弁）
+        if (hanabiManager.IsTerminalLikeHLE())
+            return;
+
+        int actionId = message.action;
+        if (actionId < 0 || actionId > 19)
+        {
+            Debug.LogWarning($"[AI] Invalid action id: {actionId}");
+            return;
+        }
+
+        int currentPlayer = hanabiManager.turnManager.GetCurrentPlayer();
+
+        // HLE順 → Unity実行
+        if (actionId >= 0 && actionId <= 4)
+        {
+            int cardIndex = actionId; // Discard
+            hanabiManager.playManager.ExecuteAction(
+                currentPlayer, "discard", cardIndex, null,
+                hanabiManager.handManager, hanabiManager.scoreManager,
+                hanabiManager.shuffleManager, hanabiManager.fireworkDisplayManager);
+        }
+        else if (actionId >= 5 && actionId <= 9)
+        {
+            int cardIndex = actionId - 5; // Play
+            hanabiManager.playManager.ExecuteAction(
+                currentPlayer, "play", cardIndex, null,
+                hanabiManager.handManager, hanabiManager.scoreManager,
+                hanabiManager.shuffleManager, hanabiManager.fireworkDisplayManager);
+        }
+        else if (actionId >= 10 && actionId <= 14)
+        {
+            char colorChar = HanabiSpec.ColorOrder[actionId - 10];
+            int targetPlayer = (currentPlayer + 1) % 2;
+            hanabiManager.playManager.ExecuteAction(
+                currentPlayer, "hint", targetPlayer, colorChar.ToString(),
+                hanabiManager.handManager, hanabiManager.scoreManager,
+                hanabiManager.shuffleManager, hanabiManager.fireworkDisplayManager);
+        }
+        else if (actionId >= 15 && actionId <= 19)
+        {
+            int number = actionId - 14; // 1..5
+            int targetPlayer = (currentPlayer + 1) % 2;
+            hanabiManager.playManager.ExecuteAction(
+                currentPlayer, "hint", targetPlayer, number.ToString(),
+                hanabiManager.handManager, hanabiManager.scoreManager,
+                hanabiManager.shuffleManager, hanabiManager.fireworkDisplayManager);
+        }
+
+        // ★ここで「返信を受けて適用した」ことを通知（次の手を送れるようにする）
+        hanabiManager.NotifyActionAppliedFromTCP();
+
+        // ターン完了（内部で終局チェック＆停止）
+        hanabiManager.CompletePlayerTurn();
     }
 
     void OnApplicationQuit()
@@ -0,0 +1,465 @@
+# coding=utf-8
+# Copyright 2018 The Dopamine Authors and Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+#
+# This file is a fork of the original Dopamine code incorporating changes for
+# the multiplayer setting and the Hanabi Learning Environment.
+#
+"""Actor/learner training on a single machine.
+
+Several actor processes play Hanabi with a copy of the online network and
+push their finished episodes into a shared-memory `TransitionQueue`. The
+learner, i.e. the main process, drains the queue into its replay memory and
+trains continuously. Every `weight_broadcast_period` gradient updates it
+publishes the online weights through `SharedWeights`, and the actors pick them
+up before their next episode. Data generation thus scales with the number of
+cores instead of being interleaved with training in a single thread.
+
+Actors are started with the `spawn` method, so that each builds its own
+TensorFlow graph and session from the same gin configuration. Evaluation games
+are played by a `run_experiment.AsyncEvaluator` process, so the learner never
+pauses for them.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import os
+import queue
+import random
+import time
+
+from third_party.dopamine import iteration_statistics
+import gin.tf
+import numpy as np
+import replay_memory
+import run_experiment
+import tensorflow as tf
+
+
+class SharedWeights(object):
+  """Online network weights shared between processes.
+
+  The weights live in one flat float32 buffer in shared memory, together with
+  a version counter and the learner's training step count.
+  """
+
+  def __init__(self, shapes, context):
+    """Allocates the shared buffer.
+
+    Args:
+      shapes: list of tuples, the shapes of the weight arrays.
+      context: multiprocessing context creating the shared objects.
+    """
+    self._shapes = [tuple(shape) for shape in shapes]
+    self._sizes = [int(np.prod(shape)) for shape in self._shapes]
+    self._buffer = context.RawArray('f', sum(self._sizes))
+    self._version = context.RawValue('q', 0)
+    self._training_steps = context.RawValue('q', 0)
+    self._lock = context.Lock()
+
+  @property
+  def version(self):
+    """Number of times weights were published."""
+    return self._version.value
+
+  def _flat(self):
+    return np.frombuffer(self._buffer, dtype=np.float32)
+
+  def publish(self, weights, training_steps):
+    """Replaces the shared weights.
+
+    Args:
+      weights: list of `np.array`, as returned by
+        `DQNAgent.get_online_weights`.
+      training_steps: int, the learner's training step count.
+    """
+    flat = np.concatenate([np.ravel(w) for w in weights]).astype(np.float32)
+    with self._lock:
+      self._flat()[:] = flat
+      self._training_steps.value = training_steps
+      self._version.value += 1
+
+  def fetch(self):
+    """Returns a copy of the shared weights.
+
+    Returns:
+      The list of weight arrays, the version and the learner's training step
+      count.
+    """
+    with self._lock:
+      flat = self._flat().copy()
+      version = self._version.value
+      training_steps = self._training_steps.value
+    weights = []
+    offset = 0
+    for shape, size in zip(self._shapes, self._sizes):
+      weights.append(flat[offset:offset + size].reshape(shape))
+      offset += size
+    return weights, version, training_steps
+
+
+class TransitionQueue(object):
+  """A bounded multi-producer, single-consumer queue of transitions.
+
+  Transitions are stored in ring buffers in shared memory, so episodes cross
+  process boundaries without pickling. Each `put_episode` is written
+  contiguously, which keeps the per-player episodes consecutive in the
+  learner's replay memory. Producers block while the queue is full.
+  """
+
+  def __init__(self, capacity, observation_size, num_actions, context):
+    """Allocates the shared ring buffers.
+
+    Args:
+      capacity: int, number of transitions the queue can hold.
+      observation_size: int, size of an observation.
+      num_actions: int, number of actions.
+      context: multiprocessing context creating the shared objects.
+    """
+    self._capacity = capacity
+    self._observation_size = observation_size
+    self._num_actions = num_actions
+    self._legal_dtype = replay_memory.legal_actions_dtype(num_actions)
+    self._buffers = {
+        'observations': context.RawArray('B', capacity * observation_size),
+        'actions': context.RawArray('i', capacity),
+        'rewards': context.RawArray('f', capacity),
+        'terminals': context.RawArray('B', capacity),
+        'legal_actions': context.RawArray(
+            'B', capacity * np.dtype(self._legal_dtype).itemsize),
+    }
+    # Total number of transitions written and read so far.
+    self._head = context.RawValue('q', 0)
+    self._tail = context.RawValue('q', 0)
+    self._not_full = context.Condition(context.Lock())
+
+  def _arrays(self):
+    return {
+        'observations': np.frombuffer(
+            self._buffers['observations'], dtype=np.uint8).reshape(
+                self._capacity, self._observation_size),
+        'actions': np.frombuffer(self._buffers['actions'], dtype=np.int32),
+        'rewards': np.frombuffer(self._buffers['rewards'], dtype=np.float32),
+        'terminals': np.frombuffer(self._buffers['terminals'], dtype=np.uint8),
+        'legal_actions': np.frombuffer(self._buffers['legal_actions'],
+                                       dtype=self._legal_dtype),
+    }
+
+  def put_episode(self, observations, actions, rewards, terminals,
+                  legal_actions, stop_event=None):
+    """Appends consecutive transitions, blocking while there is no room.
+
+    Args:
+      observations: `np.array`, (n, observation_size) observations, i.e.
+        the agent's frames.
+      actions: `np.array` of n ints.
+      rewards: `np.array` of n floats.
+      terminals: `np.array` of n bools.
+      legal_actions: `np.array`, (n, num_actions), with -inf meaning not
+        legal.
+      stop_event: optional `multiprocessing.Event`. If it is set while
+        waiting for room, the episode is dropped.
+
+    Returns:
+      bool, whether the episode was enqueued.
+
+    Raises:
+      ValueError: If the episode is longer than the queue.
+    """
+    num_transitions = len(actions)
+    if num_transitions > self._capacity:
+      raise ValueError('Episode of {} transitions does not fit a queue of {}.'
+                       .format(num_transitions, self._capacity))
+    rows = {
+        'observations': np.asarray(observations, dtype=np.uint8),
+        'actions': np.asarray(actions, dtype=np.int32),
+        'rewards': np.asarray(rewards, dtype=np.float32),
+        'terminals': np.asarray(terminals, dtype=np.uint8),
+        'legal_actions': replay_memory.pack_legal_actions(
+            np.asarray(legal_actions), self._num_actions),
+    }
+    with self._not_full:
+      while (self._head.value - self._tail.value + num_transitions >
+             self._capacity):
+        if stop_event is not None and stop_event.is_set():
+          return False
+        self._not_full.wait(0.1)
+      slots = (self._head.value + np.arange(num_transitions)) % self._capacity
+      for name, array in self._arrays().items():
+        array[slots] = rows[name]
+      self._head.value += num_transitions
+    return True
+
+  def get_all(self):
+    """Removes and returns every transition in the queue, oldest first.
+
+    Returns:
+      A dict of `np.array` with keys observations, actions, rewards, terminals
+      and legal_actions (as 0/-inf floats), or None if the queue is empty.
+    """
+    with self._not_full:
+      head = self._head.value
+      tail = self._tail.value
+    if head == tail:
+      return None
+    # Producers do not overwrite these slots until the tail moves past them.
+    slots = np.arange(tail, head) % self._capacity
+    rows = {name: array[slots] for name, array in self._arrays().items()}
+    rows['legal_actions'] = replay_memory.unpack_legal_actions(
+        rows['legal_actions'], self._num_actions)
+    with self._not_full:
+      self._tail.value = head
+      self._not_full.notify_all()
+    return rows
+
+
+def _actor_main(actor_id, gin_files, gin_bindings, transitions, weights,
+                episode_stats, stop_event):
+  """Plays training games until stop_event is set.
+
+  Args:
+    actor_id: int, index of this actor, also used to seed it.
+    gin_files: list of str, the learner's gin configuration files.
+    gin_bindings: list of str, the learner's gin bindings.
+    transitions: `TransitionQueue` receiving the finished episodes.
+    weights: `SharedWeights` holding the learner's online network.
+    episode_stats: `multiprocessing.Queue` receiving (length, return) pairs.
+    stop_event: `multiprocessing.Event` ending the actor.
+  """
+  # Actors only need forward passes; leave the accelerators to the learner.
+  os.environ['CUDA_VISIBLE_DEVICES'] = ''
+  random.seed(actor_id)
+  np.random.seed(actor_id)
+  # The configuration is finalized once parsed, so the actor overrides are
+  # appended to the learner's bindings.
+  run_experiment.load_gin_configs(
+      gin_files, list(gin_bindings) + run_experiment.WORKER_GIN_BINDINGS)
+
+  environment = run_experiment.create_environment()
+  obs_stacker = run_experiment.create_obs_stacker(environment)
+  agent = run_experiment.create_agent(environment, obs_stacker)
+  agent.eval_mode = False
+  agent.transition_sink = (
+      lambda *episode: transitions.put_episode(*episode,
+                                               stop_event=stop_event))
+
+  version = 0
+  while not stop_event.is_set():
+    if weights.version != version:
+      online_weights, version, agent.training_steps = weights.fetch()
+      agent.set_online_weights(online_weights)
+    episode_stats.put(
+        run_experiment.run_one_episode(agent, environment, obs_stacker))
+
+
+def start_actors(num_actors, gin_files, gin_bindings, transitions, weights,
+                 context):
+  """Starts the actor processes.
+
+  Args:
+    num_actors: int, number of actor processes.
+    gin_files: list of str, gin configuration files passed to the actors.
+    gin_bindings: list of str, gin bindings passed to the actors.
+    transitions: `TransitionQueue` the actors write to.
+    weights: `SharedWeights` the actors read from.
+    context: multiprocessing context.
+
+  Returns:
+    The list of processes, the episode statistics queue and the stop event.
+  """
+  episode_stats = context.Queue()
+  stop_event = context.Event()
+  actors = []
+  for actor_id in range(num_actors):
+    actor = context.Process(
+        target=_actor_main, name='actor-{}'.format(actor_id),
+        args=(actor_id, gin_files, gin_bindings, transitions, weights,
+              episode_stats, stop_event))
+    actor.start()
+    actors.append(actor)
+  return actors, episode_stats, stop_event
+
+
+def stop_actors(actors, transitions, stop_event, timeout=30.):
+  """Stops the actor processes, unblocking any waiting on a full queue."""
+  stop_event.set()
+  deadline = time.time() + timeout
+  for actor in actors:
+    while actor.is_alive() and time.time() < deadline:
+      transitions.get_all()
+      actor.join(0.1)
+    if actor.is_alive():
+      actor.terminate()
+
+
+def drain_transitions(agent, transitions):
+  """Moves all queued transitions into the agent's replay memory.
+
+  Returns:
+    int, the number of transitions added.
+  """
+  rows = transitions.get_all()
+  if rows is None:
+    return 0
+  agent.store_transitions(rows['observations'], rows['actions'],
+                          rows['rewards'], rows['terminals'],
+                          rows['legal_actions'])
+  return len(rows['actions'])
+
+
+@gin.configurable
+def run_learner_iteration(agent, evaluator, iteration, training_steps,
+                          transitions, weights, episode_stats,
+                          weight_broadcast_period=100,
+                          evaluate_every_n=100,
+                          num_evaluation_games=100):
+  """Runs one iteration of the learner.
+
+  The iteration ends after training_steps gradient updates. The returned
+  statistics have the same keys as `run_experiment.run_one_iteration`, with the
+  training episodes reported by the actors.
+
+  Args:
+    agent: The learning agent.
+    evaluator: `run_experiment.AsyncEvaluator` playing the evaluation games.
+      Evaluated iterations report -1 until `run_experiment.record_evaluations`
+      fills in the results.
+    iteration: int, current iteration number.
+    training_steps: int, number of gradient updates in this iteration.
+    transitions: `TransitionQueue` filled by the actors.
+    weights: `SharedWeights` read by the actors.
+    episode_stats: `multiprocessing.Queue` of the actors' (length, return).
+    weight_broadcast_period: int, gradient updates between weight broadcasts.
+    evaluate_every_n: int, frequency of evaluation.
+    num_evaluation_games: int, number of games per evaluation.
+
+  Returns:
+    A dict containing summary statistics for this iteration.
+  """
+  start_time = time.time()
+  statistics = iteration_statistics.IterationStatistics()
+
+  agent.eval_mode = False
+  number_steps = 0
+  number_transitions = 0
+  while number_steps < training_steps:
+    number_transitions += drain_transitions(agent, transitions)
+    if not agent.learner_step():
+      # Wait for the actors to fill the replay memory.
+      time.sleep(0.01)
+      continue
+    number_steps += 1
+    if number_steps % weight_broadcast_period == 0:
+      weights.publish(agent.get_online_weights(), agent.training_steps)
+  time_delta = time.time() - start_time
+  tf.logging.info('Average gradient updates per second: %.2f',
+                  number_steps / time_delta)
+  tf.logging.info('Average transitions received per second: %.2f',
+                  number_transitions / time_delta)
+
+  sum_returns = 0.
+  num_episodes = 0
+  while True:
+    try:
+      episode_length, episode_return = episode_stats.get_nowait()
+    except queue.Empty:
+      break
+    statistics.append({
+        'train_episode_lengths': episode_length,
+        'train_episode_returns': episode_return
+    })
+    sum_returns += episode_return
+    num_episodes += 1
+  average_return = sum_returns / max(num_episodes, 1)
+  tf.logging.info('Average per episode return: %.2f', average_return)
+  statistics.append({'average_return': average_return})
+
+  if evaluate_every_n is not None and iteration % evaluate_every_n == 0:
+    evaluator.submit(agent, iteration, num_evaluation_games)
+  statistics.append({
+      'eval_episode_lengths': -1,
+      'eval_episode_returns': -1
+  })
+
+  return statistics.data_lists
+
+
+@gin.configurable
+def run_distributed_experiment(agent,
+                               environment,
+                               start_iteration,
+                               obs_stacker,
+                               experiment_logger,
+                               experiment_checkpointer,
+                               checkpoint_dir,
+                               num_actors,
+                               gin_files,
+                               gin_bindings,
+                               num_iterations=200,
+                               training_steps=5000,
+                               logging_file_prefix='log',
+                               log_every_n=1,
+                               checkpoint_every_n=1,
+                               transition_queue_capacity=50000):
+  """Runs a full experiment with num_actors actor processes.
+
+  The calling process is the learner and owns the agent, its replay memory and
+  the checkpoints, as in `run_experiment.run_experiment`. An iteration is
+  training_steps gradient updates.
+  """
+  tf.logging.info('Beginning distributed training with %d actors...',
+                  num_actors)
+  if num_iterations <= start_iteration:
+    tf.logging.warning('num_iterations (%d) < start_iteration(%d)',
+                       num_iterations, start_iteration)
+    return
+
+  context = multiprocessing.get_context('spawn')
+  online_weights = agent.get_online_weights()
+  weights = SharedWeights([w.shape for w in online_weights], context)
+  weights.publish(online_weights, agent.training_steps)
+  transitions = TransitionQueue(transition_queue_capacity,
+                                agent.frame_size, agent.num_actions,
+                                context)
+  actors, episode_stats, stop_event = start_actors(
+      num_actors, gin_files, gin_bindings, transitions, weights, context)
+  evaluator = run_experiment.AsyncEvaluator()
+
+  try:
+    for iteration in range(start_iteration, num_iterations):
+      start_time = time.time()
+      statistics = run_learner_iteration(agent, evaluator, iteration,
+                                         training_steps, transitions, weights,
+                                         episode_stats)
+      tf.logging.info('Iteration %d took %d seconds', iteration,
+                      time.time() - start_time)
+      run_experiment.log_experiment(experiment_logger, iteration, statistics,
+                                    logging_file_prefix, log_every_n)
+      run_experiment.record_evaluations(experiment_logger, evaluator.collect())
+      run_experiment.checkpoint_experiment(
+          experiment_checkpointer, agent, experiment_logger, iteration,
+          checkpoint_dir, checkpoint_every_n)
+
+    # Wait for the last evaluations and write them out.
+    run_experiment.record_evaluations(experiment_logger,
+                                      evaluator.collect(block=True))
+    experiment_logger.log_to_file(logging_file_prefix, iteration)
+    evaluator.stop()
+  finally:
+    stop_actors(actors, transitions, stop_event)
@@ -100,6 +100,7 @@ class DQNAgent(object):
                min_replay_history=500,
                update_period=4,
                stack_size=1,
+               history_size=1,
                target_update_period=500,
                epsilon_fn=linearly_decaying_epsilon,
                epsilon_train=0.02,
@@ -126,6 +127,10 @@ class DQNAgent(object):
       min_replay_history: int, number of stored transitions before training.
       update_period: int, period between DQN updates.
       stack_size: int, number of observations to use as state.
+      history_size: int, number of frames the `ObservationStacker` stacks
+        into each observation. The replay memory stores single frames and
+        rebuilds the stacks when sampling, instead of storing every frame
+        history_size times.
       target_update_period: Update period for the target network.
       epsilon_fn: Function expecting 4 parameters: (decay_period, step,
         warmup_steps, epsilon), and which returns the epsilon value used for
@@ -146,6 +151,7 @@ class DQNAgent(object):
     tf.logging.info('\t update_horizon: %f', update_horizon)
     tf.logging.info('\t min_replay_history: %d', min_replay_history)
     tf.logging.info('\t update_period: %d', update_period)
+    tf.logging.info('\t history_size: %d', history_size)
     tf.logging.info('\t target_update_period: %d', target_update_period)
     tf.logging.info('\t epsilon_train: %f', epsilon_train)
     tf.logging.info('\t epsilon_eval: %f', epsilon_eval)
@@ -154,9 +160,16 @@ class DQNAgent(object):
     tf.logging.info('\t use_staging: %s', use_staging)
     tf.logging.info('\t optimizer: %s', optimizer)
 
+    if observation_size % history_size:
+      raise ValueError('Observation size {} is not a multiple of the history '
+                       'size {}.'.format(observation_size, history_size))
+
     # Global variables.
     self.num_actions = num_actions
     self.observation_size = observation_size
+    self.history_size = history_size
+    # Size of one frame of a stacked observation, as stored in the replay.
+    self.frame_size = observation_size // history_size
     self.num_players = num_players
     self.gamma = gamma
     self.update_horizon = update_horizon
@@ -172,6 +185,9 @@ class DQNAgent(object):
     self.training_steps = 0
     self.batch_staged = False
     self.optimizer = optimizer
+    # Optional, asynchronous game-state stream to Unity. Disabled (None) unless
+    # enabled via `create_telemetry_sink.enabled = True`.
+    self._telemetry = unity_comm.create_telemetry_sink()
 
     with tf.device(tf_device):
       # Calling online_convnet will generate a new graph as defined in
@@ -182,7 +198,7 @@ class DQNAgent(object):
       # The state of the agent. The last axis is the number of past observations
       # that make up the state.
       states_shape = (1, observation_size, stack_size)
-      self.state = np.zeros(states_shape)
+      self.state = np.zeros(states_shape, dtype=np.uint8)
       self.state_ph = tf.placeholder(tf.uint8, states_shape, name='state_ph')
       self.legal_actions_ph = tf.placeholder(tf.float32,
                                              [self.num_actions],
@@ -193,16 +209,31 @@ class DQNAgent(object):
       # support = tf.linspace(self._v_min, self._v_max, self._num_atoms)  # shape = [num_atoms]
       # q_values = tf.reduce_sum(tf.multiply(self._q, support), axis=2)   # shape = [batch_size, num_actions]
       self._q_values = self._q  
+      # Batched copy of the online network (shares weights) used to evaluate
+      # many observations, e.g. from concurrent games or clients, in a single
+      # forward pass.
+      self.batch_state_ph = tf.placeholder(
+          tf.uint8, (None, observation_size, stack_size), name='batch_state_ph')
+      self.batch_legal_actions_ph = tf.placeholder(
+          tf.float32, [None, self.num_actions], name='batch_legal_actions_ph')
+      self._batch_q = online_convnet(
+          state=self.batch_state_ph, num_actions=self.num_actions)
 
       self._replay = self._build_replay_memory(use_staging)
-      self._replay_qs = online_convnet(self._replay.states, self.num_actions)
-      self._replay_next_qt = target_convnet(self._replay.next_states,
-                                            self.num_actions)
+      self._replay_qs = online_convnet(
+          self._stacked_replay_states(self._replay.states), self.num_actions)
+      self._replay_next_qt = target_convnet(
+          self._stacked_replay_states(self._replay.next_states),
+          self.num_actions)
       self._train_op = self._build_train_op()
       self._sync_qt_ops = self._build_sync_op()
+      self._online_weights_phs, self._set_online_weights_op = (
+          self._build_set_online_weights_op())
 
       # self._q_values = self._build_networks()['q_values']  # ← これを追加
       self._q_argmax = tf.argmax(self._q + self.legal_actions_ph, axis=1)[0]
+      self._batch_q_argmax = tf.argmax(
+          self._batch_q + self.batch_legal_actions_ph, axis=1)
 
     # Set up a session and initialize variables.
     self._sess = tf.Session(
@@ -215,6 +246,11 @@ class DQNAgent(object):
     # This keeps tracks of the observed transitions during play, for each
     # player.
     self.transitions = [[] for _ in range(num_players)]
+    # If set, finished episodes are handed to this callable instead of being
+    # stored, and the agent never trains: it only acts, e.g. in an actor
+    # process of distributed.py. Called once per player episode with
+    # (observations, actions, rewards, terminals, legal_actions) arrays.
+    self.transition_sink = None
 
   def _build_replay_memory(self, use_staging):
     """Creates the replay memory used by the agent.
@@ -227,13 +263,29 @@ class DQNAgent(object):
     """
     return replay_memory.WrappedReplayMemory(
         num_actions=self.num_actions,
-        observation_size=self.observation_size,
+        observation_size=self.frame_size,
         batch_size=32,
-        stack_size=1,
+        stack_size=self.history_size,
         use_staging=use_staging,
         update_horizon=self.update_horizon,
         gamma=self.gamma)
 
+  def _stacked_replay_states(self, states):
+    """Lays out replay states like the stacked observations the agent acts on.
+
+    Args:
+      states: tensor of shape (batch_size, frame_size, history_size), frames
+        from oldest to newest, as sampled from the replay memory.
+
+    Returns:
+      The tensor of shape (batch_size, observation_size, 1) holding the frames
+      concatenated from oldest to newest, as `ObservationStacker` does.
+    """
+    if self.history_size == 1:
+      return states
+    states = tf.transpose(states, [0, 2, 1])
+    return tf.reshape(states, [-1, self.observation_size, 1])
+
   def _build_target_q_op(self):
     """Build an op to be used as a target for the Q-value.
 
@@ -288,6 +340,36 @@ class DQNAgent(object):
       sync_qt_ops.append(w_target.assign(w_online, use_locking=True))
     return sync_qt_ops
 
+  def _build_set_online_weights_op(self):
+    """Builds an op loading externally supplied online network weights.
+
+    Returns:
+      A list of placeholders, one per trainable online variable, and the op
+      assigning them.
+    """
+    placeholders = []
+    assign_ops = []
+    for variable in tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES,
+                                      scope='Online'):
+      placeholder = tf.placeholder(variable.dtype.base_dtype, variable.shape)
+      placeholders.append(placeholder)
+      assign_ops.append(variable.assign(placeholder))
+    return placeholders, tf.group(*assign_ops)
+
+  def get_online_weights(self):
+    """Returns the online network weights as a list of `np.array`."""
+    return self._sess.run(tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES,
+                                            scope='Online'))
+
+  def set_online_weights(self, weights):
+    """Loads online network weights returned by `get_online_weights`.
+
+    Args:
+      weights: list of `np.array`, in the order of `get_online_weights`.
+    """
+    self._sess.run(self._set_online_weights_op,
+                   dict(zip(self._online_weights_phs, weights)))
+
   def begin_episode(self, current_player, legal_actions, observation):
     """Returns the agent's first action.
 
@@ -338,8 +420,52 @@ class DQNAgent(object):
     """
     self._post_transitions(terminal_rewards=final_rewards)
 
+  def step_games(self, rewards, current_players, legal_actions, observations,
+                 begins, transitions):
+    """Chooses one action in each of several concurrent games.
+
+    Equivalent to calling `begin_episode` or `step` once per game, except that
+    all actions come from a single batched forward pass. Each game records its
+    transitions into its own buffers, which are posted with `end_game`.
+
+    Args:
+      rewards: list of floats, the reward each game's current player received
+        since their last action. Ignored where begins is True.
+      current_players: list of ints, the player whose turn it is in each game.
+      legal_actions: list of `np.array`, actions each current player can take.
+      observations: list of `np.array`, each current player's observation.
+      begins: list of bools, True where this is the player's first move.
+      transitions: list of per-game transition buffers, each holding one list
+        per player, like `self.transitions`.
+
+    Returns:
+      `np.array` of legal, int-valued actions, one per game.
+    """
+    # One training step per action, as in the single-game loop.
+    for _ in range(len(observations)):
+      self._train_step()
+
+    actions = self._select_actions(np.stack(observations),
+                                   np.stack(legal_actions))
+    for game, action in enumerate(actions):
+      reward = 0 if begins[game] else rewards[game]
+      self._record_transition(current_players[game], reward, observations[game],
+                              legal_actions[game], action, begin=begins[game],
+                              transitions=transitions[game])
+    return actions
+
+  def end_game(self, final_rewards, transitions):
+    """Signals the end of one of the games played with `step_games`.
+
+    Args:
+      final_rewards: `np.array`, the last rewards of each player in this game.
+      transitions: the game's transition buffers passed to `step_games`.
+    """
+    self._post_transitions(terminal_rewards=final_rewards,
+                           transitions=transitions)
+
   def _record_transition(self, current_player, reward, observation,
-                         legal_actions, action, begin=False):
+                         legal_actions, action, begin=False, transitions=None):
     """Records the most recent transition data.
 
     Specifically, the data consists of (r_t, o_{t+1}, l_{t+1}, a_{t+1}), where
@@ -355,39 +481,50 @@ class DQNAgent(object):
       legal_actions: `np.array`, legal actions from this state.
       action: int, the selected action.
       begin: bool, if True, this is the beginning of an episode.
+      transitions: per-player transition buffers to record into. Defaults to
+        `self.transitions`.
     """
-    self.transitions[current_player].append(
-        Transition(reward, np.array(observation, dtype=np.uint8, copy=True),
+    if transitions is None:
+      transitions = self.transitions
+    # Only the newest frame of the stacked observation goes to the replay.
+    frame = observation[len(observation) - self.frame_size:]
+    transitions[current_player].append(
+        Transition(reward, np.array(frame, dtype=np.uint8, copy=True),
                    np.array(legal_actions, dtype=np.float32, copy=True),
                    action, begin))
 
-  def _post_transitions(self, terminal_rewards):
+  def _post_transitions(self, terminal_rewards, transitions=None):
     """Posts this episode to the replay memory.
 
     Each player has their own episode, which is posted separately.
 
     Args:
       terminal_rewards: `np.array`,terminal rewards for each player.
+      transitions: per-player transition buffers to post. Defaults to
+        `self.transitions`.
     """
+    if transitions is None:
+      transitions = self.transitions
     # We store each player's episode consecutively in the replay memory.
     for player in range(self.num_players):
-      num_transitions = len(self.transitions[player])
-
-      for index, transition in enumerate(self.transitions[player]):
+      episode = transitions[player]
+      if episode:
         # Add: o_t, l_t, a_t, r_{t+1}, term_{t+1}
-        final_transition = index == num_transitions - 1
-        if final_transition:
-          reward = terminal_rewards[player]
-        else:
-          reward = self.transitions[player][index + 1].reward
-
-        self._store_transition(transition.observation, transition.action,
-                               reward, final_transition,
-                               transition.legal_actions)
+        episode_arrays = (
+            np.array([transition.observation for transition in episode]),
+            np.array([transition.action for transition in episode]),
+            np.array([transition.reward for transition in episode[1:]] +
+                     [terminal_rewards[player]]),
+            np.arange(len(episode)) == len(episode) - 1,
+            np.array([transition.legal_actions for transition in episode]))
+        if self.transition_sink is not None:
+          self.transition_sink(*episode_arrays)
+        elif not self.eval_mode:
+          self._replay.add_episode(*episode_arrays)
 
       # Now that this episode has been stored, drop it from the transitions
       # buffer.
-      self.transitions[player] = []
+      transitions[player] = []
 
   def _select_action(self, observation, legal_actions):
     """Select an action from the set of allowed actions.
@@ -413,7 +550,8 @@ class DQNAgent(object):
       # Choose a random action with probability epsilon.
       legal_action_indices = np.where(legal_actions == 0.0)
       action = np.random.choice(legal_action_indices[0])  # まず action を決める
-      unity_comm.send_to_unity(observation, legal_actions, action)
+      if self._telemetry is not None:
+        self._telemetry.publish(observation, legal_actions, action)
       # return np.random.choice(legal_action_indices[0]) #なぜかランダムアクションをまた設定して返している、もしかしたらUnity通信を行うときに自分で追加したかも？
       return action
 
@@ -428,46 +566,102 @@ class DQNAgent(object):
       action = self._sess.run(self._q_argmax,
                               {self.state_ph: self.state,
                                self.legal_actions_ph: legal_actions})
-      # Unity側へ送信
-      unity_comm.send_to_unity(observation, legal_actions, action)
+      # Unity側へ送信（テレメトリ有効時のみ・非同期）
+      if self._telemetry is not None:
+        self._telemetry.publish(observation, legal_actions, action)
       assert legal_actions[action] == 0.0, 'Expected legal action.'
-      q_values = self._sess.run(self._q_values, {
-        self.state_ph: self.state,
-        self.legal_actions_ph: legal_actions
-      })
-      # print(">>> Q values:", q_values[0])
       # print(">>> legal_actions shape:", legal_actions.shape)
       # print(">>> legal_actions sample:", legal_actions[:20])
       return action
 
-  def send_to_unity(self, observation, legal_actions, action):
-    import socket
-    import json
+  def _select_actions(self, observations, legal_actions):
+    """Selects actions for a batch of observations with one forward pass.
 
-    data = {
-        'observation': observation.tolist(),
-        'legal_actions': legal_actions.tolist(),
-        'action': int(action)
-    }
-    message = json.dumps(data)
+    Each row is explored independently with the same epsilon schedule as
+    `_select_action`; the remaining rows are answered greedily by a single
+    `sess.run` over the batched online network.
 
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect(('localhost', 50007))  # Unity側とポート番号合わせておく
-            s.sendall(message.encode('utf-8'))
-    except Exception as e:
-        print(f"通信エラー: {e}")
-
-  def send_to_unity(self, observation, legal_actions, action):
-    self._log_counter = getattr(self, '_log_counter', 2000)
-    if self._log_counter % 100 == 0:
-      print("=======================")
-      print("=== Unity送信テスト ===")
-      print("observation.shape:", observation.shape)
-      print("legal_actions:", legal_actions)
-      print("selected action:", action)
-      print("=======================")
-    self._log_counter += 1
+    Args:
+      observations: `np.array`, (batch_size, observation_size) observations.
+      legal_actions: `np.array`, (batch_size, num_actions) legal actions, with
+        -inf meaning not legal.
+
+    Returns:
+      actions: `np.array` of int, one legal action per row.
+    """
+    if self.eval_mode:
+      epsilon = self.epsilon_eval
+    else:
+      epsilon = self.epsilon_fn(self.epsilon_decay_period, self.training_steps,
+                                self.min_replay_history, self.epsilon_train)
+
+    observations = np.asarray(observations, dtype=np.uint8)
+    legal_actions = np.asarray(legal_actions, dtype=np.float32)
+    batch_size = observations.shape[0]
+    actions = np.empty(batch_size, dtype=np.int64)
+
+    explore = np.array([random.random() <= epsilon for _ in range(batch_size)],
+                       dtype=bool)
+    for row in np.nonzero(explore)[0]:
+      legal_action_indices = np.where(legal_actions[row] == 0.0)
+      actions[row] = np.random.choice(legal_action_indices[0])
+
+    greedy = np.nonzero(~explore)[0]
+    if greedy.size:
+      states = observations[greedy].reshape(
+          greedy.size, self.observation_size, -1)
+      actions[greedy] = self._sess.run(
+          self._batch_q_argmax,
+          {self.batch_state_ph: states,
+           self.batch_legal_actions_ph: legal_actions[greedy]})
+    if self._telemetry is not None:
+      for row in range(batch_size):
+        self._telemetry.publish(observations[row], legal_actions[row],
+                                actions[row])
+    return actions
+
+  def learner_step(self):
+    """Runs one gradient update for a learner that does not act itself.
+
+    Unlike `step`, every call trains, as `update_period` only paces updates
+    against acting. The target network is synced every
+    `target_update_period // update_period` updates, i.e. after as many
+    gradient updates as in single-process training. `training_steps` advances
+    by `update_period` per update, so it stays in agent steps for the epsilon
+    schedule. Nothing happens until the replay memory holds
+    `min_replay_history` transitions.
+
+    Returns:
+      bool, whether the update was run.
+    """
+    if self._replay.memory.add_count < self.min_replay_history:
+      return False
+    if not self.batch_staged:
+      for _ in range(self._replay.prefetch_depth):
+        self._sess.run(self._replay.prefetch_batch)
+      self.batch_staged = True
+    self._sess.run([self._train_op, self._replay.prefetch_batch])
+    updates = self.training_steps // self.update_period
+    if updates % max(self.target_update_period // self.update_period, 1) == 0:
+      self._sess.run(self._sync_qt_ops)
+    self.training_steps += self.update_period
+    return True
+
+  def store_transitions(self, observations, actions, rewards, terminals,
+                        legal_actions):
+    """Adds consecutive transitions, e.g. episodes from actors, to the replay.
+
+    Args:
+      observations: `np.array`, (n, frame_size) newest frames of the
+        observations.
+      actions: `np.array` of n ints.
+      rewards: `np.array` of n floats.
+      terminals: `np.array` of n bools.
+      legal_actions: `np.array`, (n, num_actions) legal actions, with -inf
+        meaning not legal.
+    """
+    self._replay.add_episode(observations, actions, rewards, terminals,
+                             legal_actions)
 
   def _train_step(self):
     """Runs a single training step.
@@ -479,13 +673,14 @@ class DQNAgent(object):
     Also, syncs weights from online to target network if training steps is a
     multiple of target update period.
     """
-    if self.eval_mode:
+    if self.eval_mode or self.transition_sink is not None:
       return
 
     # Run a training op.
     if (self._replay.memory.add_count >= self.min_replay_history and
         not self.batch_staged):
-      self._sess.run(self._replay.prefetch_batch)
+      for _ in range(self._replay.prefetch_depth):
+        self._sess.run(self._replay.prefetch_batch)
       self.batch_staged = True
     if (self._replay.memory.add_count > self.min_replay_history and
         self.training_steps % self.update_period == 0):
@@ -495,31 +690,6 @@ class DQNAgent(object):
       self._sess.run(self._sync_qt_ops)
     self.training_steps += 1
 
-  def _store_transition(self, observation, action, reward, is_terminal,
-                        legal_actions):
-    """Stores a transition during training mode.
-
-    Executes a tf session and executes replay memory ops in order to store the
-    following tuple in the replay buffer (last_observation, action, reward,
-    is_terminal).
-
-    Args:
-      observation: `np.array`, observation.
-      action: int, the action taken.
-      reward: float, the reward.
-      is_terminal: bool, indicating if the current state is a terminal state.
-      legal_actions: Legal actions from the current state.
-    """
-    if not self.eval_mode:
-      self._sess.run(
-          self._replay.add_transition_op, {
-              self._replay.add_obs_ph: observation,
-              self._replay.add_action_ph: action,
-              self._replay.add_reward_ph: reward,
-              self._replay.add_terminal_ph: is_terminal,
-              self._replay.add_legal_actions_ph: legal_actions
-          })
-
   def bundle_and_checkpoint(self, checkpoint_dir, iteration_number):
     """Returns a self-contained bundle of the agent's state.
 
@@ -537,11 +707,15 @@ class DQNAgent(object):
     """
     if not tf.gfile.Exists(checkpoint_dir):
       return None
+    # The replay snapshot is written in the background while the TensorFlow
+    # checkpoint is saved, but it must be complete before we return, because
+    # the caller then records this iteration as loadable.
+    self._replay.save(checkpoint_dir, iteration_number)
     self._saver.save(
         self._sess,
         os.path.join(checkpoint_dir, 'tf_ckpt'),
         global_step=iteration_number)
-    self._replay.save(checkpoint_dir, iteration_number)
+    self._replay.wait_for_save()
     bundle_dictionary = {}
     bundle_dictionary['state'] = self.state
     bundle_dictionary['eval_mode'] = self.eval_mode
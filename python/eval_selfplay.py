@@ -1,13 +1,27 @@
 # eval_selfplay.py（HLE 自己対戦・意図ログ併用／スコア計算を堅牢化）
 import argparse
+import multiprocessing
 import time
 import json
 import numpy as np
 
-# 既存の推論モジュール（Unity 連携のない純推論）を利用
-import inference
 from hanabi_learning_environment import rl_env
 
+# 既存の推論モジュール（Unity 連携のない純推論）は import 時にモデルを読むため、
+# 必要になった時点で読み込む（_inference() 経由）
+_INFERENCE = None
+
+# スコアの上限（Hanabi-Full: 5色 x 5ランク）。ヒストグラムのビン数に使う
+MAX_SCORE = 25
+
+
+def _inference():
+    global _INFERENCE
+    if _INFERENCE is None:
+        import inference
+        _INFERENCE = inference
+    return _INFERENCE
+
 
 # 0..19 の行動ID → 可読名（学習時の並びに合わせる）
 IDX2MOVE = [
@@ -26,10 +40,9 @@ def _legal_mask_from_obs(env, player_obs):
     """HLEの合法手を Rainbow 用マスク（合法=0.0 / 非合法=-inf）に変換。"""
     num_actions = env.num_moves()
     mask = np.full((num_actions,), -np.inf, dtype=np.float32)
-    legal = player_obs.get("legal_moves_as_int", [])
-    for a in legal:
-        if 0 <= a < num_actions:
-            mask[a] = 0.0
+    legal = np.asarray(player_obs.get("legal_moves_as_int", []), dtype=np.int64)
+    # 範囲外の uid は無視して一括で 0.0 を立てる
+    mask[legal[(legal >= 0) & (legal < num_actions)]] = 0.0
     return mask
 
 
@@ -40,8 +53,8 @@ def _obs_vector_from_player_obs(player_obs):
         v = np.asarray(player_obs["vectorized"], dtype=np.float32)
         return v
     # もし用意されていなければ、inference 側にエンコード関数がある前提で委譲（無い場合はエラー）
-    if hasattr(inference, "encode_observation"):
-        return np.asarray(inference.encode_observation(player_obs), dtype=np.float32)
+    if hasattr(_inference(), "encode_observation"):
+        return np.asarray(_inference().encode_observation(player_obs), dtype=np.float32)
     raise KeyError("player_obs に 'vectorized' がありません。環境設定かエンコーダをご確認ください。")
 
 
@@ -73,7 +86,7 @@ def play_one_game(env, verbose=False):
         legal_mask = _legal_mask_from_obs(env, pobs)
 
         # 推論（※ inference 側の行動選択ロジックを変更しない）
-        action_id = int(inference.predict_action(obs_vec, legal_mask))
+        action_id = int(_inference().predict_action(obs_vec, legal_mask))
 
         # HLE へ適用
         obs, reward, done, _ = env.step(action_id)
@@ -88,30 +101,131 @@ def play_one_game(env, verbose=False):
     return final_score
 
 
+def _load_policy(model_dir, backend):
+    """--model があれば推論専用モデル、無ければ inference の TF エージェントを使う。"""
+    if model_dir:
+        import exported_policy
+        return exported_policy.load_policy(model_dir, backend)
+    return _inference().policy
+
+
+def play_games_batched(policy, num_games, batch_size, environment_name, players):
+    """batch_size 個の env を同時進行させ、1 手ごとに 1 回のバッチ forward で行動を選ぶ。
+
+    終局した env はすぐに次のゲームを始め、num_games 局ぶんのスコアを返す。
+    """
+    batch_size = max(1, min(batch_size, num_games))
+    envs = [rl_env.make(environment_name=environment_name, num_players=players)
+            for _ in range(batch_size)]
+    observations = [env.reset() for env in envs]
+    started = batch_size
+    scores = []
+
+    active = list(range(batch_size))
+    while active:
+        pobs = [observations[i]["player_observations"][observations[i]["current_player"]]
+                for i in active]
+        states = np.stack([_obs_vector_from_player_obs(po) for po in pobs])
+        masks = np.stack([_legal_mask_from_obs(envs[i], po) for i, po in zip(active, pobs)])
+        actions, _ = policy.q_and_actions(states, masks)
+
+        still_active = []
+        for i, action_id in zip(active, actions):
+            observations[i], _, done, _ = envs[i].step(int(action_id))
+            if not done:
+                still_active.append(i)
+                continue
+            scores.append(_score_from_player_obs(observations[i]["player_observations"][0]))
+            if started < num_games:
+                observations[i] = envs[i].reset()
+                started += 1
+                still_active.append(i)
+        active = still_active
+    return scores
+
+
+def _eval_worker(args):
+    """ワーカープロセス：モデルを自前で読み込み、割り当て分のゲームを打つ。"""
+    model_dir, backend, num_games, batch_size, environment_name, players, seed = args
+    np.random.seed(seed)
+    policy = _load_policy(model_dir, backend)
+    return play_games_batched(policy, num_games, batch_size, environment_name, players)
+
+
+def summarize_scores(scores):
+    """平均・標準偏差・95% 信頼区間・スコアごとの度数をまとめる。"""
+    scores = np.asarray(scores, dtype=np.int64)
+    n = len(scores)
+    mean = float(scores.mean()) if n else 0.0
+    std = float(scores.std(ddof=1)) if n > 1 else 0.0
+    half_width = float(1.96 * std / np.sqrt(n)) if n > 1 else 0.0
+    histogram = np.bincount(np.clip(scores, 0, MAX_SCORE), minlength=MAX_SCORE + 1)
+    return {
+        "episodes": int(n),
+        "mean_score": mean,
+        "std_score": std,
+        "ci95": [mean - half_width, mean + half_width],
+        "min_score": int(scores.min()) if n else 0,
+        "max_score": int(scores.max()) if n else 0,
+        "perfect_rate": float(np.mean(scores == MAX_SCORE)) if n else 0.0,
+        "histogram": histogram.tolist(),
+    }
+
+
+def _print_histogram(histogram, width=50):
+    top = max(max(histogram), 1)
+    for score, count in enumerate(histogram):
+        if count:
+            print(f"  {score:2d} | {'#' * max(1, int(round(width * count / top))):<{width}} {count}")
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--episodes", type=int, default=100, help="評価ゲーム数")
     ap.add_argument("--players", type=int, default=2, help="プレイヤー人数（学習時と一致）")
-    ap.add_argument("--verbose", action="store_true", help="各手のログを出す")
+    ap.add_argument("--verbose", action="store_true", help="各手のログを出す（逐次評価になる）")
+    ap.add_argument("--log-moves", action="store_true",
+                    help="inference.predict_action で 1 手ずつ推論し [INTENT] ログを出す（逐次評価）")
+    ap.add_argument("--batch", type=int, default=256, help="同時進行させるゲーム数（ワーカーごと）")
+    ap.add_argument("--workers", type=int, default=1, help="評価ワーカープロセス数")
+    ap.add_argument("--model", default="",
+                    help="export_model.py の出力ディレクトリ（省略時は inference の TF エージェント）")
+    ap.add_argument("--backend", default="frozen",
+                    help="--model のバックエンド: frozen（既定・TF とビット一致）/ numpy（TF 不要・近似）")
     args = ap.parse_args()
 
-    # 学習時の設定に合わせる（フルルール / プレイヤー数）
-    env = rl_env.make(environment_name="Hanabi-Full", num_players=args.players)
-
-    scores = []
+    environment_name = "Hanabi-Full"
     t0 = time.time()
-    for ep in range(1, args.episodes + 1):
-        sc = play_one_game(env, verbose=args.verbose)
-        scores.append(sc)
-        print(f"[EVAL] episode {ep:3d}/{args.episodes}  score={sc}  avg={np.mean(scores):.2f}")
+
+    if args.verbose or args.log_moves:
+        # 従来の逐次評価（1 手ごとに predict_action、意図ログ付き）
+        # 学習時の設定に合わせる（フルルール / プレイヤー数）
+        env = rl_env.make(environment_name=environment_name, num_players=args.players)
+        scores = []
+        for ep in range(1, args.episodes + 1):
+            sc = play_one_game(env, verbose=args.verbose)
+            scores.append(sc)
+            print(f"[EVAL] episode {ep:3d}/{args.episodes}  score={sc}  avg={np.mean(scores):.2f}")
+    elif args.workers > 1:
+        # ゲーム数をワーカーに均等に割り振る（各ワーカーがモデルを読み込む）
+        shares = [args.episodes // args.workers + (w < args.episodes % args.workers)
+                  for w in range(args.workers)]
+        jobs = [(args.model, args.backend, n, args.batch, environment_name, args.players, w)
+                for w, n in enumerate(shares) if n > 0]
+        with multiprocessing.get_context("spawn").Pool(len(jobs)) as pool:
+            scores = [sc for part in pool.map(_eval_worker, jobs) for sc in part]
+    else:
+        policy = _load_policy(args.model, args.backend)
+        scores = play_games_batched(policy, args.episodes, args.batch,
+                                    environment_name, args.players)
 
     dt = time.time() - t0
-    print(json.dumps({
-        "episodes": args.episodes,
-        "mean_score": float(np.mean(scores) if scores else 0.0),
-        "std_score": float(np.std(scores) if scores else 0.0),
-        "elapsed_sec": round(dt, 1)
-    }, ensure_ascii=False))
+    summary = summarize_scores(scores)
+    summary["elapsed_sec"] = round(dt, 1)
+    summary["games_per_sec"] = round(len(scores) / dt, 1) if dt > 0 else 0.0
+    print("[EVAL] score histogram")
+    _print_histogram(summary["histogram"])
+    print(json.dumps(summary, ensure_ascii=False))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+# export_model.py（学習チェックポイント → 推論専用モデルの書き出し）
+#
+# 使い方:
+#   python export_model.py --checkpoint results/checkpoints/tf_ckpt-2150 --out results/export
+#
+# 出力（--out ディレクトリ）:
+#   model.json : 観測サイズ・行動数・アトム数・frozen graph の入出力テンソル名
+#   model.npz  : online ネットワーク（rainbow_template）の重み・バイアスと support
+#   model.pb   : online ネットワークの forward だけを定数化した GraphDef
+# 読み込みは exported_policy.load_policy(out, backend="frozen"（既定）/ "numpy"（近似）)。
+# 書き出し後、ランダムな観測で TF エージェントとの一致を確認して表示する。
+import argparse
+import json
+import os
+
+import gin
+import numpy as np
+import tensorflow as tf
+from hanabi_learning_environment import rl_env
+from rainbow_agent import RainbowAgent
+
+import exported_policy
+
+
+def _online_layers(agent):
+    """Online スコープの変数を [(weights, biases), ...]（入力側から順）に並べる。"""
+    variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="Online")
+    values = agent._sess.run(variables)
+    layers = []
+    for i in range(0, len(variables), 2):
+        w_name, b_name = variables[i].op.name, variables[i + 1].op.name
+        if not (w_name.endswith("/weights") and b_name.endswith("/biases")):
+            raise ValueError("想定外の変数並び: %s, %s" % (w_name, b_name))
+        layers.append((values[i], values[i + 1]))
+    return layers
+
+
+def export(agent, observation_size, out_dir, checkpoint):
+    os.makedirs(out_dir, exist_ok=True)
+
+    # --- NumPy 用: 重み + support ---
+    layers = _online_layers(agent)
+    arrays = {"num_layers": np.array(len(layers) - 1),
+              "support": agent._sess.run(agent.support)}
+    for i, (weights, biases) in enumerate(layers):
+        arrays["weights_%d" % i] = weights
+        arrays["biases_%d" % i] = biases
+    np.savez(os.path.join(out_dir, exported_policy.MODEL_NPZ), **arrays)
+
+    # --- frozen graph: バッチ推論の出力（argmax と期待Q）に必要な部分だけ定数化 ---
+    fetches = [agent._batch_q_argmax, agent._batch_q]
+    graph_def = tf.graph_util.convert_variables_to_constants(
+        agent._sess, agent._sess.graph.as_graph_def(),
+        [t.op.name for t in fetches])
+    for node in graph_def.node:
+        node.device = ""  # 学習時の '/gpu:0' 指定を外して CPU だけでも読めるようにする
+    with open(os.path.join(out_dir, exported_policy.MODEL_PB), "wb") as f:
+        f.write(graph_def.SerializeToString())
+
+    meta = {
+        "checkpoint": checkpoint,
+        "observation_size": int(observation_size),
+        "num_actions": int(agent.num_actions),
+        "num_atoms": int(agent.num_atoms),
+        "tensors": {
+            "state": agent.batch_state_ph.name,
+            "legal_actions": agent.batch_legal_actions_ph.name,
+            "action": agent._batch_q_argmax.name,
+            "q": agent._batch_q.name,
+        },
+    }
+    with open(os.path.join(out_dir, exported_policy.MODEL_JSON), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+def verify(agent, observation_size, out_dir, num_states, seed=0):
+    """ランダムな 0/1 観測と合法手マスクで TF エージェントと各バックエンドを比べる。"""
+    rng = np.random.RandomState(seed)
+    states = rng.randint(0, 2, size=(num_states, observation_size, 1)).astype(np.uint8)
+    masks = np.where(rng.rand(num_states, agent.num_actions) < 0.5, 0.0, -np.inf).astype(np.float32)
+    masks[np.arange(num_states), rng.randint(agent.num_actions, size=num_states)] = 0.0  # 最低 1 手は合法
+    actions, q = agent._sess.run(
+        [agent._batch_q_argmax, agent._batch_q],
+        {agent.batch_state_ph: states, agent.batch_legal_actions_ph: masks})
+
+    for backend in ("frozen", "numpy"):
+        policy = exported_policy.load_policy(out_dir, backend)
+        actions_b, q_b = policy.q_and_actions(states, masks)
+        print("[EXPORT] %-6s  action一致=%d/%d  Q完全一致=%s  max|dQ|=%.3g" % (
+            backend, int(np.sum(actions_b == actions)), num_states,
+            bool(np.array_equal(q_b, q)), float(np.max(np.abs(q_b - q)))))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--checkpoint", default="results/checkpoints/tf_ckpt-2150")
+    ap.add_argument("--gin", default="configs/hanabi_rainbow.gin")
+    ap.add_argument("--out", default="results/export")
+    ap.add_argument("--environment", default="Hanabi-Full")
+    ap.add_argument("--players", type=int, default=2)
+    ap.add_argument("--verify", type=int, default=1000, help="一致確認に使う観測数（0 で省略）")
+    args = ap.parse_args()
+
+    gin.parse_config_files_and_bindings([args.gin], bindings=[])
+    env = rl_env.make(environment_name=args.environment, num_players=args.players)
+    observation_size = env.vectorized_observation_shape()[0]
+    agent = RainbowAgent(num_actions=env.num_moves(),
+                         observation_size=observation_size,
+                         num_players=env.players)
+    agent._saver.restore(agent._sess, args.checkpoint)
+    agent.eval_mode = True
+
+    export(agent, observation_size, args.out, args.checkpoint)
+    print("[EXPORT] %s → %s" % (args.checkpoint, args.out))
+    if args.verify > 0:
+        verify(agent, observation_size, args.out, args.verify)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# exported_policy.py（export_model.py で書き出した推論専用モデルの実行系）
+#
+# 学習用の RainbowAgent（リプレイメモリ・ターゲットネット・Adam・py_func）を
+# 組み立てずに、online ネットワークの forward だけを行う。
+#   - FrozenGraphPolicy  : model.pb（変数を定数化した GraphDef）を TF で実行（既定）。
+#                          学習時と同じカーネルを通るので TF エージェントとビット一致
+#   - NumpyRainbowPolicy : model.npz を NumPy で計算（TensorFlow 不要、起動が速い）。
+#                          近似: Q 値が最下位ビットでずれ、argmax の同点が入れ替わることがある
+# どちらも q_and_actions(states, legal_masks) -> (actions, q) を持ち、
+# agent._sess.run([agent._batch_q_argmax, agent._batch_q], ...) と同じ値を返す
+# （numpy は上記の誤差の範囲で）。
+import json
+import os
+
+import numpy as np
+
+MODEL_JSON = "model.json"
+MODEL_NPZ = "model.npz"
+MODEL_PB = "model.pb"
+
+
+def load_metadata(export_dir):
+    """export_dir/model.json（観測サイズ・行動数・テンソル名など）を読む。"""
+    with open(os.path.join(export_dir, MODEL_JSON), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class NumpyRainbowPolicy(object):
+    """rainbow_template の MLP + 分布→期待Q 変換を NumPy で再現する（近似。TF とはビット一致しない）。"""
+
+    def __init__(self, export_dir):
+        meta = load_metadata(export_dir)
+        self.observation_size = int(meta["observation_size"])
+        self.num_actions = int(meta["num_actions"])
+        self.num_atoms = int(meta["num_atoms"])
+        with np.load(os.path.join(export_dir, MODEL_NPZ)) as data:
+            num_layers = int(data["num_layers"])
+            # 隠れ層 num_layers 枚 + 出力層 1 枚（weights: (in, out), biases: (out,)）
+            self._layers = [(data["weights_%d" % i].astype(np.float32),
+                             data["biases_%d" % i].astype(np.float32))
+                            for i in range(num_layers + 1)]
+            self._support = data["support"].astype(np.float32)
+
+    def q_values(self, states):
+        """states: (B, observation_size) または (B, observation_size, 1) の 0/1。"""
+        x = np.asarray(states).reshape(len(states), -1).astype(np.float32)
+        for weights, biases in self._layers[:-1]:
+            x = np.maximum(x.dot(weights) + biases, np.float32(0))
+        weights, biases = self._layers[-1]
+        logits = (x.dot(weights) + biases).reshape(-1, self.num_actions, self.num_atoms)
+        # tf.contrib.layers.softmax と同じく最大値を引いてから exp
+        logits = logits - logits.max(axis=2, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=2, keepdims=True)
+        return (probs * self._support).sum(axis=2)
+
+    def q_and_actions(self, states, legal_masks):
+        """legal_masks は加算マスク（合法=0.0 / 非合法=-inf）、形状 (B, num_actions)。"""
+        q = self.q_values(states)
+        actions = np.argmax(q + np.asarray(legal_masks, dtype=np.float32), axis=1)
+        return actions, q
+
+
+class FrozenGraphPolicy(object):
+    """model.pb を読み込み、専用の Graph/Session で forward だけを実行する。"""
+
+    def __init__(self, export_dir):
+        import tensorflow as tf  # frozen バックエンドを使うときだけ読み込む
+
+        meta = load_metadata(export_dir)
+        self.observation_size = int(meta["observation_size"])
+        self.num_actions = int(meta["num_actions"])
+        graph_def = tf.GraphDef()
+        with open(os.path.join(export_dir, MODEL_PB), "rb") as f:
+            graph_def.ParseFromString(f.read())
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            tf.import_graph_def(graph_def, name="")
+        tensors = meta["tensors"]
+        get = self._graph.get_tensor_by_name
+        self._state = get(tensors["state"])
+        self._legal_actions = get(tensors["legal_actions"])
+        self._fetches = [get(tensors["action"]), get(tensors["q"])]
+        self._sess = tf.Session(graph=self._graph)
+
+    def q_and_actions(self, states, legal_masks):
+        states = np.asarray(states, dtype=np.uint8).reshape(len(states), self.observation_size, 1)
+        actions, q = self._sess.run(
+            self._fetches,
+            {self._state: states,
+             self._legal_actions: np.asarray(legal_masks, dtype=np.float32)})
+        return actions, q
+
+
+def load_policy(export_dir, backend="frozen"):
+    """backend: "frozen"（既定・TF とビット一致）または "numpy"（TF 不要・近似）。"""
+    if backend == "numpy":
+        return NumpyRainbowPolicy(export_dir)
+    if backend == "frozen":
+        return FrozenGraphPolicy(export_dir)
+    raise ValueError("unknown backend: %s (numpy / frozen)" % backend)
@@ -15,10 +15,12 @@
 #include <algorithm>
 #include <cassert>
 #include <cstdlib>
+#include <cstring>
 #include <iostream>
 #include <vector>
 
 #include "canonical_encoders.h"
+#include "util.h"
 
 namespace hanabi_learning_env {
 
@@ -40,6 +42,37 @@ const HanabiHistoryItem* GetLastNonDealMove(
   return it == past_moves.end() ? nullptr : &(*it);
 }
 
+// Destinations for the section encoders below. The encoding starts out all
+// zero and the encoders only ever set single bits.
+class IntVectorWriter {
+ public:
+  explicit IntVectorWriter(std::vector<int>* encoding) : encoding_(encoding) {}
+  void Set(int index) { (*encoding_)[index] = 1; }
+
+ private:
+  std::vector<int>* encoding_;
+};
+
+// One byte (0 or 1) per bit.
+class ByteWriter {
+ public:
+  explicit ByteWriter(uint8_t* encoding) : encoding_(encoding) {}
+  void Set(int index) { encoding_[index] = 1; }
+
+ private:
+  uint8_t* encoding_;
+};
+
+// Eight bits per byte, most significant bit first (numpy.packbits order).
+class PackedBitWriter {
+ public:
+  explicit PackedBitWriter(uint8_t* encoding) : encoding_(encoding) {}
+  void Set(int index) { encoding_[index >> 3] |= 0x80 >> (index & 7); }
+
+ private:
+  uint8_t* encoding_;
+};
+
 int BitsPerCard(const HanabiGame& game) {
   return game.NumColors() * game.NumRanks();
 }
@@ -54,56 +87,86 @@ int HandsSectionLength(const HanabiGame& game) {
          game.NumPlayers();
 }
 
+// Encodes the cards of one other player's hand, one-hot per card, leaving
+// the bits of absent cards empty. Returns the number of entries covered
+// (<hand_size> * <num_colors> * <num_ranks>).
+template <class Writer>
+int EncodeHandCards(const HanabiGame& game, const HanabiHand& hand,
+                    int start_offset, Writer* encoding) {
+  int bits_per_card = BitsPerCard(game);
+  int num_ranks = game.NumRanks();
+  int hand_size = game.HandSize();
+
+  int offset = start_offset;
+  const std::vector<HanabiCard>& cards = hand.Cards();
+  int num_cards = 0;
+
+  for (const HanabiCard& card : cards) {
+    // Only a player's own cards can be invalid/unobserved.
+    assert(card.IsValid());
+    assert(card.Color() < game.NumColors());
+    assert(card.Rank() < num_ranks);
+    encoding->Set(offset + CardIndex(card.Color(), card.Rank(), num_ranks));
+
+    ++num_cards;
+    offset += bits_per_card;
+  }
+
+  // A player's hand can have fewer cards than the initial hand size.
+  // Leave the bits for the absent cards empty (adjust the offset to skip
+  // bits for the missing cards).
+  if (num_cards < hand_size) {
+    offset += (hand_size - num_cards) * bits_per_card;
+  }
+  return offset - start_offset;
+}
+
+// For each player, set a bit if their hand is missing a card. Bit i describes
+// hands[(observer + i) % num_players], so observer is 0 for the already
+// observer-relative hands of a HanabiObservation.
+// Returns the number of entries covered (<num_players>).
+template <class Writer>
+int EncodeMissingCards(const HanabiGame& game,
+                       const std::vector<HanabiHand>& hands, int observer,
+                       int start_offset, Writer* encoding) {
+  int num_players = game.NumPlayers();
+  for (int player = 0; player < num_players; ++player) {
+    const HanabiHand& hand = hands[(observer + player) % num_players];
+    if (hand.Cards().size() < game.HandSize()) {
+      encoding->Set(start_offset + player);
+    }
+  }
+  return game.NumPlayers();
+}
+
 // Enocdes cards in all other player's hands (excluding our unknown hand),
 // and whether the hand is missing a card for all players (when deck is empty.)
 // Each card in a hand is encoded with a one-hot representation using
 // <num_colors> * <num_ranks> bits (25 bits in a standard game) per card.
 // Returns the number of entries written to the encoding.
+template <class Writer>
 int EncodeHands(const HanabiGame& game, const HanabiObservation& obs,
-                int start_offset, std::vector<int>* encoding) {
-  int bits_per_card = BitsPerCard(game);
-  int num_ranks = game.NumRanks();
+                int start_offset, Writer* encoding) {
   int num_players = game.NumPlayers();
-  int hand_size = game.HandSize();
 
   int offset = start_offset;
   const std::vector<HanabiHand>& hands = obs.Hands();
   assert(hands.size() == num_players);
   for (int player = 1; player < num_players; ++player) {
-    const std::vector<HanabiCard>& cards = hands[player].Cards();
-    int num_cards = 0;
-
-    for (const HanabiCard& card : cards) {
-      // Only a player's own cards can be invalid/unobserved.
-      assert(card.IsValid());
-      assert(card.Color() < game.NumColors());
-      assert(card.Rank() < num_ranks);
-      (*encoding)[offset + CardIndex(card.Color(), card.Rank(), num_ranks)] = 1;
-
-      ++num_cards;
-      offset += bits_per_card;
-    }
-
-    // A player's hand can have fewer cards than the initial hand size.
-    // Leave the bits for the absent cards empty (adjust the offset to skip
-    // bits for the missing cards).
-    if (num_cards < hand_size) {
-      offset += (hand_size - num_cards) * bits_per_card;
-    }
+    offset += EncodeHandCards(game, hands[player], offset, encoding);
   }
-
-  // For each player, set a bit if their hand is missing a card.
-  for (int player = 0; player < num_players; ++player) {
-    if (hands[player].Cards().size() < game.HandSize()) {
-      (*encoding)[offset + player] = 1;
-    }
-  }
-  offset += num_players;
+  offset += EncodeMissingCards(game, hands, 0, offset, encoding);
 
   assert(offset - start_offset == HandsSectionLength(game));
   return offset - start_offset;
 }
 
+// The board and discard encoders below read either a HanabiObservation or,
+// for the incremental encoder, the HanabiState directly. Only the deck size
+// is spelled differently.
+int DeckSize(const HanabiObservation& obs) { return obs.DeckSize(); }
+int DeckSize(const HanabiState& state) { return state.Deck().Size(); }
+
 int BoardSectionLength(const HanabiGame& game) {
   return game.MaxDeckSize() - game.NumPlayers() * game.HandSize() +  // deck
          game.NumColors() * game.NumRanks() +  // fireworks
@@ -120,8 +183,9 @@ int BoardSectionLength(const HanabiGame& game) {
 // We note several features use a thermometer representation instead of one-hot.
 // For example, life tokens could be: 000 (0), 100 (1), 110 (2), 111 (3).
 // Returns the number of entries written to the encoding.
-int EncodeBoard(const HanabiGame& game, const HanabiObservation& obs,
-                int start_offset, std::vector<int>* encoding) {
+template <class Writer, class Observation>
+int EncodeBoard(const HanabiGame& game, const Observation& obs,
+                int start_offset, Writer* encoding) {
   int num_colors = game.NumColors();
   int num_ranks = game.NumRanks();
   int num_players = game.NumPlayers();
@@ -130,8 +194,8 @@ int EncodeBoard(const HanabiGame& game, const HanabiObservation& obs,
 
   int offset = start_offset;
   // Encode the deck size
-  for (int i = 0; i < obs.DeckSize(); ++i) {
-    (*encoding)[offset + i] = 1;
+  for (int i = 0; i < DeckSize(obs); ++i) {
+    encoding->Set(offset + i);
   }
   offset += (max_deck_size - hand_size * num_players);  // 40 in normal 2P game
 
@@ -141,7 +205,7 @@ int EncodeBoard(const HanabiGame& game, const HanabiObservation& obs,
     // fireworks[color] is the number of successfully played <color> cards.
     // If some were played, one-hot encode the highest (0-indexed) rank played
     if (fireworks[c] > 0) {
-      (*encoding)[offset + fireworks[c] - 1] = 1;
+      encoding->Set(offset + fireworks[c] - 1);
     }
     offset += num_ranks;
   }
@@ -150,7 +214,7 @@ int EncodeBoard(const HanabiGame& game, const HanabiObservation& obs,
   assert(obs.InformationTokens() >= 0);
   assert(obs.InformationTokens() <= game.MaxInformationTokens());
   for (int i = 0; i < obs.InformationTokens(); ++i) {
-    (*encoding)[offset + i] = 1;
+    encoding->Set(offset + i);
   }
   offset += game.MaxInformationTokens();
 
@@ -158,7 +222,7 @@ int EncodeBoard(const HanabiGame& game, const HanabiObservation& obs,
   assert(obs.LifeTokens() >= 0);
   assert(obs.LifeTokens() <= game.MaxLifeTokens());
   for (int i = 0; i < obs.LifeTokens(); ++i) {
-    (*encoding)[offset + i] = 1;
+    encoding->Set(offset + i);
   }
   offset += game.MaxLifeTokens();
 
@@ -185,13 +249,14 @@ int DiscardSectionLength(const HanabiGame& game) { return game.MaxDeckSize(); }
 //   - one of the second highest rank have been discarded
 //   - the highest rank card has been discarded
 // Returns the number of entries written to the encoding.
-int EncodeDiscards(const HanabiGame& game, const HanabiObservation& obs,
-                   int start_offset, std::vector<int>* encoding) {
+template <class Writer, class Observation>
+int EncodeDiscards(const HanabiGame& game, const Observation& obs,
+                   int start_offset, Writer* encoding) {
   int num_colors = game.NumColors();
   int num_ranks = game.NumRanks();
 
   int offset = start_offset;
-  std::vector<int> discard_counts(num_colors * num_ranks, 0);
+  int discard_counts[kMaxNumColors * kMaxNumRanks] = {0};
   for (const HanabiCard& card : obs.DiscardPile()) {
     ++discard_counts[card.Color() * num_ranks + card.Rank()];
   }
@@ -200,7 +265,7 @@ int EncodeDiscards(const HanabiGame& game, const HanabiObservation& obs,
     for (int r = 0; r < num_ranks; ++r) {
       int num_discarded = discard_counts[c * num_ranks + r];
       for (int i = 0; i < num_discarded; ++i) {
-        (*encoding)[offset + i] = 1;
+        encoding->Set(offset + i);
       }
       offset += game.NumberCardInstances(c, r);
     }
@@ -232,16 +297,18 @@ int LastActionSectionLength(const HanabiGame& game) {
 //  - Reveal outcome (<hand_size> bits; each bit is 1 if the card was hinted at)
 //  - Position played/discarded (<hand_size> bits; one-hot)
 //  - Card played/discarded (<num_colors> * <num_ranks> bits; one-hot)
+// last_move is observer-relative, or nullptr before the first player action.
 // Returns the number of entries written to the encoding.
-int EncodeLastAction(const HanabiGame& game, const HanabiObservation& obs,
-                     int start_offset, std::vector<int>* encoding) {
+template <class Writer>
+int EncodeLastAction(const HanabiGame& game,
+                     const HanabiHistoryItem* last_move, int start_offset,
+                     Writer* encoding) {
   int num_colors = game.NumColors();
   int num_ranks = game.NumRanks();
   int num_players = game.NumPlayers();
   int hand_size = game.HandSize();
 
   int offset = start_offset;
-  const HanabiHistoryItem* last_move = GetLastNonDealMove(obs.LastMoves());
   if (last_move == nullptr) {
     offset += LastActionSectionLength(game);
   } else {
@@ -250,22 +317,22 @@ int EncodeLastAction(const HanabiGame& game, const HanabiObservation& obs,
     // player_id
     // Note: no assertion here. At a terminal state, the last player could have
     // been me (player id 0).
-    (*encoding)[offset + last_move->player] = 1;
+    encoding->Set(offset + last_move->player);
     offset += num_players;
 
     // move type
     switch (last_move_type) {
       case HanabiMove::Type::kPlay:
-        (*encoding)[offset] = 1;
+        encoding->Set(offset);
         break;
       case HanabiMove::Type::kDiscard:
-        (*encoding)[offset + 1] = 1;
+        encoding->Set(offset + 1);
         break;
       case HanabiMove::Type::kRevealColor:
-        (*encoding)[offset + 2] = 1;
+        encoding->Set(offset + 2);
         break;
       case HanabiMove::Type::kRevealRank:
-        (*encoding)[offset + 3] = 1;
+        encoding->Set(offset + 3);
         break;
       default:
         std::abort();
@@ -277,19 +344,19 @@ int EncodeLastAction(const HanabiGame& game, const HanabiObservation& obs,
         last_move_type == HanabiMove::Type::kRevealRank) {
       int8_t observer_relative_target =
           (last_move->player + last_move->move.TargetOffset()) % num_players;
-      (*encoding)[offset + observer_relative_target] = 1;
+      encoding->Set(offset + observer_relative_target);
     }
     offset += num_players;
 
     // color (if hint action)
     if (last_move_type == HanabiMove::Type::kRevealColor) {
-      (*encoding)[offset + last_move->move.Color()] = 1;
+      encoding->Set(offset + last_move->move.Color());
     }
     offset += num_colors;
 
     // rank (if hint action)
     if (last_move_type == HanabiMove::Type::kRevealRank) {
-      (*encoding)[offset + last_move->move.Rank()] = 1;
+      encoding->Set(offset + last_move->move.Rank());
     }
     offset += num_ranks;
 
@@ -298,7 +365,7 @@ int EncodeLastAction(const HanabiGame& game, const HanabiObservation& obs,
         last_move_type == HanabiMove::Type::kRevealRank) {
       for (int i = 0, mask = 1; i < hand_size; ++i, mask <<= 1) {
         if ((last_move->reveal_bitmask & mask) > 0) {
-          (*encoding)[offset + i] = 1;
+          encoding->Set(offset + i);
         }
       }
     }
@@ -307,7 +374,7 @@ int EncodeLastAction(const HanabiGame& game, const HanabiObservation& obs,
     // position (if play or discard action)
     if (last_move_type == HanabiMove::Type::kPlay ||
         last_move_type == HanabiMove::Type::kDiscard) {
-      (*encoding)[offset + last_move->move.CardIndex()] = 1;
+      encoding->Set(offset + last_move->move.CardIndex());
     }
     offset += hand_size;
 
@@ -316,18 +383,18 @@ int EncodeLastAction(const HanabiGame& game, const HanabiObservation& obs,
         last_move_type == HanabiMove::Type::kDiscard) {
       assert(last_move->color >= 0);
       assert(last_move->rank >= 0);
-      (*encoding)[offset +
-                  CardIndex(last_move->color, last_move->rank, num_ranks)] = 1;
+      encoding->Set(offset +
+                    CardIndex(last_move->color, last_move->rank, num_ranks));
     }
     offset += BitsPerCard(game);
 
     // was successful and/or added information token (if play action)
     if (last_move_type == HanabiMove::Type::kPlay) {
       if (last_move->scored) {
-        (*encoding)[offset] = 1;
+        encoding->Set(offset);
       }
       if (last_move->information_token) {
-        (*encoding)[offset + 1] = 1;
+        encoding->Set(offset + 1);
       }
     }
     offset += 2;
@@ -342,6 +409,57 @@ int CardKnowledgeSectionLength(const HanabiGame& game) {
          (BitsPerCard(game) + game.NumColors() + game.NumRanks());
 }
 
+// Encodes the card knowledge of one hand, as described for
+// EncodeCardKnowledge below. Returns the number of entries covered
+// (<hand_size> * (<num_colors> * <num_ranks> + <num_colors> + <num_ranks>)).
+template <class Writer>
+int EncodeHandKnowledge(const HanabiGame& game, const HanabiHand& hand,
+                        int start_offset, Writer* encoding) {
+  int bits_per_card = BitsPerCard(game);
+  int num_colors = game.NumColors();
+  int num_ranks = game.NumRanks();
+  int hand_size = game.HandSize();
+
+  int offset = start_offset;
+  const std::vector<HanabiHand::CardKnowledge>& knowledge = hand.Knowledge();
+  int num_cards = 0;
+
+  for (const HanabiHand::CardKnowledge& card_knowledge : knowledge) {
+    // Add bits for plausible card.
+    for (int color = 0; color < num_colors; ++color) {
+      if (card_knowledge.ColorPlausible(color)) {
+        for (int rank = 0; rank < num_ranks; ++rank) {
+          if (card_knowledge.RankPlausible(rank)) {
+            encoding->Set(offset + CardIndex(color, rank, num_ranks));
+          }
+        }
+      }
+    }
+    offset += bits_per_card;
+
+    // Add bits for explicitly revealed colors and ranks.
+    if (card_knowledge.ColorHinted()) {
+      encoding->Set(offset + card_knowledge.Color());
+    }
+    offset += num_colors;
+    if (card_knowledge.RankHinted()) {
+      encoding->Set(offset + card_knowledge.Rank());
+    }
+    offset += num_ranks;
+
+    ++num_cards;
+  }
+
+  // A player's hand can have fewer cards than the initial hand size.
+  // Leave the bits for the absent cards empty (adjust the offset to skip
+  // bits for the missing cards).
+  if (num_cards < hand_size) {
+    offset +=
+        (hand_size - num_cards) * (bits_per_card + num_colors + num_ranks);
+  }
+  return offset - start_offset;
+}
+
 // Encode the common card knowledge.
 // For each card/position in each player's hand, including the observing player,
 // encode the possible cards that could be in that position and whether the
@@ -363,91 +481,244 @@ int CardKnowledgeSectionLength(const HanabiGame& game) {
 // Uses <num_players> * <hand_size> *
 // (<num_colors> * <num_ranks> + <num_colors> + <num_ranks>) bits.
 // Returns the number of entries written to the encoding.
+template <class Writer>
 int EncodeCardKnowledge(const HanabiGame& game, const HanabiObservation& obs,
-                        int start_offset, std::vector<int>* encoding) {
-  int bits_per_card = BitsPerCard(game);
-  int num_colors = game.NumColors();
-  int num_ranks = game.NumRanks();
+                        int start_offset, Writer* encoding) {
   int num_players = game.NumPlayers();
-  int hand_size = game.HandSize();
 
   int offset = start_offset;
   const std::vector<HanabiHand>& hands = obs.Hands();
   assert(hands.size() == num_players);
   for (int player = 0; player < num_players; ++player) {
-    const std::vector<HanabiHand::CardKnowledge>& knowledge =
-        hands[player].Knowledge();
-    int num_cards = 0;
-
-    for (const HanabiHand::CardKnowledge& card_knowledge : knowledge) {
-      // Add bits for plausible card.
-      for (int color = 0; color < num_colors; ++color) {
-        if (card_knowledge.ColorPlausible(color)) {
-          for (int rank = 0; rank < num_ranks; ++rank) {
-            if (card_knowledge.RankPlausible(rank)) {
-              (*encoding)[offset + CardIndex(color, rank, num_ranks)] = 1;
-            }
-          }
-        }
-      }
-      offset += bits_per_card;
-
-      // Add bits for explicitly revealed colors and ranks.
-      if (card_knowledge.ColorHinted()) {
-        (*encoding)[offset + card_knowledge.Color()] = 1;
-      }
-      offset += num_colors;
-      if (card_knowledge.RankHinted()) {
-        (*encoding)[offset + card_knowledge.Rank()] = 1;
-      }
-      offset += num_ranks;
-
-      ++num_cards;
-    }
-
-    // A player's hand can have fewer cards than the initial hand size.
-    // Leave the bits for the absent cards empty (adjust the offset to skip
-    // bits for the missing cards).
-    if (num_cards < hand_size) {
-      offset +=
-          (hand_size - num_cards) * (bits_per_card + num_colors + num_ranks);
-    }
+    offset += EncodeHandKnowledge(game, hands[player], offset, encoding);
   }
 
   assert(offset - start_offset == CardKnowledgeSectionLength(game));
   return offset - start_offset;
 }
 
+// Total number of bits in the encoding.
+int EncodingLength(const HanabiGame& game) {
+  return HandsSectionLength(game) + BoardSectionLength(game) +
+         DiscardSectionLength(game) + LastActionSectionLength(game) +
+         (game.ObservationType() == HanabiGame::kMinimal
+              ? 0
+              : CardKnowledgeSectionLength(game));
+}
+
+// Writes all sections of the encoding, which must be zero-initialized.
+template <class Writer>
+int EncodeSections(const HanabiGame& game, const HanabiObservation& obs,
+                   Writer* encoding) {
+  // This offset is an index to the start of each section of the bit vector.
+  // It is incremented at the end of each section.
+  int offset = 0;
+  offset += EncodeHands(game, obs, offset, encoding);
+  offset += EncodeBoard(game, obs, offset, encoding);
+  offset += EncodeDiscards(game, obs, offset, encoding);
+  offset += EncodeLastAction(game, GetLastNonDealMove(obs.LastMoves()), offset,
+                             encoding);
+  if (game.ObservationType() != HanabiGame::kMinimal) {
+    offset += EncodeCardKnowledge(game, obs, offset, encoding);
+  }
+  return offset;
+}
+
 }  // namespace
 
 std::vector<int> CanonicalObservationEncoder::Shape() const {
-  return {HandsSectionLength(*parent_game_) +
-          BoardSectionLength(*parent_game_) +
-          DiscardSectionLength(*parent_game_) +
-          LastActionSectionLength(*parent_game_) +
-          (parent_game_->ObservationType() == HanabiGame::kMinimal
-               ? 0
-               : CardKnowledgeSectionLength(*parent_game_))};
+  return {EncodingLength(*parent_game_)};
 }
 
 std::vector<int> CanonicalObservationEncoder::Encode(
     const HanabiObservation& obs) const {
   // Make an empty bit string of the proper size.
   std::vector<int> encoding(FlatLength(Shape()), 0);
+  IntVectorWriter writer(&encoding);
+  int length = EncodeSections(*parent_game_, obs, &writer);
+  assert(length == encoding.size());
+  return encoding;
+}
 
-  // This offset is an index to the start of each section of the bit vector.
-  // It is incremented at the end of each section.
-  int offset = 0;
-  offset += EncodeHands(*parent_game_, obs, offset, &encoding);
-  offset += EncodeBoard(*parent_game_, obs, offset, &encoding);
-  offset += EncodeDiscards(*parent_game_, obs, offset, &encoding);
-  offset += EncodeLastAction(*parent_game_, obs, offset, &encoding);
-  if (parent_game_->ObservationType() != HanabiGame::kMinimal) {
-    offset += EncodeCardKnowledge(*parent_game_, obs, offset, &encoding);
+int CanonicalObservationEncoder::EncodedBytes(bool packed) const {
+  int length = EncodingLength(*parent_game_);
+  return packed ? (length + 7) / 8 : length;
+}
+
+void CanonicalObservationEncoder::EncodeInto(const HanabiObservation& obs,
+                                             uint8_t* encoding,
+                                             bool packed) const {
+  std::memset(encoding, 0, EncodedBytes(packed));
+  if (packed) {
+    PackedBitWriter writer(encoding);
+    EncodeSections(*parent_game_, obs, &writer);
+  } else {
+    ByteWriter writer(encoding);
+    EncodeSections(*parent_game_, obs, &writer);
   }
+}
 
-  assert(offset == encoding.size());
-  return encoding;
+IncrementalObservationEncoder::IncrementalObservationEncoder(
+    const HanabiGame* parent_game, int observer)
+    : parent_game_(parent_game),
+      full_encoder_(parent_game),
+      observer_(observer),
+      last_move_(HanabiMove(HanabiMove::kInvalid, -1, -1, -1, -1)) {
+  REQUIRE(observer >= 0 && observer < parent_game->NumPlayers());
+  // The dirty hand masks hold one bit per player.
+  REQUIRE(parent_game->NumPlayers() <= 32);
+  const HanabiGame& game = *parent_game;
+  board_offset_ = HandsSectionLength(game);
+  discards_offset_ = board_offset_ + BoardSectionLength(game);
+  last_action_offset_ = discards_offset_ + DiscardSectionLength(game);
+  knowledge_offset_ = last_action_offset_ + LastActionSectionLength(game);
+  hand_bits_ = game.HandSize() * BitsPerCard(game);
+  knowledge_bits_ = game.HandSize() *
+                    (BitsPerCard(game) + game.NumColors() + game.NumRanks());
+  Reset();
+}
+
+void IncrementalObservationEncoder::Reset() {
+  encoding_.assign(EncodingLength(*parent_game_), 0);
+  num_moves_seen_ = 0;
+  has_last_move_ = false;
+  uint32_t all_players = (1u << parent_game_->NumPlayers()) - 1;
+  dirty_hands_ = all_players;
+  dirty_knowledge_ = all_players;
+  dirty_board_ = true;
+  dirty_discards_ = true;
+  dirty_last_action_ = true;
+}
+
+int IncrementalObservationEncoder::RelativePlayer(int player) const {
+  int num_players = parent_game_->NumPlayers();
+  return (player - observer_ + num_players) % num_players;
+}
+
+void IncrementalObservationEncoder::ApplyMove(const HanabiHistoryItem& item) {
+  switch (item.move.MoveType()) {
+    case HanabiMove::kDeal: {
+      // A new card and its knowledge, and a smaller deck.
+      uint32_t player_bit = 1u << RelativePlayer(item.deal_to_player);
+      dirty_hands_ |= player_bit;
+      dirty_knowledge_ |= player_bit;
+      dirty_board_ = true;
+      return;
+    }
+    case HanabiMove::kPlay:
+    case HanabiMove::kDiscard: {
+      // The remaining cards of the hand shift down one slot.
+      uint32_t player_bit = 1u << RelativePlayer(item.player);
+      dirty_hands_ |= player_bit;
+      dirty_knowledge_ |= player_bit;
+      dirty_discards_ = true;
+      break;
+    }
+    case HanabiMove::kRevealColor:
+    case HanabiMove::kRevealRank: {
+      int num_players = parent_game_->NumPlayers();
+      int target = (item.player + item.move.TargetOffset()) % num_players;
+      dirty_knowledge_ |= 1u << RelativePlayer(target);
+      break;
+    }
+    default:
+      std::abort();
+  }
+  // Every player move changes the tokens or the fireworks, and is the new
+  // last action.
+  dirty_board_ = true;
+  dirty_last_action_ = true;
+  last_move_ = item;
+  last_move_.player = RelativePlayer(item.player);
+  has_last_move_ = true;
+}
+
+const std::vector<uint8_t>& IncrementalObservationEncoder::Encode(
+    const HanabiState& state) {
+  const HanabiGame& game = *parent_game_;
+  int num_players = game.NumPlayers();
+
+  const std::vector<HanabiHistoryItem>& history = state.MoveHistory();
+  REQUIRE(history.size() >= num_moves_seen_);
+  for (int i = num_moves_seen_; i < history.size(); ++i) {
+    ApplyMove(history[i]);
+  }
+  num_moves_seen_ = history.size();
+
+  // Each dirty section is cleared, then encoded like a fresh encoding.
+  ByteWriter writer(encoding_.data());
+  const std::vector<HanabiHand>& hands = state.Hands();
+  if (dirty_hands_ != 0) {
+    for (int player = 1; player < num_players; ++player) {
+      if (dirty_hands_ & (1u << player)) {
+        int offset = (player - 1) * hand_bits_;
+        std::memset(encoding_.data() + offset, 0, hand_bits_);
+        EncodeHandCards(game, hands[(observer_ + player) % num_players],
+                        offset, &writer);
+      }
+    }
+    // Any hand may have changed size.
+    int offset = (num_players - 1) * hand_bits_;
+    std::memset(encoding_.data() + offset, 0, num_players);
+    EncodeMissingCards(game, hands, observer_, offset, &writer);
+  }
+  if (dirty_board_) {
+    std::memset(encoding_.data() + board_offset_, 0, BoardSectionLength(game));
+    EncodeBoard(game, state, board_offset_, &writer);
+  }
+  if (dirty_discards_) {
+    std::memset(encoding_.data() + discards_offset_, 0,
+                DiscardSectionLength(game));
+    EncodeDiscards(game, state, discards_offset_, &writer);
+  }
+  if (dirty_last_action_) {
+    std::memset(encoding_.data() + last_action_offset_, 0,
+                LastActionSectionLength(game));
+    EncodeLastAction(game, has_last_move_ ? &last_move_ : nullptr,
+                     last_action_offset_, &writer);
+  }
+  if (game.ObservationType() != HanabiGame::kMinimal) {
+    for (int player = 0; player < num_players; ++player) {
+      if (dirty_knowledge_ & (1u << player)) {
+        int offset = knowledge_offset_ + player * knowledge_bits_;
+        std::memset(encoding_.data() + offset, 0, knowledge_bits_);
+        EncodeHandKnowledge(game, hands[(observer_ + player) % num_players],
+                            offset, &writer);
+      }
+    }
+  }
+  dirty_hands_ = 0;
+  dirty_knowledge_ = 0;
+  dirty_board_ = false;
+  dirty_discards_ = false;
+  dirty_last_action_ = false;
+
+  if (verify_) {
+    std::vector<int> expected =
+        full_encoder_.Encode(HanabiObservation(state, observer_));
+    REQUIRE(expected.size() == encoding_.size());
+    for (int i = 0; i < expected.size(); ++i) {
+      REQUIRE(expected[i] == encoding_[i]);
+    }
+  }
+  return encoding_;
+}
+
+void IncrementalObservationEncoder::EncodeInto(const HanabiState& state,
+                                               uint8_t* encoding,
+                                               bool packed) {
+  const std::vector<uint8_t>& bits = Encode(state);
+  if (!packed) {
+    std::memcpy(encoding, bits.data(), bits.size());
+    return;
+  }
+  std::memset(encoding, 0, (bits.size() + 7) / 8);
+  PackedBitWriter writer(encoding);
+  for (int i = 0; i < bits.size(); ++i) {
+    if (bits[i]) {
+      writer.Set(i);
+    }
+  }
 }
 
 }  // namespace hanabi_learning_env
@@ -18,10 +18,13 @@
 #ifndef __CANONICAL_ENCODERS_H__
 #define __CANONICAL_ENCODERS_H__
 
+#include <cstdint>
 #include <vector>
 
 #include "hanabi_game.h"
+#include "hanabi_history_item.h"
 #include "hanabi_observation.h"
+#include "hanabi_state.h"
 #include "observation_encoder.h"
 
 namespace hanabi_learning_env {
@@ -35,6 +38,16 @@ class CanonicalObservationEncoder : public ObservationEncoder {
   std::vector<int> Shape() const override;
   std::vector<int> Encode(const HanabiObservation& obs) const override;
 
+  // Size in bytes of the buffer EncodeInto writes: one byte per bit, or
+  // (bits + 7) / 8 bytes when packed.
+  int EncodedBytes(bool packed) const;
+  // Same encoding as Encode, written into a caller-owned buffer of
+  // EncodedBytes(packed) bytes without allocating. Unpacked, each bit is one
+  // 0/1 byte; packed, bits are stored most significant first, as
+  // numpy.packbits does.
+  void EncodeInto(const HanabiObservation& obs, uint8_t* encoding,
+                  bool packed) const;
+
   ObservationEncoder::Type type() const override {
     return ObservationEncoder::Type::kCanonical;
   }
@@ -43,6 +56,64 @@ class CanonicalObservationEncoder : public ObservationEncoder {
   const HanabiGame* parent_game_ = nullptr;
 };
 
+// Keeps the canonical encoding of one player's observation up to date across
+// the moves of a single game.
+//
+// Encode reads the moves appended to the state's history since the previous
+// call and re-encodes only the parts of the encoding they can change: the hand
+// and card knowledge of the players involved, the board, the discard pile and
+// the last action. The rest is kept from the previous encoding, and no
+// HanabiObservation is built. Call Reset before reusing the encoder for a new
+// game.
+class IncrementalObservationEncoder {
+ public:
+  IncrementalObservationEncoder(const HanabiGame* parent_game, int observer);
+
+  int Observer() const { return observer_; }
+  // Forgets the previous encoding. The next Encode rebuilds every section.
+  void Reset();
+  // Returns the canonical encoding of state as seen by the observer, one 0/1
+  // byte per bit. The reference stays valid until the next call.
+  const std::vector<uint8_t>& Encode(const HanabiState& state);
+  // Same encoding, written as by CanonicalObservationEncoder::EncodeInto.
+  void EncodeInto(const HanabiState& state, uint8_t* encoding, bool packed);
+  // When enabled, every Encode is checked against a full
+  // CanonicalObservationEncoder encoding of the same observation.
+  void SetVerify(bool verify) { verify_ = verify; }
+
+ private:
+  // Marks the sections changed by one move, given in absolute player ids as
+  // stored in HanabiState::MoveHistory().
+  void ApplyMove(const HanabiHistoryItem& item);
+  // Converts an absolute player id to one relative to the observer.
+  int RelativePlayer(int player) const;
+
+  const HanabiGame* parent_game_ = nullptr;
+  CanonicalObservationEncoder full_encoder_;
+  int observer_ = -1;
+  bool verify_ = false;
+  // Section offsets and per-player sizes within the encoding.
+  int board_offset_ = -1;
+  int discards_offset_ = -1;
+  int last_action_offset_ = -1;
+  int knowledge_offset_ = -1;
+  int hand_bits_ = -1;
+  int knowledge_bits_ = -1;
+  // Number of history items already applied.
+  int num_moves_seen_ = 0;
+  // Observer-relative copy of the last non-deal move, if any.
+  bool has_last_move_ = false;
+  HanabiHistoryItem last_move_;
+  // Dirty sections. Bit i of the hand masks is the player i seats after the
+  // observer.
+  uint32_t dirty_hands_ = 0;
+  uint32_t dirty_knowledge_ = 0;
+  bool dirty_board_ = false;
+  bool dirty_discards_ = false;
+  bool dirty_last_action_ = false;
+  std::vector<uint8_t> encoding_;
+};
+
 }  // namespace hanabi_learning_env
 
 #endif
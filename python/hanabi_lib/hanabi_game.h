@@ -76,6 +76,8 @@ class HanabiGame {
   HanabiMove PickRandomChance(
       const std::pair<std::vector<HanabiMove>, std::vector<double>>&
           chance_outcomes) const;
+  // The game's seeded random number generator, shared by all its states.
+  std::mt19937* rng() const { return &rng_; }
 
   std::unordered_map<std::string, std::string> Parameters() const;
   int MinPlayers() const { return 2; }
@@ -22,23 +22,25 @@
 namespace hanabi_learning_env {
 
 HanabiHand::ValueKnowledge::ValueKnowledge(int value_range)
-    : value_(-1), value_plausible_(std::max(value_range, 0), true) {
+    : value_(-1),
+      range_(std::max(value_range, 0)),
+      value_plausible_((1u << range_) - 1) {
   assert(value_range > 0);
+  assert(value_range <= 8);  // More than 8 values is not supported.
 }
 
 void HanabiHand::ValueKnowledge::ApplyIsValueHint(int value) {
-  assert(value >= 0 && value < value_plausible_.size());
+  assert(value >= 0 && value < range_);
   assert(value_ < 0 || value_ == value);
-  assert(value_plausible_[value] == true);
+  assert(IsPlausible(value));
   value_ = value;
-  std::fill(value_plausible_.begin(), value_plausible_.end(), false);
-  value_plausible_[value] = true;
+  value_plausible_ = 1u << value;
 }
 
 void HanabiHand::ValueKnowledge::ApplyIsNotValueHint(int value) {
-  assert(value >= 0 && value < value_plausible_.size());
+  assert(value >= 0 && value < range_);
   assert(value_ < 0 || value_ != value);
-  value_plausible_[value] = false;
+  value_plausible_ &= ~(1u << value);
 }
 
 HanabiHand::CardKnowledge::CardKnowledge(int num_colors, int num_ranks)
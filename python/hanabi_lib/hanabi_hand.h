@@ -38,13 +38,15 @@ class HanabiHand {
     // ValueHinted()=true, value()=0, and ValueCouldBe(v)=false for v=1, and 2.
    public:
     explicit ValueKnowledge(int value_range);
-    int Range() const { return value_plausible_.size(); }
+    int Range() const { return range_; }
     // Returns true if and only if the exact value was revealed.
     // Does not perform inference to get a known value from not-value hints.
     bool ValueHinted() const { return value_ >= 0; }
     int Value() const { return value_; }  // -1 if value was not hinted.
     // Returns true if we have no hint saying variable is not the given value.
-    bool IsPlausible(int value) const { return value_plausible_[value]; }
+    bool IsPlausible(int value) const {
+      return (value_plausible_ >> value) & 1;
+    }
     // Record a hint that gives the value of the variable.
     void ApplyIsValueHint(int value);
     // Record a hint that the variable does not have the given value.
@@ -53,7 +55,10 @@ class HanabiHand {
    private:
     // Value if hint directly provided the value, or -1 with no direct hint.
     int value_ = -1;
-    std::vector<bool> value_plausible_;  // Knowledge from not-value hints.
+    int range_ = 0;
+    // Knowledge from not-value hints, bit v set if v is still plausible. A
+    // bitmask rather than a vector keeps hands (and so states) cheap to copy.
+    uint8_t value_plausible_ = 0;
   };
 
   class CardKnowledge {
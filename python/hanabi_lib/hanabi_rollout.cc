@@ -0,0 +1,108 @@
+// Copyright 2018 Google LLC
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    https://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#include "hanabi_rollout.h"
+
+#include "util.h"
+
+namespace hanabi_learning_env {
+
+int SampleLegalMove(uint64_t legal_moves, std::mt19937* rng) {
+  REQUIRE(legal_moves != 0);
+  int num_legal = 0;
+  for (uint64_t mask = legal_moves; mask != 0; mask &= mask - 1) {
+    ++num_legal;
+  }
+  std::uniform_int_distribution<int> dist(0, num_legal - 1);
+  int skip = dist(*rng);
+  for (int uid = 0;; ++uid) {
+    if ((legal_moves >> uid) & 1) {
+      if (skip == 0) {
+        return uid;
+      }
+      --skip;
+    }
+  }
+}
+
+HanabiRolloutRunner::HanabiRolloutRunner(int num_rollouts, int seed,
+                                         int max_history)
+    : num_rollouts_(num_rollouts),
+      max_history_(max_history),
+      rng_(seed),
+      scores_(num_rollouts, 0) {
+  REQUIRE(num_rollouts > 0);
+  active_.reserve(num_rollouts);
+  active_states_.reserve(num_rollouts);
+  legal_moves_.reserve(num_rollouts);
+  actions_.reserve(num_rollouts);
+}
+
+const std::vector<int>& HanabiRolloutRunner::Run(const HanabiState& state,
+                                                 const RolloutPolicy& policy) {
+  const HanabiGame* game = state.ParentGame();
+  // Moves are exchanged with the policy as LegalMovesMask bits.
+  REQUIRE(game->MaxMoves() <= 64);
+
+  HanabiState snapshot = state.Clone(max_history_);
+  if (states_.empty() || states_[0].ParentGame() != game) {
+    states_.assign(num_rollouts_, snapshot);
+  } else {
+    for (HanabiState& rollout : states_) {
+      rollout.Restore(snapshot);
+    }
+  }
+
+  while (true) {
+    active_.clear();
+    active_states_.clear();
+    legal_moves_.clear();
+    for (int i = 0; i < num_rollouts_; ++i) {
+      HanabiState& rollout = states_[i];
+      while (rollout.CurPlayer() == kChancePlayerId && !rollout.IsTerminal()) {
+        rollout.ApplyRandomChance(&rng_);
+      }
+      if (rollout.IsTerminal()) {
+        continue;
+      }
+      active_.push_back(i);
+      active_states_.push_back(&rollout);
+      legal_moves_.push_back(rollout.LegalMovesMask(rollout.CurPlayer()));
+    }
+    if (active_.empty()) {
+      break;
+    }
+
+    actions_.resize(active_.size());
+    if (policy) {
+      policy(active_states_, legal_moves_, &actions_);
+    } else {
+      for (int k = 0; k < active_.size(); ++k) {
+        actions_[k] = SampleLegalMove(legal_moves_[k], &rng_);
+      }
+    }
+    for (int k = 0; k < active_.size(); ++k) {
+      REQUIRE(actions_[k] >= 0 && actions_[k] < 64 &&
+              ((legal_moves_[k] >> actions_[k]) & 1));
+      states_[active_[k]].ApplyMove(game->GetMove(actions_[k]));
+    }
+  }
+
+  for (int i = 0; i < num_rollouts_; ++i) {
+    scores_[i] = states_[i].Score();
+  }
+  return scores_;
+}
+
+}  // namespace hanabi_learning_env
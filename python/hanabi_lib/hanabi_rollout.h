@@ -0,0 +1,78 @@
+// Copyright 2018 Google LLC
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    https://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#ifndef __HANABI_ROLLOUT_H__
+#define __HANABI_ROLLOUT_H__
+
+#include <cstdint>
+#include <functional>
+#include <random>
+#include <vector>
+
+#include "hanabi_state.h"
+
+namespace hanabi_learning_env {
+
+// Chooses the moves of a batch of rollouts at once, so that a policy network
+// can score them in a single forward pass. states[i] is waiting for a move
+// from its current player and legal_moves[i] is its LegalMovesMask. The policy
+// writes a legal move uid to (*actions)[i].
+using RolloutPolicy =
+    std::function<void(const std::vector<const HanabiState*>& states,
+                       const std::vector<uint64_t>& legal_moves,
+                       std::vector<int>* actions)>;
+
+// Returns the uid of a uniformly random set bit of legal_moves, which must
+// not be zero.
+int SampleLegalMove(uint64_t legal_moves, std::mt19937* rng);
+
+// Plays a fixed number of rollouts from a state to the end of the game.
+//
+// The rollouts advance in lockstep: each step deals any pending cards, then
+// asks the policy for the moves of all unfinished rollouts in one call.
+// Chance moves and the default random policy draw from the runner's own
+// generator, so results are reproducible per seed and do not disturb the
+// game's generator. The rollout states are kept between calls and restored
+// from a bounded-history Clone of the start state, so a Run allocates nothing
+// once the runner has been used on the same game.
+//
+// Determinizing hidden information (e.g. resampling the observer's own hand)
+// is up to the caller, who passes the sampled state to Run.
+class HanabiRolloutRunner {
+ public:
+  HanabiRolloutRunner(int num_rollouts, int seed, int max_history = 0);
+
+  int NumRollouts() const { return num_rollouts_; }
+  // Plays NumRollouts() games from state and returns the final score of each.
+  // Player moves come from policy, or are uniformly random legal moves if
+  // policy is empty. The reference stays valid until the next call.
+  const std::vector<int>& Run(const HanabiState& state,
+                              const RolloutPolicy& policy = RolloutPolicy());
+
+ private:
+  int num_rollouts_ = -1;
+  int max_history_ = 0;
+  std::mt19937 rng_;
+  std::vector<HanabiState> states_;
+  std::vector<int> scores_;
+  // Per-step scratch space for the unfinished rollouts.
+  std::vector<int> active_;
+  std::vector<const HanabiState*> active_states_;
+  std::vector<uint64_t> legal_moves_;
+  std::vector<int> actions_;
+};
+
+}  // namespace hanabi_learning_env
+
+#endif
@@ -48,40 +48,70 @@ uint8_t HandRankBitmask(const HanabiHand& hand, int rank) {
   }
   return mask;
 }
+
+// Returns bitmask of the colors of the cards in hand.
+uint64_t HandColorsPresent(const HanabiHand& hand) {
+  uint64_t mask = 0;
+  for (const HanabiCard& card : hand.Cards()) {
+    mask |= static_cast<uint64_t>(1) << card.Color();
+  }
+  return mask;
+}
+
+// Returns bitmask of the ranks of the cards in hand.
+uint64_t HandRanksPresent(const HanabiHand& hand) {
+  uint64_t mask = 0;
+  for (const HanabiCard& card : hand.Cards()) {
+    mask |= static_cast<uint64_t>(1) << card.Rank();
+  }
+  return mask;
+}
 }  // namespace
 
 HanabiState::HanabiDeck::HanabiDeck(const HanabiGame& game)
     : card_count_(game.NumColors() * game.NumRanks(), 0),
       total_count_(0),
       num_ranks_(game.NumRanks()) {
+  cards_.reserve(game.MaxDeckSize());
   for (int color = 0; color < game.NumColors(); ++color) {
     for (int rank = 0; rank < game.NumRanks(); ++rank) {
       auto count = game.NumberCardInstances(color, rank);
       card_count_[CardToIndex(color, rank)] = count;
       total_count_ += count;
+      cards_.insert(cards_.end(), count, CardToIndex(color, rank));
     }
   }
 }
 
-HanabiCard HanabiState::HanabiDeck::DealCard(std::mt19937* rng) {
+HanabiCard HanabiState::HanabiDeck::DrawToTop(std::mt19937* rng) {
   if (Empty()) {
     return HanabiCard();
   }
-  std::discrete_distribution<std::mt19937::result_type> dist(
-      card_count_.begin(), card_count_.end());
-  int index = dist(*rng);
-  assert(card_count_[index] > 0);
-  --card_count_[index];
-  --total_count_;
+  std::uniform_int_distribution<int> dist(0, total_count_ - 1);
+  std::swap(cards_[dist(*rng)], cards_.back());
+  int index = cards_.back();
   return HanabiCard(IndexToColor(index), IndexToRank(index));
 }
 
+HanabiCard HanabiState::HanabiDeck::DealCard(std::mt19937* rng) {
+  HanabiCard card = DrawToTop(rng);
+  if (!card.IsValid()) {
+    return card;
+  }
+  return DealCard(card.Color(), card.Rank());
+}
+
 HanabiCard HanabiState::HanabiDeck::DealCard(int color, int rank) {
   int index = CardToIndex(color, rank);
   if (card_count_[index] <= 0) {
     return HanabiCard();
   }
   assert(card_count_[index] > 0);
+  // Search from the top, where DrawToTop leaves the card.
+  auto it = std::find(cards_.rbegin(), cards_.rend(), index);
+  assert(it != cards_.rend());
+  std::swap(*it, cards_.back());
+  cards_.pop_back();
   --card_count_[index];
   --total_count_;
   return HanabiCard(IndexToColor(index), IndexToRank(index));
@@ -101,6 +131,32 @@ HanabiState::HanabiState(HanabiGame* parent_game, int start_player)
       fireworks_(parent_game->NumColors(), 0),
       turns_to_play_(parent_game->NumPlayers()) {}
 
+HanabiState::HanabiState(const HanabiState& state, int max_history)
+    : parent_game_(state.parent_game_),
+      deck_(state.deck_),
+      discard_pile_(state.discard_pile_),
+      hands_(state.hands_),
+      move_history_(max_history >= 0 &&
+                            max_history < state.move_history_.size()
+                        ? state.move_history_.end() - max_history
+                        : state.move_history_.begin(),
+                    state.move_history_.end()),
+      cur_player_(state.cur_player_),
+      next_non_chance_player_(state.next_non_chance_player_),
+      information_tokens_(state.information_tokens_),
+      life_tokens_(state.life_tokens_),
+      fireworks_(state.fireworks_),
+      turns_to_play_(state.turns_to_play_) {}
+
+HanabiState HanabiState::Clone(int max_history) const {
+  return HanabiState(*this, max_history);
+}
+
+void HanabiState::Restore(const HanabiState& snapshot) {
+  REQUIRE(snapshot.parent_game_ == parent_game_);
+  *this = snapshot;
+}
+
 void HanabiState::AdvanceToNextPlayer() {
   if (!deck_.Empty() && PlayerToDeal() >= 0) {
     cur_player_ = kChancePlayerId;
@@ -280,9 +336,17 @@ double HanabiState::ChanceOutcomeProb(HanabiMove move) const {
 }
 
 void HanabiState::ApplyRandomChance() {
-  auto chance_outcomes = ChanceOutcomes();
-  REQUIRE(!chance_outcomes.second.empty());
-  ApplyMove(ParentGame()->PickRandomChance(chance_outcomes));
+  ApplyRandomChance(ParentGame()->rng());
+}
+
+void HanabiState::ApplyRandomChance(std::mt19937* rng) {
+  // Same distribution as PickRandomChance(ChanceOutcomes()): every remaining
+  // card instance is equally likely.
+  REQUIRE(cur_player_ == kChancePlayerId);
+  HanabiCard card = deck_.DrawToTop(rng);
+  REQUIRE(card.IsValid());
+  ApplyMove(HanabiMove(HanabiMove::kDeal, /*card_index=*/-1,
+                       /*target_offset=*/-1, card.Color(), card.Rank()));
 }
 
 std::vector<HanabiMove> HanabiState::LegalMoves(int player) const {
@@ -294,6 +358,15 @@ std::vector<HanabiMove> HanabiState::LegalMoves(int player) const {
     return movelist;
   }
   int max_move_uid = ParentGame()->MaxMoves();
+  if (max_move_uid <= 64) {
+    uint64_t mask = LegalMovesMask(player);
+    for (int uid = 0; mask != 0; ++uid, mask >>= 1) {
+      if (mask & 1) {
+        movelist.push_back(ParentGame()->GetMove(uid));
+      }
+    }
+    return movelist;
+  }
   for (int uid = 0; uid < max_move_uid; ++uid) {
     HanabiMove move = ParentGame()->GetMove(uid);
     if (MoveIsLegal(move)) {
@@ -303,6 +376,44 @@ std::vector<HanabiMove> HanabiState::LegalMoves(int player) const {
   return movelist;
 }
 
+uint64_t HanabiState::LegalMovesMask(int player) const {
+  REQUIRE(player >= 0 && player < ParentGame()->NumPlayers());
+  const HanabiGame& game = *ParentGame();
+  REQUIRE(game.MaxMoves() <= 64);
+  if (player != cur_player_) {
+    return 0;
+  }
+
+  // Discards and plays are legal for every card in hand.
+  uint64_t mask = 0;
+  uint64_t cards_in_hand =
+      (static_cast<uint64_t>(1) << hands_[cur_player_].Cards().size()) - 1;
+  if (InformationTokens() < game.MaxInformationTokens()) {
+    mask |= cards_in_hand
+            << game.GetMoveUid(HanabiMove::kDiscard, /*card_index=*/0,
+                               /*target_offset=*/-1, /*color=*/-1,
+                               /*rank=*/-1);
+  }
+  mask |= cards_in_hand << game.GetMoveUid(HanabiMove::kPlay,
+                                           /*card_index=*/0,
+                                           /*target_offset=*/-1,
+                                           /*color=*/-1, /*rank=*/-1);
+
+  // A hint is legal for every color and rank present in the target's hand.
+  if (InformationTokens() > 0) {
+    for (int offset = 1; offset < game.NumPlayers(); ++offset) {
+      const HanabiHand& hand = HandByOffset(offset);
+      mask |= HandColorsPresent(hand)
+              << game.GetMoveUid(HanabiMove::kRevealColor, /*card_index=*/-1,
+                                 offset, /*color=*/0, /*rank=*/-1);
+      mask |= HandRanksPresent(hand)
+              << game.GetMoveUid(HanabiMove::kRevealRank, /*card_index=*/-1,
+                                 offset, /*color=*/-1, /*rank=*/0);
+    }
+  }
+  return mask;
+}
+
 bool HanabiState::CardPlayableOnFireworks(int color, int rank) const {
   if (color < 0 || color >= ParentGame()->NumColors()) {
     return false;
@@ -15,6 +15,7 @@
 #ifndef __HANABI_STATE_H__
 #define __HANABI_STATE_H__
 
+#include <cstdint>
 #include <random>
 #include <string>
 #include <vector>
@@ -37,6 +38,10 @@ class HanabiState {
     // DealCard returns invalid card on failure.
     HanabiCard DealCard(int color, int rank);
     HanabiCard DealCard(std::mt19937* rng);
+    // Moves a uniformly random remaining card to the top of the deck and
+    // returns it without dealing it. Dealing that color and rank next is
+    // then O(1). Returns invalid card if the deck is empty.
+    HanabiCard DrawToTop(std::mt19937* rng);
     int Size() const { return total_count_; }
     bool Empty() const { return total_count_ == 0; }
     int CardCount(int color, int rank) const {
@@ -54,6 +59,10 @@ class HanabiState {
     // E.g., if card_count_[CardToIndex(card)] == 2, then there are two
     // instances of card remaining in the deck, available to be dealt out.
     std::vector<int> card_count_;
+    // Every remaining card instance, as CardToIndex(color, rank). The back
+    // element is the top of the deck. Random deals swap a random instance to
+    // the top and pop it, so dealing never rebuilds a distribution.
+    std::vector<uint8_t> cards_;
     int total_count_ = -1;  // Total number of cards available to be dealt out.
     int num_ranks_ = -1;    // From game.NumRanks(), used to map card to index.
   };
@@ -71,11 +80,27 @@ class HanabiState {
   explicit HanabiState(HanabiGame* parent_game, int start_player = -1);
   // Copy constructor for recursive game traversals using copy + apply-move.
   HanabiState(const HanabiState& state) = default;
+  HanabiState& operator=(const HanabiState& state) = default;
+
+  // Snapshot for search: a copy of the state that keeps only the last
+  // max_history items of MoveHistory() (all of them if max_history < 0).
+  // Everything else, including the deck, is copied, so the clone plays on
+  // exactly like the original. Observations of a clone see only the kept
+  // history.
+  HanabiState Clone(int max_history) const;
+  // Makes this state a copy of snapshot (typically a Clone) of the same game,
+  // reusing this state's allocations. Restoring one scratch state per
+  // rollout avoids allocating a new state each time.
+  void Restore(const HanabiState& snapshot);
 
   bool MoveIsLegal(HanabiMove move) const;
   void ApplyMove(HanabiMove move);
   // Legal moves for state. Moves point into an unchanging list in parent_game.
   std::vector<HanabiMove> LegalMoves(int player) const;
+  // Legal moves for state as a bitmask: bit uid is set iff
+  // ParentGame()->GetMove(uid) is legal for player. Requires
+  // ParentGame()->MaxMoves() <= 64.
+  uint64_t LegalMovesMask(int player) const;
   // Returns true if card with color and rank can be played on fireworks pile.
   bool CardPlayableOnFireworks(int color, int rank) const;
   bool CardPlayableOnFireworks(HanabiCard card) const {
@@ -85,6 +110,9 @@ class HanabiState {
   double ChanceOutcomeProb(HanabiMove move) const;
   void ApplyChanceOutcome(HanabiMove move) { ApplyMove(move); }
   void ApplyRandomChance();
+  // Same, drawing the card from rng instead of the game's generator, e.g. to
+  // keep rollouts independent of the game's random stream.
+  void ApplyRandomChance(std::mt19937* rng);
   // Get the valid chance moves, and associated probabilities.
   // Guaranteed that moves.size() == probabilities.size().
   std::pair<std::vector<HanabiMove>, std::vector<double>> ChanceOutcomes()
@@ -115,6 +143,8 @@ class HanabiState {
   // information_token_added is true iff information_tokens increase
   // (i.e., success=true, highest rank was added, and not at max tokens.)
   std::pair<bool, bool> AddToFireworks(HanabiCard card);
+  // Used by Clone.
+  HanabiState(const HanabiState& state, int max_history);
   const HanabiHand& HandByOffset(int offset) const {
     return hands_[(cur_player_ + offset) % hands_.size()];
   }
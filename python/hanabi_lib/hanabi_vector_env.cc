@@ -0,0 +1,99 @@
+// Copyright 2018 Google LLC
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    https://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#include "hanabi_vector_env.h"
+
+#include "util.h"
+
+namespace hanabi_learning_env {
+
+HanabiVectorEnv::HanabiVectorEnv(HanabiGame* parent_game, int num_envs,
+                                 bool packed_observations)
+    : parent_game_(parent_game),
+      encoder_(parent_game),
+      packed_observations_(packed_observations),
+      observation_bytes_(encoder_.EncodedBytes(packed_observations)),
+      states_(num_envs, HanabiState(parent_game)) {
+  REQUIRE(num_envs > 0);
+  // Legal moves are reported as one 64-bit mask per game.
+  REQUIRE(parent_game->MaxMoves() <= 64);
+  encoders_.reserve(num_envs * parent_game->NumPlayers());
+  for (int i = 0; i < num_envs; ++i) {
+    for (int player = 0; player < parent_game->NumPlayers(); ++player) {
+      encoders_.emplace_back(parent_game, player);
+    }
+  }
+}
+
+void HanabiVectorEnv::SetVerifyObservations(bool verify) {
+  for (IncrementalObservationEncoder& encoder : encoders_) {
+    encoder.SetVerify(verify);
+  }
+}
+
+void HanabiVectorEnv::Reset(uint8_t* observations, uint64_t* legal_moves,
+                            int* current_players) {
+  for (int i = 0; i < states_.size(); ++i) {
+    ResetState(i);
+    WriteTurn(i, observations, legal_moves, current_players);
+  }
+}
+
+void HanabiVectorEnv::Step(const int* actions, uint8_t* observations,
+                           uint64_t* legal_moves, int* current_players,
+                           float* rewards, uint8_t* dones) {
+  for (int i = 0; i < states_.size(); ++i) {
+    HanabiState& state = states_[i];
+    int score_before = state.Score();
+    state.ApplyMove(parent_game_->GetMove(actions[i]));
+    DealUntilPlayerTurn(i);
+    rewards[i] = static_cast<float>(state.Score() - score_before);
+    dones[i] = state.IsTerminal() ? 1 : 0;
+    if (dones[i]) {
+      ResetState(i);
+    }
+    WriteTurn(i, observations, legal_moves, current_players);
+  }
+}
+
+void HanabiVectorEnv::ResetState(int index) {
+  states_[index] = HanabiState(parent_game_);
+  int num_players = parent_game_->NumPlayers();
+  for (int player = 0; player < num_players; ++player) {
+    encoders_[index * num_players + player].Reset();
+  }
+  DealUntilPlayerTurn(index);
+}
+
+void HanabiVectorEnv::DealUntilPlayerTurn(int index) {
+  HanabiState& state = states_[index];
+  while (state.CurPlayer() == kChancePlayerId && !state.IsTerminal()) {
+    state.ApplyRandomChance();
+  }
+}
+
+void HanabiVectorEnv::WriteTurn(int index, uint8_t* observations,
+                                uint64_t* legal_moves,
+                                int* current_players) {
+  const HanabiState& state = states_[index];
+  int player = state.CurPlayer();
+  current_players[index] = player;
+
+  encoders_[index * parent_game_->NumPlayers() + player].EncodeInto(
+      state, observations + index * observation_bytes_, packed_observations_);
+
+  legal_moves[index] = state.LegalMovesMask(player);
+}
+
+}  // namespace hanabi_learning_env
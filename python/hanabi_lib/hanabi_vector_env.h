@@ -0,0 +1,84 @@
+// Copyright 2018 Google LLC
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    https://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#ifndef __HANABI_VECTOR_ENV_H__
+#define __HANABI_VECTOR_ENV_H__
+
+#include <cstdint>
+#include <vector>
+
+#include "canonical_encoders.h"
+#include "hanabi_game.h"
+#include "hanabi_state.h"
+
+namespace hanabi_learning_env {
+
+// Steps a batch of independent games of the same HanabiGame in one call.
+//
+// All outputs go to caller-owned contiguous buffers with one row per game:
+//   observations:    num_envs * ObservationBytes() bytes, the canonical
+//                    encoding of the current player's observation, one 0/1
+//                    byte per bit or bit-packed (see
+//                    CanonicalObservationEncoder::EncodeInto).
+//   legal_moves:     num_envs bitmasks; bit uid is set iff the move with that
+//                    uid is legal for the current player.
+//   current_players: num_envs ints.
+//   rewards:         num_envs floats, the change in score caused by the move.
+//   dones:           num_envs bytes, 1 iff the move ended the game.
+// Chance moves (dealing) are applied internally, so every game is always
+// waiting for a player move. A game that ends is immediately reset, and its
+// row describes the first turn of the new game.
+// Observations are kept by one IncrementalObservationEncoder per game and
+// player, so each step only re-encodes what the moves since that player's
+// previous turn changed.
+class HanabiVectorEnv {
+ public:
+  HanabiVectorEnv(HanabiGame* parent_game, int num_envs,
+                  bool packed_observations = false);
+
+  int NumEnvs() const { return states_.size(); }
+  // Number of bits in one observation.
+  int ObservationLength() const { return encoder_.Shape()[0]; }
+  // Size in bytes of one observation row.
+  int ObservationBytes() const { return observation_bytes_; }
+  int NumMoves() const { return parent_game_->MaxMoves(); }
+  const HanabiState& State(int index) const { return states_[index]; }
+  // Cross-checks every observation against the full canonical encoder.
+  void SetVerifyObservations(bool verify);
+
+  // Starts a new game in every slot and writes the first turn of each.
+  void Reset(uint8_t* observations, uint64_t* legal_moves,
+             int* current_players);
+  // Applies move uid actions[i] to game i, which must be legal.
+  void Step(const int* actions, uint8_t* observations, uint64_t* legal_moves,
+            int* current_players, float* rewards, uint8_t* dones);
+
+ private:
+  void ResetState(int index);
+  void DealUntilPlayerTurn(int index);
+  void WriteTurn(int index, uint8_t* observations, uint64_t* legal_moves,
+                 int* current_players);
+
+  HanabiGame* parent_game_ = nullptr;
+  CanonicalObservationEncoder encoder_;
+  bool packed_observations_ = false;
+  int observation_bytes_ = -1;
+  std::vector<HanabiState> states_;
+  // encoders_[index * num_players + player].
+  std::vector<IncrementalObservationEncoder> encoders_;
+};
+
+}  // namespace hanabi_learning_env
+
+#endif
@@ -1,11 +1,28 @@
 import os
 # os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
-import gin
-import tensorflow as tf
 import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
 # === 追加：先頭付近の import の下あたりに置くと見通し良い ===
 import numpy as np
+import exported_policy
+import unity_comm
 DEBUG_MASK = os.getenv("MASK_LOG", "0") == "1"
+# 推論結果を Unity の TCPReceiver(8052) へも送るか
+# （ExternalAIController は 9000 の応答を読まず、8052 で行動を受け取って盤面に適用する）
+# 既定は送らない（eval_selfplay などの逐次推論を毎手の TCP 接続で遅くしない）。
+# 推論サーバ（python_comm_server）だけが既定で有効にする。
+UNITY_PUSH = os.getenv("UNITY_PUSH", "0") == "1"
+# マイクロバッチ設定（BatchingInferenceEngine 用）
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "64"))      # 1 回の forward に詰める最大件数
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "2"))  # 最初の要求からの最大待ち時間
+# export_model.py の出力ディレクトリ。指定すると TF/gin/RainbowAgent を読み込まずに推論する
+INFER_MODEL = os.getenv("INFER_MODEL", "")
+# INFER_MODEL のバックエンド: "frozen"（既定。TF エージェントとビット一致）
+# / "numpy"（TF 不要だが近似。最下位ビットの差で argmax の同点が入れ替わることがある）
+INFER_BACKEND = os.getenv("INFER_BACKEND", "frozen")
 
 def _ensure_legal_mask(legal_actions, num_actions):
     """Unityから来た 0/1 マスクを、Rainbow用の加算マスク(合法=0.0, 非合法=-inf)に正規化する。"""
@@ -32,7 +49,6 @@ def _ensure_legal_mask(legal_actions, num_actions):
     return mask
 
 from hanabi_learning_environment import rl_env
-from rainbow_agent import RainbowAgent
 
 def _normalize_legal_mask(legal):
     """
@@ -65,52 +81,68 @@ env = rl_env.make()
 idx2move = [str(env.game.get_move(i)) for i in range(env.num_moves())]
 print("\n".join(f"{i}: {m}" for i, m in enumerate(idx2move)))
 
-# ginファイルの読み込み
-gin_files = ['configs/hanabi_rainbow.gin']  # ginファイルのパス
-gin.parse_config_files_and_bindings(gin_files, bindings=[])
 
-# 環境とエージェントの初期化（gin設定で行うため明示的に書かない）
-env = rl_env.make()
-observation_vector_shape = env.vectorized_observation_shape()[0]
-print(f"観測ベクトルサイズ: {observation_vector_shape}")
+class _AgentPolicy(object):
+    """学習用 RainbowAgent を exported_policy と同じ q_and_actions(states, masks) で包む。"""
+
+    def __init__(self, agent):
+        self._agent = agent
+        self.num_actions = agent.num_actions
+
+    def q_and_actions(self, states, legal_masks):
+        agent = self._agent
+        states = np.asarray(states, dtype=np.uint8).reshape(len(states), -1, 1)
+        return agent._sess.run(
+            [agent._batch_q_argmax, agent._batch_q],
+            {agent.batch_state_ph: states, agent.batch_legal_actions_ph: legal_masks})
+
 
-agent = RainbowAgent(
-    num_actions=env.num_moves(),
-    observation_size=observation_vector_shape,
-    num_players=env.players
-)
+def _load_agent():
+    """gin 設定から RainbowAgent を組み立ててチェックポイントを復元する（従来の経路）。"""
+    import gin
+    from rainbow_agent import RainbowAgent
 
-checkpoint_path = "results/checkpoints/tf_ckpt-2150"
+    # ginファイルの読み込み
+    gin_files = ['configs/hanabi_rainbow.gin']  # ginファイルのパス
+    gin.parse_config_files_and_bindings(gin_files, bindings=[])
 
-# with tf.compat.v1.Session() as sess:
-#     sess.run(tf.compat.v1.global_variables_initializer())
-#     saver = tf.compat.v1.train.Saver()
-#     saver.restore(sess, checkpoint_path)
-#     print("✅ チェックポイントロード成功")
+    # 環境とエージェントの初期化（gin設定で行うため明示的に書かない）
+    observation_vector_shape = env.vectorized_observation_shape()[0]
+    print(f"観測ベクトルサイズ: {observation_vector_shape}")
 
-#     # 推論テスト
-#     obs = env.reset()
-#     observation = obs['player_observations'][0]['vectorized']
-#     action = agent._select_action(observation)
-#     print("✅ 推論成功, 選択されたアクション:", action)
+    agent = RainbowAgent(
+        num_actions=env.num_moves(),
+        observation_size=observation_vector_shape,
+        num_players=env.players
+    )
 
-# 以下のように書き直す：
+    checkpoint_path = "results/checkpoints/tf_ckpt-2150"
+    agent._saver.restore(agent._sess, checkpoint_path)
+    print("チェックポイントロード成功")
 
-agent._saver.restore(agent._sess, checkpoint_path)
-print("チェックポイントロード成功")
+    # チェックポイントのロード後に評価モードへ
+    agent.eval_mode = True  # ← これが超重要。選択時に epsilon_eval を使う
 
-# チェックポイントのロード後に評価モードへ
-agent.eval_mode = True  # ← これが超重要。選択時に epsilon_eval を使う
+    # 念のため（ginで変えていた場合に備えて）ゼロ固定
+    agent.epsilon_eval = 0.0
+    agent.epsilon_train = 0.0  # 誤って訓練モードに戻っても探索しないよう保険
+    return agent
 
-# 念のため（ginで変えていた場合に備えて）ゼロ固定
-agent.epsilon_eval = 0.0
-agent.epsilon_train = 0.0  # 誤って訓練モードに戻っても探索しないよう保険
+
+if INFER_MODEL:
+    # 推論専用モデル（export_model.py の出力）。学習用グラフは作らない
+    agent = None
+    policy = exported_policy.load_policy(INFER_MODEL, INFER_BACKEND)
+    print(f"推論専用モデルをロード: {INFER_MODEL} (backend={INFER_BACKEND})")
+else:
+    agent = _load_agent()
+    policy = _AgentPolicy(agent)
 
 # 推論テスト
 obs = env.reset()
 observation = obs['player_observations'][0]['vectorized']
-legal_actions = np.zeros(agent.num_actions, dtype=np.float32)  # 適当に仮置き
-action = agent._select_action(observation, legal_actions)
+legal_actions = np.zeros((1, policy.num_actions), dtype=np.float32)  # 適当に仮置き
+action = int(policy.q_and_actions([observation], legal_actions)[0][0])
 print("推論成功, 選択されたアクション:", action)
 
 try:
@@ -122,21 +154,14 @@ except Exception:
 
 # === ここから predict_action を貼り替え ===
 def predict_action(observation, legal_actions):
-    global agent
-    if agent is None:
-        raise RuntimeError("agent is not initialized")
-
-    # 観測・合法手
-    obs = np.asarray(observation, dtype=np.uint8)
+    """観測と合法手から行動を選び、意図ログを出す（forward は 1 回だけ）。"""
     la_raw = np.asarray(legal_actions, dtype=np.float32)
-
-    # 学習時と同じ“加算マスク”仕様へ正規化（合法=0.0 / 非合法=-inf）
-    la_mask = _ensure_legal_mask(la_raw, agent.num_actions)
+    result = infer(observation, la_raw, topk=3)
 
     if DEBUG_MASK:
         try:
             la = la_raw.reshape(-1).astype(np.float32)
-            mask = la_mask.reshape(-1).astype(np.float32)
+            mask = result["legal_mask"]
             illegal_idx = np.where(~(la > 0.5))[0].tolist()
 
             def short(v, n=20):
@@ -148,33 +173,45 @@ def predict_action(observation, legal_actions):
         except Exception as e:
             print("[MASKCHK] logging failed:", e)
 
-    # 行動選択（これが最終アクション。従来と同じAPI）
-    act = agent._select_action(obs, la_mask)
-
-    # 選択“後”に読み取りだけで意図ログ（内部状態は一切変更しない）
     try:
-        _log_intent_after_selection(agent, obs, la_mask, act, idx2move=_IDX2MOVE, topk=3)
+        _log_intent(result)
     except Exception as e:
         print("Intent計算時エラー:", e)
 
-    return act
+    if UNITY_PUSH:
+        unity_comm.send_to_unity(observation, result["legal_mask"], result["action"])
+    return result["action"]
+
+
+def infer(observation, legal_actions, topk=3):
+    """1 回の sess.run で行動・期待Q・確率・上位候補・意図をまとめて返す。
+
+    Returns:
+      dict: action / legal_mask / masked_q / probs / topk / intent_type / confidence / move
+    """
+    if policy is None:
+        raise RuntimeError("policy is not initialized")
+
+    # 観測・合法手（学習時と同じ“加算マスク”仕様へ正規化：合法=0.0 / 非合法=-inf）
+    obs = np.asarray(observation, dtype=np.uint8).reshape(1, -1)
+    la_mask = _ensure_legal_mask(legal_actions, policy.num_actions)
+
+    # argmax と期待Q を 1 回の forward でまとめて取得
+    actions, q = policy.q_and_actions(obs, la_mask[None, :])
+    return _summarize_q(q[0], la_mask, int(actions[0]), idx2move=_IDX2MOVE, topk=topk)
 
-def _log_intent_after_selection(agent, observation, legal_actions, chosen_action, idx2move=None, topk=3):
-    """選択後に同一入力で Q を読むだけの純ロガー（副作用なし）。"""
-    # 形状合わせ（state は [1, obs, 1]。legal は 1次元のまま）
-    obs = np.asarray(observation, dtype=np.uint8).reshape(1, -1, 1)
-    la  = np.asarray(legal_actions, dtype=np.float32).reshape(-1)
 
-    # 期待Qを読み取り。legal_actions_ph は feed しない（読むだけ）
-    # self._q は [1, num_actions] の期待Q（Rainbowで _reshape_networks 後）:contentReference[oaicite:2]{index=2}
-    q = agent._sess.run(agent._q, {agent.state_ph: obs})[0]  # (num_actions,)
+def _summarize_q(q, legal_actions, chosen_action, idx2move=None, topk=3):
+    """計算済みの期待Q（マスク前）から確信度・上位候補・意図分類を求める（副作用なし）。"""
+    la = np.asarray(legal_actions, dtype=np.float32).reshape(-1)
 
     # 選択時と同じルールでマスク加算（合法=0.0 / 非合法=-inf）
     masked_q = q + la
 
     # softmax で選択行動の確信度を概算
     exps = np.exp(masked_q - np.max(masked_q))
-    probs = exps / np.sum(exps) if np.sum(exps) > 0 else np.zeros_like(exps)
+    total = np.sum(exps)
+    probs = exps / total if total > 0 else np.zeros_like(exps)
 
     act = int(chosen_action)
     conf = float(probs[act])
@@ -198,18 +235,115 @@ def _log_intent_after_selection(agent, observation, legal_actions, chosen_action
     top_list = []
     for i in order:
         label = idx2move[i] if (idx2move is not None and 0 <= i < len(idx2move)) else str(i)
-        top_list.append({"action": int(i), "move": label, "q": float(masked_q[i]), "p": float(exps[i]/np.sum(exps) if np.sum(exps)>0 else 0.0)})
-
-    print(f"[INTENT] {intent_type}  conf={conf:.3f}  move={move_str}")
-    print("[INTENT_JSON]", json.dumps({
+        top_list.append({"action": int(i), "move": label, "q": float(masked_q[i]), "p": float(probs[i])})
+
+    return {
+        "action": act,
+        "legal_mask": la,
+        "masked_q": masked_q,
+        "probs": probs,
+        "topk": top_list,
         "intent_type": intent_type,
-        "confidence": round(conf, 3),
-        "chosen_action": act,
+        "confidence": conf,
         "move": move_str,
-        "topk": top_list
+    }
+
+
+def _log_intent(result):
+    """_summarize_q の結果を [INTENT] / [INTENT_JSON] として出力する。"""
+    print(f"[INTENT] {result['intent_type']}  conf={result['confidence']:.3f}  move={result['move']}")
+    print("[INTENT_JSON]", json.dumps({
+        "intent_type": result["intent_type"],
+        "confidence": round(result["confidence"], 3),
+        "chosen_action": result["action"],
+        "move": result["move"],
+        "topk": result["topk"]
     }, ensure_ascii=False))
 
 
   # ソケット通信の設定（Unityから観測データ受信）
     #HOST = '192.168.0.11'
-    #PORT = 8052
\ No newline at end of file
+    #PORT = 8052
+
+
+# === 複数クライアントの要求をまとめて 1 回の forward で処理するバッチ推論 ===
+class BatchingInferenceEngine(object):
+    """観測と合法手マスクを溜めて、最大 max_batch_size 件 / max_wait_ms ごとに
+    online ネットワーク（policy.q_and_actions）を 1 回だけ実行し、結果を各呼び出し元に返す。
+
+    submit() はスレッドセーフで、concurrent.futures.Future を返す。
+    Future の結果は (action, q) で、q はマスク前の期待Q（num_actions,）。
+    """
+
+    def __init__(self, policy, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self._policy = policy
+        self._max_batch_size = max(1, int(max_batch_size))
+        self._max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="batch-infer", daemon=True)
+        self._thread.start()
+
+    def submit(self, observation, legal_actions):
+        """推論要求を積む。legal_actions は 0/1 でも 0/-inf でもよい。"""
+        fut = Future()
+        obs = np.asarray(observation, dtype=np.uint8).reshape(-1)
+        mask = _ensure_legal_mask(legal_actions, self._policy.num_actions)
+        self._requests.put((obs, mask, fut))
+        return fut
+
+    def _collect(self):
+        batch = [self._requests.get()]  # 最初の 1 件はブロックして待つ
+        deadline = time.monotonic() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0:
+                    batch.append(self._requests.get_nowait())
+                else:
+                    batch.append(self._requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        policy = self._policy
+        while True:
+            batch = [b for b in self._collect() if b[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                states = np.stack([o for o, _, _ in batch])
+                masks = np.stack([m for _, m, _ in batch])
+                actions, q = policy.q_and_actions(states, masks)
+            except Exception as e:
+                for _, _, f in batch:
+                    f.set_exception(e)
+                continue
+            for i, (_, _, f) in enumerate(batch):
+                f.set_result((int(actions[i]), q[i]))
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_batching_engine():
+    """プロセス共通の BatchingInferenceEngine（初回呼び出し時に起動）。"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = BatchingInferenceEngine(policy)
+        return _engine
+
+
+def predict_action_batched(observation, legal_actions):
+    """predict_action のバッチ版。複数スレッドから同時に呼ぶと 1 回の forward にまとめられる。"""
+    la_mask = _ensure_legal_mask(np.asarray(legal_actions, dtype=np.float32), policy.num_actions)
+    act, q = get_batching_engine().submit(observation, la_mask).result()
+    try:
+        _log_intent(_summarize_q(q, la_mask, act, idx2move=_IDX2MOVE, topk=3))
+    except Exception as e:
+        print("Intent計算時エラー:", e)
+    if UNITY_PUSH:
+        unity_comm.send_to_unity(observation, la_mask, act)
+    return act
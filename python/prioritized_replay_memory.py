@@ -29,10 +29,10 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from third_party.dopamine import sum_tree
 import gin.tf
 import numpy as np
 import replay_memory
+import sum_tree
 import tensorflow as tf
 
 DEFAULT_PRIORITY = 100.0
@@ -45,7 +45,7 @@ class OutOfGraphPrioritizedReplayMemory(replay_memory.OutOfGraphReplayMemory):
   """
 
   def __init__(self, num_actions, observation_size, stack_size, replay_capacity,
-               batch_size, update_horizon=1, gamma=1.0):
+               batch_size, update_horizon=1, gamma=1.0, backing_dir=None):
     """This data structure does the heavy lifting in the replay memory.
 
     Args:
@@ -56,14 +56,33 @@ class OutOfGraphPrioritizedReplayMemory(replay_memory.OutOfGraphReplayMemory):
       batch_size: int, batch size.
       update_horizon: int, length of update ('n' in n-step update).
       gamma: int, the discount factor.
+      backing_dir: str, optional local directory for memory-mapped buffers.
+        The sum tree leaves are kept there as well.
     """
     super(OutOfGraphPrioritizedReplayMemory, self).__init__(
         num_actions=num_actions,
         observation_size=observation_size, stack_size=stack_size,
         replay_capacity=replay_capacity, batch_size=batch_size,
-        update_horizon=update_horizon, gamma=gamma)
+        update_horizon=update_horizon, gamma=gamma, backing_dir=backing_dir)
 
     self.sum_tree = sum_tree.SumTree(replay_capacity)
+    if backing_dir is not None:
+      self._attach_priorities()
+
+  def _attach_priorities(self, priorities=None):
+    """Moves the sum tree leaves into the backing directory.
+
+    Args:
+      priorities: `np.array`, optional leaf values to write. If None, the
+        values already in the backing file are kept.
+    """
+    leaves = replay_memory.open_backing_array(
+        self._backing_dir, 'priorities', self.sum_tree.nodes[-1].shape,
+        self.sum_tree.nodes[-1].dtype)
+    if priorities is not None:
+      leaves[...] = priorities
+    self.sum_tree.nodes[-1] = leaves
+    self.sum_tree.rebuild()
 
   def add(self, observation, action, reward, terminal, legal_actions):
     """Adds a transition to the replay memory.
@@ -102,32 +121,62 @@ class OutOfGraphPrioritizedReplayMemory(replay_memory.OutOfGraphReplayMemory):
 
     self.sum_tree.set(new_element_index, priority)
 
+  def add_episode(self, observations, actions, rewards, terminals,
+                  legal_actions):
+    """Adds consecutive transitions, see `OutOfGraphReplayMemory.add_episode`.
+
+    As in add(), dummy frames get priority 0.
+    """
+    if not len(actions):
+      return
+    rows, dummy = self._episode_rows(observations, actions, rewards, terminals,
+                                     legal_actions)
+    self._add_rows(*rows,
+                   priorities=np.where(dummy, 0.0, DEFAULT_PRIORITY))
+
+  def _add_rows(self, observations, actions, rewards, terminals, legal_actions,
+                priorities=DEFAULT_PRIORITY):
+    indices = super(OutOfGraphPrioritizedReplayMemory, self)._add_rows(
+        observations, actions, rewards, terminals, legal_actions)
+    priorities = np.broadcast_to(priorities, (len(actions),))
+    self.sum_tree.set(indices, priorities[len(actions) - len(indices):])
+    return indices
+
+  def load(self, checkpoint_dir, suffix):
+    super(OutOfGraphPrioritizedReplayMemory, self).load(checkpoint_dir, suffix)
+    if self._backing_dir is not None:
+      # The checkpointed sum tree replaced the memory-mapped one.
+      self._attach_priorities(self.sum_tree.nodes[-1])
+
   def sample_index_batch(self, batch_size):
     """Returns a batch of valid indices.
 
+    The batch is drawn with stratified sampling from the sum tree. Invalid
+    draws are replaced by fresh proportional draws, in bulk, until the batch is
+    complete.
+
     Args:
       batch_size: int, number of indices returned.
 
     Returns:
-      List of size batch_size containing valid indices.
+      `np.array` of batch_size, containing valid indices.
 
     Raises:
       Exception: If the batch was not constructed after maximum number of tries.
     """
-    indices = []
+    indices = self.sum_tree.stratified_sample(batch_size)
+    invalid = ~self.valid_transitions(indices)
     allowed_attempts = replay_memory.MAX_SAMPLE_ATTEMPTS
 
-    while len(indices) < batch_size and allowed_attempts > 0:
-      index = self.sum_tree.sample()
-
-      if self.is_valid_transition(index):
-        indices.append(index)
-      else:
-        allowed_attempts -= 1
+    while invalid.any() and allowed_attempts > 0:
+      num_invalid = int(invalid.sum())
+      allowed_attempts -= num_invalid
+      indices[invalid] = self.sum_tree.sample(size=num_invalid)
+      invalid[invalid] = ~self.valid_transitions(indices[invalid])
 
-    if len(indices) != batch_size:
+    if invalid.any():
       raise Exception('Could only sample {} valid transitions'.format(
-          len(indices)))
+          batch_size - int(invalid.sum())))
     else:
       return indices
 
@@ -140,8 +189,7 @@ class OutOfGraphPrioritizedReplayMemory(replay_memory.OutOfGraphReplayMemory):
     """
     assert indices.dtype == np.int32, ('Indices must be integers, '
                                        'given: {}'.format(indices.dtype))
-    for i, memory_index in enumerate(indices):
-      self.sum_tree.set(memory_index, priorities[i])
+    self.sum_tree.set(indices, priorities)
 
   def get_priority(self, indices, batch_size=None):
     """Fetches the priorities correspond to a batch of memory indices.
@@ -159,14 +207,9 @@ class OutOfGraphPrioritizedReplayMemory(replay_memory.OutOfGraphReplayMemory):
     if batch_size != self._state_batch.shape[0]:
       self.reset_state_batch_arrays(batch_size)
 
-    priority_batch = np.empty((batch_size), dtype=np.float32)
-
     assert indices.dtype == np.int32, ('Indices must be integers, '
                                        'given: {}'.format(indices.dtype))
-    for i, memory_index in enumerate(indices):
-      priority_batch[i] = self.sum_tree.get(memory_index)
-
-    return priority_batch
+    return self.sum_tree.get(indices).astype(np.float32)
 
 
 @gin.configurable(denylist=['observation_size', 'stack_size'])
@@ -174,8 +217,7 @@ class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
   """In graph wrapper for the python Replay Memory.
 
   Usage:
-    To add a transition:  run the operation add_transition_op
-                          (and feed all the placeholders in add_transition_ph)
+    To add transitions:   call add() or, for a whole episode, add_episode().
 
     To sample a batch:    Construct operations that depend on any of the
                           sampling tensors. Every sess.run using any of these
@@ -194,13 +236,6 @@ class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
     rewards
     next_states
     terminals
-
-    add_transition_op:    tf operation to add a transition to the replay
-                          memory. All the following placeholders need to be fed.
-    add_obs_ph
-    add_action_ph
-    add_reward_ph
-    add_terminal_ph
   """
 
   def __init__(self,
@@ -211,7 +246,11 @@ class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
                replay_capacity=1000000,
                batch_size=32,
                update_horizon=1,
-               gamma=1.0):
+               gamma=1.0,
+               backing_dir=None,
+               num_sampler_threads=0,
+               sample_queue_size=4,
+               prefetch_depth=1):
     """Initializes a graph wrapper for the python Replay Memory.
 
     Args:
@@ -224,6 +263,13 @@ class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
       batch_size: int.
       update_horizon: int, length of update ('n' in n-step update).
       gamma: int, the discount factor.
+      backing_dir: str, optional local directory for memory-mapped replay
+        buffers.
+      num_sampler_threads: int, number of background threads sampling
+        batches. If 0, batches are sampled when the sampling op runs.
+      sample_queue_size: int, number of batches the sampler threads keep
+        ready.
+      prefetch_depth: int, number of batches the staging area holds.
 
     Raises:
       ValueError: If update_horizon is not positive.
@@ -232,11 +278,13 @@ class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
     memory = OutOfGraphPrioritizedReplayMemory(num_actions, observation_size,
                                                stack_size, replay_capacity,
                                                batch_size, update_horizon,
-                                               gamma)
+                                               gamma, backing_dir=backing_dir)
     super(WrappedPrioritizedReplayMemory, self).__init__(
         num_actions,
         observation_size, stack_size, use_staging, replay_capacity, batch_size,
-        update_horizon, gamma, wrapped_memory=memory)
+        update_horizon, gamma, wrapped_memory=memory,
+        num_sampler_threads=num_sampler_threads,
+        sample_queue_size=sample_queue_size, prefetch_depth=prefetch_depth)
 
   def tf_set_priority(self, indices, losses):
     """Sets the priorities for the given indices.
@@ -247,10 +295,11 @@ class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
 
     Returns:
        A TF op setting the priorities according to Prioritized Experience
-       Replay.
+       Replay. With sampler threads, the op only queues the update.
     """
+    source = self.memory if self.sampler is None else self.sampler
     return tf.py_func(
-        self.memory.set_priority, [indices, losses],
+        source.set_priority, [indices, losses],
         [],
         name='prioritized_replay_set_priority_py_func')
 
@@ -263,7 +312,8 @@ class WrappedPrioritizedReplayMemory(replay_memory.WrappedReplayMemory):
     Returns:
        A tensor (float32) of priorities.
     """
+    source = self.memory if self.sampler is None else self.sampler
     return tf.py_func(
-        self.memory.get_priority, [indices],
+        source.get_priority, [indices],
         [tf.float32],
         name='prioritized_replay_get_priority_py_func')
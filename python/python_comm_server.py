@@ -1,9 +1,13 @@
 import socket
 import json
 import os
+import asyncio
+import struct
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from inference import predict_action  # 既存の推論関数
 import inference  # ファイル先頭で一度importしておけばOK（predict_actionのある同モジュール）
+import wire_protocol  # Unity とのバイナリ形式（JSON と併用可）
 import os, json
 
 # === 観測ベクトル検証オプション ===
@@ -13,6 +17,23 @@ OBS_BLOCKS_ENV = os.getenv("OBS_BLOCKS", "")               # 例: "100,50,200,30
 _OBS_GOLDEN = None
 _OBS_BLOCKS = None
 
+# === サーバモード ===
+# "oneshot": 従来どおり 1接続=1リクエスト（Unity 既存クライアント用）
+# "async"  : 常時接続・複数クライアント同時処理・パイプライン対応
+SERVER_MODE = os.getenv("SERVER_MODE", "oneshot")
+# async モードのフレーム形式: "line"（改行区切りJSON）/ "length"（4byte big-endian 長さ + JSON）
+# バイナリ形式（wire_protocol）は長さプレフィックス付きなので oneshot か FRAMING=length で受け付ける
+FRAMING = os.getenv("FRAMING", "line")
+# 1 で複数接続の推論要求をマイクロバッチ化（inference.BatchingInferenceEngine）
+INFER_BATCH = os.getenv("INFER_BATCH", "0") == "1"
+# predict_action を回すワーカースレッド数（accept ループとは別スレッド）
+# バッチ時はワーカーが結果待ちでブロックするだけなので、最大バッチ数ぶん用意する
+INFER_WORKERS = int(os.getenv("INFER_WORKERS", str(inference.BATCH_MAX_SIZE) if INFER_BATCH else "1"))
+MAX_FRAME_BYTES = 1 << 20
+# Unity（ExternalAIController）は 9000 の応答を読まず 8052 で行動を受け取るので、
+# サーバとして動くときだけ推論結果の push を既定で有効にする（UNITY_PUSH=0 で無効化）
+inference.UNITY_PUSH = os.getenv("UNITY_PUSH", "1") == "1"
+
 def _load_golden():
     global _OBS_GOLDEN, _OBS_BLOCKS
     try:
@@ -46,6 +67,120 @@ except Exception:
 # （必要なら）検証メタを通常応答に一度だけ同梱するフラグ
 _idx2move_sent = False
 
+# 通常の観測→推論で使う関数（バッチ有効時は同時要求を 1 回の forward にまとめる）
+_predict = inference.predict_action_batched if INFER_BATCH else predict_action
+
+
+def _verify_observation(observation, legal_actions):
+    """観測ベクトル＆合法手をゴールデンと比較してログを出す（応答には影響しない）。"""
+    try:
+        obs_rx = [int(x) for x in observation]
+        legal_rx = [float(x) for x in legal_actions]
+        obs_g = _OBS_GOLDEN["observation"]
+        legal_g = _OBS_GOLDEN["legal_actions"]
+
+        if len(obs_rx) != len(obs_g) or len(legal_rx) != len(legal_g):
+            print(f"[OBSCHK] ❌ shape mismatch: obs {len(obs_rx)} vs {len(obs_g)}, legal {len(legal_rx)} vs {len(legal_g)}")
+        else:
+            diff_idx = [i for i, (a, b) in enumerate(zip(obs_rx, obs_g)) if a != b]
+            diff_legal = [i for i, (a, b) in enumerate(zip(legal_rx, legal_g)) if not (a == b or (abs(a - b) < 1e-9))]
+            if not diff_idx and not diff_legal:
+                print("[OBSCHK] ✅ observation & legal_actions PERFECT MATCH")
+            else:
+                print(f"[OBSCHK] ❌ mismatch: obs_diff={len(diff_idx)}, legal_diff={len(diff_legal)}")
+                if diff_idx:
+                    head = diff_idx[:10]
+                    print(f"[OBSCHK]   first_obs_diffs_idx={head}")
+                    print(f"[OBSCHK]   sample_rx={[obs_rx[i] for i in head]}")
+                    print(f"[OBSCHK]   sample_g ={[obs_g[i]  for i in head]}")
+                    if _OBS_BLOCKS:
+                        s = 0
+                        for bi, blen in enumerate(_OBS_BLOCKS):
+                            e = s + blen
+                            sum_rx = sum(obs_rx[s:e])
+                            sum_g  = sum(obs_g[s:e])
+                            mark = "OK" if sum_rx == sum_g else "DIFF"
+                            print(f"[OBSCHK]   block#{bi} [{s}:{e}) sum_rx={sum_rx} sum_g={sum_g} -> {mark}")
+                            s = e
+                if diff_legal:
+                    head = diff_legal[:10]
+                    print(f"[OBSCHK]   legal first diffs idx={head}")
+                    print(f"[OBSCHK]   legal_rx_sample={[legal_rx[i] for i in head]}")
+                    print(f"[OBSCHK]   legal_g_sample ={[legal_g[i]  for i in head]}")
+    except Exception as e:
+        print(f"[OBSCHK] compare failed: {e}")
+
+
+def _handle_message(msg):
+    """1メッセージを処理して応答 dict を返す。応答不要なメッセージは None。
+
+    oneshot / async の両モードで共通。
+    """
+    global _idx2move_sent
+
+    if isinstance(msg, dict) and msg.get("type") == "mask_log_on":
+        inference.DEBUG_MASK = True
+        print("[Python][MASK] debug logging ENABLED")
+        return None
+
+    if isinstance(msg, dict) and msg.get("type") == "mask_log_off":
+        inference.DEBUG_MASK = False
+        print("[Python][MASK] debug logging DISABLED")
+        return None
+
+    if isinstance(msg, dict) and msg.get("type") == "idx2move_request":
+        # ★ 検証モード用の特別ハンドラ（ExternalAIController は関係なし）
+        print("[Python] sent idx2move_table to Unity (via 9000)")
+        return {"type": "idx2move_table", "items": (IDX2MOVE or [])}
+
+    if isinstance(msg, dict) and msg.get("type") == "golden_test":
+        # Unity から投げ込まれた観測/マスクで 1 回だけ推論して結果を返す
+        try:
+            obs = np.array(msg["observation"], dtype=np.uint8)
+            legal = np.array(msg["legal_actions"], dtype=np.float32)
+            action = predict_action(obs, legal)
+            print("[Python] golden_test → action:", action)
+            return {"type": "golden_result", "action": int(action)}
+        except Exception as e:
+            print("[Python] golden_test error:", e)
+            return {"type": "golden_result", "error": str(e)}
+
+    # ---- ここから通常の観測→推論→応答 ----
+    print("[Python] 受信データ構造確認:", list(msg.keys()))
+    # === 観測ベクトル＆合法手の比較（ゴールデンと一致か）===
+    if OBS_VERIFY and _OBS_GOLDEN is not None and isinstance(msg, dict) and "observation" in msg and "legal_actions" in msg:
+        _verify_observation(msg["observation"], msg["legal_actions"])
+    obs = np.array(msg["observation"], dtype=np.uint8)
+    legal = np.array(msg["legal_actions"], dtype=np.float32)
+
+    action = _predict(obs, legal)
+    print(f"[Python] 推論完了 → 選択アクション: {action}")
+
+    resp = {"action": int(action)}
+    # 任意：検証環境変数があるなら、最初だけ通常応答にも同梱（ExternalAIは無視しても壊れない）
+    if os.getenv("VERIFY_ACTIONMAP") == "1" and (not _idx2move_sent) and IDX2MOVE is not None:
+        resp["idx2move_table"] = IDX2MOVE
+        _idx2move_sent = True
+    return resp
+
+
+def _handle_binary(body):
+    """バイナリ形式の本体 → 応答本体（bytes）。観測要求にだけ応答し、結果は ACTION で返す。"""
+    request_id = 0
+    try:
+        msg_type, request_id, content = wire_protocol.decode(body)
+        if msg_type != wire_protocol.MSG_OBSERVATION:
+            raise wire_protocol.WireProtocolError(f"unexpected message type: {msg_type}")
+        obs, legal = content
+        if OBS_VERIFY and _OBS_GOLDEN is not None:
+            _verify_observation(obs, legal)
+        action = _predict(obs, legal)
+        print(f"[Python] 推論完了(binary) → 選択アクション: {action}")
+        return wire_protocol.encode_action(action, request_id)
+    except Exception as e:
+        print("エラー(binary):", e)
+        return wire_protocol.encode_error(e, request_id)
+
 
 def start_server(host='0.0.0.0', port=9000):
     if OBS_VERIFY:
@@ -64,89 +199,24 @@ def start_server(host='0.0.0.0', port=9000):
                     if not data:
                         continue
 
-                    msg = json.loads(data.decode('utf-8'))
-                    if isinstance(msg, dict) and msg.get("type") == "mask_log_on":
-                        inference.DEBUG_MASK = True
-                        print("[Python][MASK] debug logging ENABLED")
+                    if wire_protocol.is_binary_frame(data):
+                        # バイナリ形式: 長さプレフィックスぶん揃うまで読み、ACTION フレームで返す
+                        size = wire_protocol.frame_size(data)
+                        if size > MAX_FRAME_BYTES:
+                            raise ValueError(f"frame too large: {size}")
+                        while len(data) < size:
+                            chunk = conn.recv(size - len(data))
+                            if not chunk:
+                                raise ConnectionError("connection closed mid-frame")
+                            data += chunk
+                        resp = _handle_binary(data[4:size])
+                        conn.sendall(wire_protocol.frame(resp))
+                        print("[Python] Unityにアクション返信(binary)")
                         continue
 
-                    if isinstance(msg, dict) and msg.get("type") == "mask_log_off":
-                        inference.DEBUG_MASK = False
-                        print("[Python][MASK] debug logging DISABLED")
-                        continue
-                    if isinstance(msg, dict) and msg.get("type") == "idx2move_request":
-                        # ★ 検証モード用の特別ハンドラ（ExternalAIController は関係なし）
-                        meta = {"type": "idx2move_table", "items": (IDX2MOVE or [])}
-                        conn.sendall(json.dumps(meta, ensure_ascii=False).encode('utf-8'))
-                        print("[Python] sent idx2move_table to Unity (via 9000)")
-                        continue  # 次の接続へ
-
-                    # ---- ここから通常の観測→推論→応答 ----
-                    print("[Python] 受信データ構造確認:", list(msg.keys()))
-                    # === 観測ベクトル＆合法手の比較（ゴールデンと一致か）===
-                    if OBS_VERIFY and _OBS_GOLDEN is not None and isinstance(msg, dict) and "observation" in msg and "legal_actions" in msg:
-                        try:
-                            obs_rx = [int(x) for x in msg["observation"]]
-                            legal_rx = [float(x) for x in msg["legal_actions"]]
-                            obs_g = _OBS_GOLDEN["observation"]
-                            legal_g = _OBS_GOLDEN["legal_actions"]
-
-                            if len(obs_rx) != len(obs_g) or len(legal_rx) != len(legal_g):
-                                print(f"[OBSCHK] ❌ shape mismatch: obs {len(obs_rx)} vs {len(obs_g)}, legal {len(legal_rx)} vs {len(legal_g)}")
-                            else:
-                                diff_idx = [i for i, (a, b) in enumerate(zip(obs_rx, obs_g)) if a != b]
-                                diff_legal = [i for i, (a, b) in enumerate(zip(legal_rx, legal_g)) if not (a == b or (abs(a - b) < 1e-9))]
-                                if not diff_idx and not diff_legal:
-                                    print("[OBSCHK] ✅ observation & legal_actions PERFECT MATCH")
-                                else:
-                                    print(f"[OBSCHK] ❌ mismatch: obs_diff={len(diff_idx)}, legal_diff={len(diff_legal)}")
-                                    if diff_idx:
-                                        head = diff_idx[:10]
-                                        print(f"[OBSCHK]   first_obs_diffs_idx={head}")
-                                        print(f"[OBSCHK]   sample_rx={[obs_rx[i] for i in head]}")
-                                        print(f"[OBSCHK]   sample_g ={[obs_g[i]  for i in head]}")
-                                        if _OBS_BLOCKS:
-                                            s = 0
-                                            for bi, blen in enumerate(_OBS_BLOCKS):
-                                                e = s + blen
-                                                sum_rx = sum(obs_rx[s:e])
-                                                sum_g  = sum(obs_g[s:e])
-                                                mark = "OK" if sum_rx == sum_g else "DIFF"
-                                                print(f"[OBSCHK]   block#{bi} [{s}:{e}) sum_rx={sum_rx} sum_g={sum_g} -> {mark}")
-                                                s = e
-                                    if diff_legal:
-                                        head = diff_legal[:10]
-                                        print(f"[OBSCHK]   legal first diffs idx={head}")
-                                        print(f"[OBSCHK]   legal_rx_sample={[legal_rx[i] for i in head]}")
-                                        print(f"[OBSCHK]   legal_g_sample ={[legal_g[i]  for i in head]}")
-                        except Exception as e:
-                            print(f"[OBSCHK] compare failed: {e}")
-                    obs = np.array(msg["observation"], dtype=np.uint8)
-                    legal = np.array(msg["legal_actions"], dtype=np.float32)
-
-                    action = predict_action(obs, legal)
-                    print(f"[Python] 推論完了 → 選択アクション: {action}")
-
-                    resp = {"action": int(action)}
-                    global _idx2move_sent
-                    # 任意：検証環境変数があるなら、最初だけ通常応答にも同梱（ExternalAIは無視しても壊れない）
-                    if os.getenv("VERIFY_ACTIONMAP") == "1" and (not _idx2move_sent) and IDX2MOVE is not None:
-                        resp["idx2move_table"] = IDX2MOVE
-                        _idx2move_sent = True
-                    
-                    if isinstance(msg, dict) and msg.get("type") == "golden_test":
-                        # Unity から投げ込まれた観測/マスクで 1 回だけ推論して結果を返す
-                        try:
-                            obs = np.array(msg["observation"], dtype=np.uint8)
-                            legal = np.array(msg["legal_actions"], dtype=np.float32)
-                            action = predict_action(obs, legal)
-                            resp = {"type": "golden_result", "action": int(action)}
-                            conn.sendall(json.dumps(resp, ensure_ascii=False).encode('utf-8'))
-                            print("[Python] golden_test → action:", action)
-                        except Exception as e:
-                            err = {"type": "golden_result", "error": str(e)}
-                            conn.sendall(json.dumps(err, ensure_ascii=False).encode('utf-8'))
-                            print("[Python] golden_test error:", e)
+                    msg = json.loads(data.decode('utf-8'))
+                    resp = _handle_message(msg)
+                    if resp is None:
                         continue
 
                     conn.sendall(json.dumps(resp, ensure_ascii=False).encode('utf-8'))
@@ -156,5 +226,130 @@ def start_server(host='0.0.0.0', port=9000):
                     print("エラー:", e)
 
 
+# ===================== async（常時接続）モード =====================
+
+def _handle_frame(raw):
+    """受信フレーム（bytes）→ 応答 dict。request_id があればそのまま返す。
+
+    先頭が wire_protocol.MAGIC のフレームはバイナリ形式として扱い、応答も bytes で返す。
+    """
+    if wire_protocol.is_binary(raw):
+        return _handle_binary(raw)
+    try:
+        msg = json.loads(raw.decode('utf-8'))
+    except Exception as e:
+        print("エラー(JSON):", e)
+        return {"error": f"invalid json: {e}"}
+    try:
+        resp = _handle_message(msg)
+    except Exception as e:
+        print("エラー:", e)
+        resp = {"error": str(e)}
+    if resp is not None and isinstance(msg, dict) and "request_id" in msg:
+        resp["request_id"] = msg["request_id"]
+    return resp
+
+
+async def _read_frame(reader, framing):
+    """1フレーム読み出す。接続終了なら None。"""
+    if framing == "length":
+        try:
+            header = await reader.readexactly(4)
+            (length,) = struct.unpack(">I", header)
+            if length > MAX_FRAME_BYTES:
+                raise ValueError(f"frame too large: {length}")
+            return await reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return None
+
+    line = await reader.readline()
+    if not line:
+        return None
+    # 改行なしで half-close したクライアント（旧来の 1 発送信）もそのまま 1 フレームとして扱う
+    line = line.strip()
+    return line if line else b""
+
+
+def _encode_frame(resp, framing):
+    if isinstance(resp, bytes):  # バイナリ形式の応答（_handle_binary）
+        return struct.pack(">I", len(resp)) + resp
+    payload = json.dumps(resp, ensure_ascii=False).encode('utf-8')
+    if framing == "length":
+        return struct.pack(">I", len(payload)) + payload
+    return payload + b"\n"
+
+
+async def _serve_connection(reader, writer, executor, framing):
+    """1 接続を処理する。
+
+    受信したフレームは即座に executor へ投入し（パイプライン）、
+    応答は受信順に書き戻す。推論が accept ループや他接続をブロックすることはない。
+    """
+    loop = asyncio.get_event_loop()
+    addr = writer.get_extra_info("peername")
+    print(f"[Python] Unityと接続(常時接続): {addr}")
+
+    pending = asyncio.Queue()
+
+    async def _reply_in_order():
+        while True:
+            fut = await pending.get()
+            if fut is None:
+                return
+            try:
+                resp = await fut
+            except Exception as e:
+                resp = {"error": str(e)}
+            if resp is None:
+                continue
+            writer.write(_encode_frame(resp, framing))
+            await writer.drain()
+
+    replier = asyncio.ensure_future(_reply_in_order())
+    try:
+        while True:
+            raw = await _read_frame(reader, framing)
+            if raw is None:
+                break
+            if not raw:
+                continue
+            await pending.put(loop.run_in_executor(executor, _handle_frame, raw))
+    except (ConnectionError, ValueError) as e:
+        print("エラー(接続):", e)
+    finally:
+        await pending.put(None)
+        try:
+            await replier
+        except ConnectionError:
+            pass
+        writer.close()
+        print(f"[Python] 接続終了: {addr}")
+
+
+async def _serve_async(host, port, framing, workers):
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="infer")
+    server = await asyncio.start_server(
+        lambda r, w: _serve_connection(r, w, executor, framing),
+        host, port, limit=MAX_FRAME_BYTES)
+    async with server:
+        await server.serve_forever()
+
+
+def start_async_server(host='0.0.0.0', port=9000, framing=FRAMING, workers=INFER_WORKERS):
+    """常時接続・多クライアント対応の推論サーバ。
+
+    - 1 接続で複数リクエストを送れる（改行区切り or 長さプレフィックス）
+    - 同一接続内のリクエストはパイプライン処理し、受信順に応答する
+    - predict_action はワーカースレッドで実行するので accept ループは止まらない
+    """
+    if OBS_VERIFY:
+        _load_golden()
+    print(f"[Python] Rainbow推論サーバ(async, framing={framing}, workers={workers}) 起動中 ({host}:{port})...")
+    asyncio.run(_serve_async(host, port, framing, workers))
+
+
 if __name__ == "__main__":
-    start_server()
+    if SERVER_MODE == "async":
+        start_async_server()
+    else:
+        start_server()
@@ -86,6 +86,7 @@ class RainbowAgent(dqn_agent.DQNAgent):
                update_horizon=1,
                min_replay_history=500,
                update_period=4,
+               history_size=1,
                target_update_period=500,
                epsilon_train=0.0,
                epsilon_eval=0.0,
@@ -106,6 +107,8 @@ class RainbowAgent(dqn_agent.DQNAgent):
         n-step update.
       min_replay_history: int, number of stored transitions before training.
       update_period: int, period between DQN updates.
+      history_size: int, number of frames stacked into each observation, see
+        `DQNAgent`.
       target_update_period: int, update period for the target network.
       epsilon_train: float, final epsilon for training.
       epsilon_eval: float, epsilon during evaluation.
@@ -132,6 +135,7 @@ class RainbowAgent(dqn_agent.DQNAgent):
         update_horizon=update_horizon,
         min_replay_history=min_replay_history,
         update_period=update_period,
+        history_size=history_size,
         target_update_period=target_update_period,
         epsilon_train=epsilon_train,
         epsilon_eval=epsilon_eval,
@@ -154,8 +158,8 @@ class RainbowAgent(dqn_agent.DQNAgent):
     """
     return prioritized_replay_memory.WrappedPrioritizedReplayMemory(
         num_actions=self.num_actions,
-        observation_size=self.observation_size,
-        stack_size=1,
+        observation_size=self.frame_size,
+        stack_size=self.history_size,
         use_staging=use_staging,
         update_horizon=self.update_horizon,
         gamma=self.gamma)
@@ -170,6 +174,11 @@ class RainbowAgent(dqn_agent.DQNAgent):
     self._q = tf.reduce_sum(self.support * self._probabilities, axis=2)
     # Recompute argmax from q values. Ignore illegal actions.
     self._q_argmax = tf.argmax(self._q + self.legal_actions_ph, axis=1)[0]
+    # Same conversion for the batched serving network.
+    # size of _batch_q: batch_size x num_actions
+    self._batch_probabilities = tf.contrib.layers.softmax(self._batch_q)
+    self._batch_q = tf.reduce_sum(
+        self.support * self._batch_probabilities, axis=2)
 
     # size of _replay_logits: 1 x num_actions x num_atoms
     self._replay_logits = self._replay_qs
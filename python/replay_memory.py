@@ -31,10 +31,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import glob
 import gzip
 import math
 import os
 import pickle
+import queue
+import threading
 
 import gin.tf
 import numpy as np
@@ -44,6 +48,9 @@ import tensorflow as tf
 # This constant determines how many iterations a checkpoint is kept for.
 CHECKPOINT_DURATION = 4
 MAX_SAMPLE_ATTEMPTS = 1000000
+# Replay snapshots alternate between this many sets of buffer files, so that
+# the previous snapshot stays loadable while the next one is written.
+SNAPSHOT_SLOTS = 2
 
 
 def invalid_range(cursor, replay_capacity, stack_size):
@@ -64,6 +71,86 @@ def invalid_range(cursor, replay_capacity, stack_size):
       [(cursor - 1 + i) % replay_capacity for i in range(stack_size)])
 
 
+def open_backing_array(backing_dir, name, shape, dtype):
+  """Opens a `.npy` file in backing_dir as a writable memory map.
+
+  An existing file with the same shape and dtype is reopened with its contents,
+  otherwise a new zero-filled file is created.
+
+  Args:
+    backing_dir: str, directory holding the backing files.
+    name: str, name of the array.
+    shape: tuple of ints, shape of the array.
+    dtype: numpy dtype of the array.
+
+  Returns:
+    `np.memmap` backed by `<backing_dir>/<name>.npy`.
+  """
+  filename = os.path.join(backing_dir, '{}.npy'.format(name))
+  if os.path.exists(filename):
+    array = np.lib.format.open_memmap(filename, mode='r+')
+    if array.shape == tuple(shape) and array.dtype == np.dtype(dtype):
+      return array
+    del array
+  return np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                   shape=shape)
+
+
+def legal_actions_dtype(num_actions):
+  """Returns the smallest unsigned integer type holding a legal-action mask.
+
+  Args:
+    num_actions: int, number of possible actions.
+
+  Returns:
+    `np.uint32` or `np.uint64`.
+
+  Raises:
+    ValueError: If there are more than 64 actions.
+  """
+  if num_actions <= 32:
+    return np.uint32
+  if num_actions <= 64:
+    return np.uint64
+  raise ValueError('Cannot pack {} legal actions into a 64-bit mask.'.format(
+      num_actions))
+
+
+def pack_legal_actions(legal_actions, num_actions):
+  """Packs legal-action vectors into integer bitmasks.
+
+  Bit i of the mask is set when action i is legal, i.e. when its entry is 0
+  (illegal actions are -inf, see run_experiment.format_legal_moves).
+
+  Args:
+    legal_actions: `np.array` of floats, shape (..., num_actions).
+    num_actions: int, number of possible actions.
+
+  Returns:
+    `np.array` of shape (...), of type `legal_actions_dtype(num_actions)`.
+  """
+  dtype = legal_actions_dtype(num_actions)
+  bits = np.left_shift(dtype(1), np.arange(num_actions, dtype=dtype))
+  return np.dot(np.asarray(legal_actions) == 0, bits).astype(dtype)
+
+
+def unpack_legal_actions(masks, num_actions):
+  """Inverse of `pack_legal_actions`.
+
+  Args:
+    masks: `np.array` of integer bitmasks, shape (...).
+    num_actions: int, number of possible actions.
+
+  Returns:
+    `np.array` float32 of shape (..., num_actions), with 0 for legal actions
+    and -inf for illegal ones.
+  """
+  masks = np.asarray(masks)
+  shifts = np.arange(num_actions, dtype=masks.dtype)
+  legal = (masks[..., None] >> shifts) & 1
+  return np.where(legal != 0, np.float32(0), np.float32(-np.inf))
+
+
 class OutOfGraphReplayMemory(object):
   """A simple out of graph replay memory.
 
@@ -71,18 +158,27 @@ class OutOfGraphReplayMemory(object):
   efficiently when the states consist of stacks. The writing behaves like
   a FIFO buffer and the sampling is uniformly random.
 
+  Observations are binary, so they are stored bit-packed (one bit per
+  feature), and legal actions are stored as one integer bitmask per
+  transition. Both are unpacked only for the sampled batch.
+
+  With a backing_dir, the circular buffers and add_count are memory-mapped
+  `.npy` files on local disk instead of process memory, so the capacity is not
+  bounded by RAM and a memory reopened on the same directory resumes where the
+  previous process stopped.
+
   Attributes:
     add_count:  counter of how many transitions have been added.
-    observations: `np.array`, circular buffer of observations.
+    observations: `np.array`, circular buffer of bit-packed observations.
     actions: `np.array`, circular buffer of actions.
     rewards: `np.array`, circular buffer of rewards.
     terminals: `np.array`, circular buffer of terminals.
-    legal_actions: `np.array`, circular buffer of legal actions for hanabi.
+    legal_actions: `np.array`, circular buffer of legal-action bitmasks.
     invalid_range: `np.array`, currently invalid indices.
   """
 
   def __init__(self, num_actions, observation_size, stack_size, replay_capacity,
-               batch_size, update_horizon=1, gamma=1.0):
+               batch_size, update_horizon=1, gamma=1.0, backing_dir=None):
     """Data structure doing the heavy lifting.
 
     Args:
@@ -93,7 +189,10 @@ class OutOfGraphReplayMemory(object):
       batch_size: int, batch size.
       update_horizon: int, length of update ('n' in n-step update).
       gamma: float, the discount factor.
+      backing_dir: str, optional local directory for memory-mapped buffers.
+        If None, the buffers are held in memory.
     """
+    self._backing_dir = backing_dir
     self._observation_size = observation_size
     self._num_actions = num_actions
     self._replay_capacity = replay_capacity
@@ -109,17 +208,43 @@ class OutOfGraphReplayMemory(object):
         dtype=np.float32)
 
     # Create numpy arrays used to store sampled transitions.
-    self.observations = np.empty(
-        (replay_capacity, observation_size), dtype=np.uint8)
-    self.actions = np.empty((replay_capacity), dtype=np.int32)
-    self.rewards = np.empty((replay_capacity), dtype=np.float32)
-    self.terminals = np.empty((replay_capacity), dtype=np.uint8)
-    self.legal_actions = np.empty((replay_capacity, num_actions),
-                                  dtype=np.float32)
+    if backing_dir is not None:
+      tf.gfile.MakeDirs(backing_dir)
+
+    def allocate(name, shape, dtype):
+      if backing_dir is None:
+        return np.empty(shape, dtype=dtype)
+      return open_backing_array(backing_dir, name, shape, dtype)
+
+    self.observations = allocate(
+        'observations', (replay_capacity, (observation_size + 7) // 8),
+        np.uint8)
+    self.actions = allocate('actions', (replay_capacity,), np.int32)
+    self.rewards = allocate('rewards', (replay_capacity,), np.float32)
+    self.terminals = allocate('terminals', (replay_capacity,), np.uint8)
+    self.legal_actions = allocate('legal_actions', (replay_capacity,),
+                                  legal_actions_dtype(num_actions))
     self.reset_state_batch_arrays(batch_size)
-    self.add_count = np.array(0)
+    if backing_dir is None:
+      self.add_count = np.array(0)
+    else:
+      self.add_count = open_backing_array(backing_dir, 'add_count', (),
+                                          np.int64)
 
     self.invalid_range = np.zeros((self._stack_size))
+    if not self.is_empty():
+      tf.logging.info('Reopened replay memory in %s with %d transitions.',
+                      backing_dir, int(self.add_count))
+      self.invalid_range = invalid_range(self.cursor(), self._replay_capacity,
+                                         self._stack_size)
+
+    # Bookkeeping for incremental snapshots, see save(): the slot of the newest
+    # complete snapshot in _snapshot_dir, and the add_count each slot holds.
+    self._snapshot_dir = None
+    self._snapshot_slot = None
+    self._slot_add_counts = {}
+    self._save_thread = None
+    self._save_error = None
 
   def add(self, observation, action, reward, terminal, legal_actions):
     """Adds a transition to the replay memory.
@@ -130,7 +255,7 @@ class OutOfGraphReplayMemory(object):
     If the replay memory is at capacity the oldest transition will be discarded.
 
     Args:
-      observation: `np.array` uint8, (observation_size).
+      observation: `np.array` uint8, (observation_size), binary features.
       action: uint8, indicating the action in the transition.
       reward: float, indicating the reward received in the transition.
       terminal: uint8, acting as a boolean indicating whether the transition
@@ -146,15 +271,103 @@ class OutOfGraphReplayMemory(object):
 
   def _add(self, observation, action, reward, terminal, legal_actions):
     cursor = self.cursor()
-    self.observations[cursor] = observation
+    self.observations[cursor] = np.packbits(np.asarray(observation) != 0)
     self.actions[cursor] = action
     self.rewards[cursor] = reward
     self.terminals[cursor] = terminal
-    self.legal_actions[cursor] = legal_actions
+    self.legal_actions[cursor] = pack_legal_actions(legal_actions,
+                                                    self._num_actions)
     self.add_count += 1
     self.invalid_range = invalid_range(self.cursor(), self._replay_capacity,
                                        self._stack_size)
 
+  def add_episode(self, observations, actions, rewards, terminals,
+                  legal_actions):
+    """Adds consecutive transitions, typically one episode, in one call.
+
+    Equivalent to calling `add` on each transition in order, but writes the
+    ring buffers with array slicing.
+
+    Args:
+      observations: `np.array`, (n, observation_size) binary features.
+      actions: `np.array` of n ints.
+      rewards: `np.array` of n floats.
+      terminals: `np.array` of n bools.
+      legal_actions: `np.array`, (n, num_actions), with -inf meaning not
+        legal.
+    """
+    if not len(actions):
+      return
+    rows, _ = self._episode_rows(observations, actions, rewards, terminals,
+                                 legal_actions)
+    self._add_rows(*rows)
+
+  def _episode_rows(self, observations, actions, rewards, terminals,
+                    legal_actions):
+    """Lays out transitions as `add` would write them, with dummy frames.
+
+    Returns:
+      The packed rows (observations, actions, rewards, terminals,
+      legal_actions) to write, and a boolean `np.array` marking the dummy
+      rows.
+    """
+    terminals = np.asarray(terminals) != 0
+    num_transitions = len(terminals)
+    # add() pads with stack_size - 1 dummy frames before the first transition
+    # of each episode.
+    starts_episode = np.empty(num_transitions, dtype=bool)
+    starts_episode[0] = self.is_empty() or self.terminals[self.cursor() - 1] == 1
+    starts_episode[1:] = terminals[:-1]
+    num_dummies = starts_episode * (self._stack_size - 1)
+    positions = np.arange(num_transitions) + np.cumsum(num_dummies)
+    num_rows = num_transitions + int(num_dummies.sum())
+
+    dummy = np.ones(num_rows, dtype=bool)
+    dummy[positions] = False
+    packed_observations = np.zeros((num_rows,) + self.observations.shape[1:],
+                                   dtype=self.observations.dtype)
+    packed_observations[positions] = np.packbits(
+        np.asarray(observations) != 0, axis=1)
+    row_actions = np.zeros(num_rows, dtype=self.actions.dtype)
+    row_actions[positions] = actions
+    row_rewards = np.zeros(num_rows, dtype=self.rewards.dtype)
+    row_rewards[positions] = rewards
+    row_terminals = np.zeros(num_rows, dtype=self.terminals.dtype)
+    row_terminals[positions] = terminals
+    # Dummy frames have every action legal, as in add().
+    row_legal_actions = np.full(
+        num_rows, pack_legal_actions(np.zeros(self._num_actions),
+                                     self._num_actions),
+        dtype=self.legal_actions.dtype)
+    row_legal_actions[positions] = pack_legal_actions(legal_actions,
+                                                      self._num_actions)
+    rows = (packed_observations, row_actions, row_rewards, row_terminals,
+            row_legal_actions)
+    return rows, dummy
+
+  def _add_rows(self, observations, actions, rewards, terminals,
+                legal_actions):
+    """Writes packed rows at the cursor.
+
+    Returns:
+      `np.array`, the indices written. If there are more rows than the
+      capacity, only the last replay_capacity rows are written.
+    """
+    num_rows = len(actions)
+    num_kept = min(num_rows, self._replay_capacity)
+    kept = slice(num_rows - num_kept, num_rows)
+    indices = ((self.add_count + np.arange(num_rows - num_kept, num_rows)) %
+               self._replay_capacity)
+    self.observations[indices] = observations[kept]
+    self.actions[indices] = actions[kept]
+    self.rewards[indices] = rewards[kept]
+    self.terminals[indices] = terminals[kept]
+    self.legal_actions[indices] = legal_actions[kept]
+    self.add_count += num_rows
+    self.invalid_range = invalid_range(self.cursor(), self._replay_capacity,
+                                       self._stack_size)
+    return indices
+
   def is_empty(self):
     """Is the replay memory empty?"""
     return self.add_count == 0
@@ -193,12 +406,57 @@ class OutOfGraphReplayMemory(object):
     return stack
 
   def get_observation_stack(self, index):
-    state = self.get_stack(self.observations, index)
+    state = np.unpackbits(self.get_stack(self.observations, index), axis=-1,
+                          count=self._observation_size)
     return np.transpose(state, [1, 0])
 
   def get_terminal_stack(self, index):
     return self.get_stack(self.terminals, index)
 
+  def _stack_indices(self, indices):
+    """Returns the memory indices making up the stacks ending at `indices`.
+
+    Args:
+      indices: `np.array` of ints, index of the last frame of each stack.
+
+    Returns:
+      `np.array` of shape (len(indices), stack_size), oldest frame first.
+    """
+    offsets = np.arange(1 - self._stack_size, 1)
+    return (indices[:, None] + offsets) % self._replay_capacity
+
+  def get_observation_stacks(self, indices):
+    """Vectorized `get_observation_stack` for an array of indices.
+
+    Args:
+      indices: `np.array` of ints, indices of the stacks to fetch.
+
+    Returns:
+      `np.array` of shape (len(indices), observation_size, stack_size).
+    """
+    stacks = np.unpackbits(
+        self._gather(self.observations, self._stack_indices(indices)),
+        axis=-1, count=self._observation_size)
+    return np.transpose(stacks, [0, 2, 1])
+
+  def _gather(self, array, indices):
+    """Returns `array[indices]`, reading memory-mapped rows in file order.
+
+    Args:
+      array: `np.array`, one of the circular buffers.
+      indices: `np.array` of ints, rows to read.
+
+    Returns:
+      `np.array` of shape indices.shape + array.shape[1:].
+    """
+    if self._backing_dir is None:
+      return array[indices]
+    flat_indices = indices.ravel()
+    order = np.argsort(flat_indices, kind='stable')
+    rows = np.empty((flat_indices.size,) + array.shape[1:], dtype=array.dtype)
+    rows[order] = array[flat_indices[order]]
+    return rows.reshape(indices.shape + array.shape[1:])
+
   def is_valid_transition(self, index):
     """Checks if the index contains a valid transition.
 
@@ -213,27 +471,35 @@ class OutOfGraphReplayMemory(object):
       bool, True if transition is valid.
 
     """
+    return bool(self.valid_transitions(np.array([index]))[0])
+
+  def valid_transitions(self, indices):
+    """Vectorized `is_valid_transition`.
+
+    Args:
+      indices: `np.array` of ints, candidate indices to the state in the
+        transition.
+
+    Returns:
+      `np.array` of bools, True where the transition is valid.
+    """
     # Range checks
-    if index < 0 or index >= self._replay_capacity:
-      return False
+    valid = (indices >= 0) & (indices < self._replay_capacity)
     if not self.is_full():
       # The indices and next_indices must be smaller than the cursor.
-      if index >= self.cursor() - self._update_horizon:
-        return False
+      valid &= indices < self.cursor() - self._update_horizon
       # The first few indices contain the padding states of the first episode.
-      if index < self._stack_size - 1:
-        return False
+      valid &= indices >= self._stack_size - 1
 
     # Skip transitions that straddle the cursor.
-    if index in set(self.invalid_range):
-      return False
+    valid &= ~np.isin(indices, self.invalid_range)
 
     # If there are terminal flags in any other frame other than the last one
     # the stack is not valid, so don't sample it.
-    if self.get_terminal_stack(index)[:-1].any():
-      return False
-
-    return True
+    if self._stack_size > 1:
+      stack_terminals = self.terminals[self._stack_indices(indices)]
+      valid &= ~stack_terminals[:, :-1].any(axis=1)
+    return valid
 
   def reset_state_batch_arrays(self, batch_size):
     self._next_state_batch = np.empty(
@@ -244,27 +510,36 @@ class OutOfGraphReplayMemory(object):
   def sample_index_batch(self, batch_size):
     """Returns a batch of valid indices.
 
+    Candidates are drawn in bulk and validated with array masks. Each round
+    draws exactly as many candidates as are still missing, so the random
+    stream, and hence the batch, is the same as when drawing and checking one
+    index at a time.
+
     Args:
       batch_size: int, number of indices returned.
 
     Returns:
-      list of batch_size, containing valid indices.
+      `np.array` of batch_size, containing valid indices.
 
     Raises:
       Exception: If the batch was not constructed after maximum number of tries.
     """
-    indices = []
+    indices = np.empty((0,), dtype=np.int64)
     attempt_count = 0
     while len(indices) < batch_size and attempt_count < MAX_SAMPLE_ATTEMPTS:
-      attempt_count += 1
+      num_draws = min(batch_size - len(indices),
+                      MAX_SAMPLE_ATTEMPTS - attempt_count)
+      attempt_count += num_draws
       # index references the state and index + 1 points to next_state
       if self.is_full():
-        index = np.random.randint(0, self._replay_capacity)
+        candidates = np.random.randint(0, self._replay_capacity,
+                                       size=num_draws)
       else:
         # Can't start at 0 because the buffer is not yet circular
-        index = np.random.randint(self._stack_size - 1, self.cursor() - 1)
-      if self.is_valid_transition(index):
-        indices.append(index)
+        candidates = np.random.randint(self._stack_size - 1,
+                                       self.cursor() - 1, size=num_draws)
+      indices = np.concatenate(
+          [indices, candidates[self.valid_transitions(candidates)]])
     if len(indices) != batch_size:
       raise Exception('I tried %i times but only sampled %i valid transitions' %
                       (MAX_SAMPLE_ATTEMPTS, len(indices)))
@@ -298,50 +573,43 @@ class OutOfGraphReplayMemory(object):
                                                                 self.add_count))
     if indices is None:
       indices = self.sample_index_batch(batch_size)
+    indices = np.asarray(indices, dtype=np.int64)
     assert len(indices) == batch_size
 
-    action_batch = self.actions[indices]
-    reward_batch = np.empty((batch_size), dtype=np.float32)
-    terminal_batch = np.empty((batch_size), dtype=np.uint8)
-    indices_batch = np.empty((batch_size), dtype=np.int32)
-    next_legal_actions_batch = np.empty((batch_size, self._num_actions),
-                                        dtype=np.float32)
-
-    for batch_element, memory_index in enumerate(indices):
-      indices_batch[batch_element] = memory_index
-
-      self._state_batch[batch_element] = self.get_observation_stack(
-          memory_index)
-
-      # Compute indices in the replay memory up to n steps ahead.
-      trajectory_indices = [(memory_index + j) % self._replay_capacity for
-                            j in range(self._update_horizon)]
-
-      # Determine if this trajectory segment contains a terminal state.
-      terminals_in_trajectory = np.nonzero(self.terminals[trajectory_indices])
-      if terminals_in_trajectory[0].size == 0:
-        # If not, sum rewards along the trajectory, property discounted.
-        terminal_batch[batch_element] = 0
-        reward_batch[batch_element] = self._cumulative_discount_vector.dot(
-            self.rewards[trajectory_indices])
-      else:
-        # Updates leading to a terminal state require a little more care, in
-        # particular to avoid summing rewards past the end of the episode.
-        terminal_batch[batch_element] = 1
-        # Fetch smallest index corresponding to a terminal state.
-        terminal_index = np.min(terminals_in_trajectory)
-
-        truncated_discount_vector = (
-            self._cumulative_discount_vector[0:terminal_index + 1])
-        reward_batch[batch_element] = truncated_discount_vector.dot(
-            self.rewards[trajectory_indices[0:terminal_index + 1]])
-
-      bootstrap_state_index = (
-          (memory_index + self._update_horizon) % self._replay_capacity)
-      self._next_state_batch[batch_element] = (
-          self.get_observation_stack(bootstrap_state_index))
-      next_legal_actions_batch[batch_element] = (
-          self.legal_actions[bootstrap_state_index])
+    action_batch = self._gather(self.actions, indices)
+    indices_batch = indices.astype(np.int32)
+    self._state_batch[...] = self.get_observation_stacks(indices)
+
+    # Compute indices in the replay memory up to n steps ahead.
+    trajectory_indices = (
+        (indices[:, None] + np.arange(self._update_horizon)) %
+        self._replay_capacity)
+
+    # Determine if each trajectory segment contains a terminal state, and if so
+    # the smallest index corresponding to one. Rewards past the end of the
+    # episode are masked out rather than summed.
+    trajectory_terminals = self._gather(self.terminals,
+                                        trajectory_indices) != 0
+    is_terminal = trajectory_terminals.any(axis=1)
+    last_index = np.where(is_terminal, np.argmax(trajectory_terminals, axis=1),
+                          self._update_horizon - 1)
+    in_episode = np.arange(self._update_horizon) <= last_index[:, None]
+    # Sum rewards along the trajectory, properly discounted. Products are taken
+    # in float32 and accumulated in float64, as the float32 dot product did.
+    discounted_rewards = (
+        self._gather(self.rewards, trajectory_indices) *
+        np.where(in_episode, self._cumulative_discount_vector, 0.))
+    reward_batch = np.sum(
+        discounted_rewards, axis=1, dtype=np.float64).astype(np.float32)
+    terminal_batch = is_terminal.astype(np.uint8)
+
+    bootstrap_state_indices = (
+        (indices + self._update_horizon) % self._replay_capacity)
+    self._next_state_batch[...] = self.get_observation_stacks(
+        bootstrap_state_indices)
+    next_legal_actions_batch = unpack_legal_actions(
+        self._gather(self.legal_actions, bootstrap_state_indices),
+        self._num_actions)
 
     return (self._state_batch, action_batch, reward_batch,
             self._next_state_batch, terminal_batch, indices_batch,
@@ -350,10 +618,57 @@ class OutOfGraphReplayMemory(object):
   def _generate_filename(self, checkpoint_dir, name, suffix):
     return os.path.join(checkpoint_dir, '{}_ckpt.{}.gz'.format(name, suffix))
 
+  def _snapshot_filename(self, checkpoint_dir, name, slot):
+    return os.path.join(checkpoint_dir, 'replay_{}.{}.npy'.format(name, slot))
+
+  def _snapshot_owner_filename(self, checkpoint_dir, slot):
+    return os.path.join(checkpoint_dir, 'replay_slot.{}'.format(slot))
+
+  def _read_snapshot_owner(self, checkpoint_dir, slot):
+    """Returns the suffix of the snapshot held by slot, or None."""
+    filename = self._snapshot_owner_filename(checkpoint_dir, slot)
+    if not os.path.exists(filename):
+      return None
+    with open(filename, 'r') as f:
+      return f.read().strip()
+
+  def _next_snapshot_slot(self, checkpoint_dir):
+    """Returns the slot that does not hold the newest complete snapshot."""
+    if self._snapshot_slot is not None:
+      return (self._snapshot_slot + 1) % SNAPSHOT_SLOTS
+    # Nothing saved or loaded from this directory yet: take a free slot, or the
+    # one holding the oldest snapshot.
+    owners = [self._read_snapshot_owner(checkpoint_dir, slot)
+              for slot in range(SNAPSHOT_SLOTS)]
+    if None in owners:
+      return owners.index(None)
+    return min(range(SNAPSHOT_SLOTS), key=lambda slot: int(owners[slot]))
+
+  def _snapshot_meta_filename(self, checkpoint_dir, suffix):
+    return os.path.join(checkpoint_dir,
+                        'replay_meta_ckpt.{}.pkl'.format(suffix))
+
+  def _ring_attributes(self):
+    """Returns the names of the public circular buffers."""
+    return [attr for attr, value in self.__dict__.items()
+            if not attr.startswith('_') and isinstance(value, np.ndarray) and
+            value.ndim > 0 and value.shape[0] == self._replay_capacity]
+
   def save(self, checkpoint_dir, iteration_number):
-    """Save the python replay memory attributes into a file.
+    """Snapshots the replay memory into checkpoint_dir.
+
+    Snapshots alternate between SNAPSHOT_SLOTS sets of raw `.npy` files, one
+    file per circular buffer, so that writing one never touches the newest
+    complete snapshot. A slot's files are updated in place: only the rows added
+    since that slot was last written are stored. All other public attributes
+    (counters, the sum tree of the prioritized memory, ...) are pickled into a
+    small meta file named after iteration_number. The slot is handed over to
+    iteration_number last, by rewriting its owner file; meta files of
+    snapshots that no longer own a slot are then removed.
 
-    This method will save all the replay memory's state in a single file.
+    Only copying the changed rows happens on the caller's thread; the disk
+    writes run on a background thread. Callers must `wait_for_save` before
+    recording the snapshot anywhere else (e.g. in an experiment checkpoint).
 
     Args:
       checkpoint_dir: str, directory where numpy checkpoint files should be
@@ -363,33 +678,159 @@ class OutOfGraphReplayMemory(object):
     """
     if not tf.gfile.Exists(checkpoint_dir):
       return
-    for attr in self.__dict__:
-      if not attr.startswith('_'):
-        filename = self._generate_filename(checkpoint_dir, attr,
-                                           iteration_number)
-        with tf.gfile.Open(filename, 'wb') as f:
-          with gzip.GzipFile(fileobj=f) as outfile:
-            # Checkpoint numpy arrays directly with np.save to avoid excessive
-            # memory usage. This is particularly important for the observations
-            # data.
-            if isinstance(self.__dict__[attr], np.ndarray):
-              np.save(outfile, self.__dict__[attr], allow_pickle=False)
-            else:
-              pickle.dump(self.__dict__[attr], outfile)
-
-      # After writing a checkpoint file, we garbage collect the checkpoint file
-      # that is four versions old.
-      stale_iteration_number = iteration_number - CHECKPOINT_DURATION
-      if stale_iteration_number >= 0:
-        stale_filename = self._generate_filename(checkpoint_dir, attr,
-                                                 stale_iteration_number)
-        try:
-          tf.gfile.Remove(stale_filename)
-        except tf.errors.NotFoundError:
-          pass
+    self.wait_for_save()
+
+    if checkpoint_dir != self._snapshot_dir:
+      self._snapshot_dir = checkpoint_dir
+      self._snapshot_slot = None
+      self._slot_add_counts = {}
+    slot = self._next_snapshot_slot(checkpoint_dir)
+    slot_add_count = self._slot_add_counts.get(slot)
+
+    add_count = int(self.add_count)
+    ring_attrs = self._ring_attributes()
+    incremental = (
+        slot_add_count is not None and
+        add_count - slot_add_count < self._replay_capacity and
+        all(os.path.exists(self._snapshot_filename(checkpoint_dir, attr, slot))
+            for attr in ring_attrs))
+    if incremental:
+      rows = np.arange(slot_add_count, add_count) % self._replay_capacity
+      changed = {attr: self.__dict__[attr][rows] for attr in ring_attrs}
+    else:
+      rows = None
+      changed = {attr: np.copy(self.__dict__[attr]) for attr in ring_attrs}
+    meta = {attr: value for attr, value in self.__dict__.items()
+            if not attr.startswith('_') and attr not in ring_attrs}
+    meta['_slot'] = slot
+    meta = pickle.dumps(meta, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Not a daemon: the interpreter waits for a pending snapshot on exit.
+    self._save_thread = threading.Thread(
+        target=self._write_snapshot, name='replay-snapshot',
+        args=(checkpoint_dir, iteration_number, slot, add_count, rows, changed,
+              meta))
+    self._save_thread.start()
+
+  def _write_snapshot(self, checkpoint_dir, iteration_number, slot, add_count,
+                      rows, changed, meta):
+    try:
+      self._write_snapshot_files(checkpoint_dir, iteration_number, slot, rows,
+                                 changed, meta)
+    except Exception as e:  # pylint: disable=broad-except
+      # Re-raised by wait_for_save. The slot is left without an owner, so the
+      # next save rewrites it in full.
+      self._save_error = e
+      self._slot_add_counts.pop(slot, None)
+      return
+    self._snapshot_slot = slot
+    self._slot_add_counts[slot] = add_count
+
+  def _write_snapshot_files(self, checkpoint_dir, iteration_number, slot, rows,
+                            changed, meta):
+    # Invalidate the snapshot that held this slot before overwriting it.
+    owner_filename = self._snapshot_owner_filename(checkpoint_dir, slot)
+    if os.path.exists(owner_filename):
+      os.remove(owner_filename)
+
+    for attr, values in changed.items():
+      filename = self._snapshot_filename(checkpoint_dir, attr, slot)
+      if rows is None:
+        np.save(filename, values, allow_pickle=False)
+      else:
+        array = np.lib.format.open_memmap(filename, mode='r+')
+        array[rows] = values
+        array.flush()
+        del array
+
+    meta_filename = self._snapshot_meta_filename(checkpoint_dir,
+                                                 iteration_number)
+    with open(meta_filename + '.tmp', 'wb') as f:
+      f.write(meta)
+    os.replace(meta_filename + '.tmp', meta_filename)
+    with open(owner_filename + '.tmp', 'w') as f:
+      f.write(str(iteration_number))
+    os.replace(owner_filename + '.tmp', owner_filename)
+
+    # Meta files of snapshots whose slot has since been overwritten.
+    live = set(self._snapshot_meta_filename(
+        checkpoint_dir, self._read_snapshot_owner(checkpoint_dir, other))
+               for other in range(SNAPSHOT_SLOTS))
+    for filename in glob.glob(self._snapshot_meta_filename(checkpoint_dir, '*')):
+      if filename not in live:
+        os.remove(filename)
+
+  def wait_for_save(self):
+    """Blocks until the snapshot started by the last `save` is on disk.
+
+    Raises:
+      Exception: whatever the background write raised, if it failed.
+    """
+    if self._save_thread is not None:
+      self._save_thread.join()
+      self._save_thread = None
+    if self._save_error is not None:
+      error, self._save_error = self._save_error, None
+      raise error
 
   def load(self, checkpoint_dir, suffix):
-    """Restores the object from bundle_dictionary and numpy checkpoints.
+    """Restores the memory from the snapshot written by `save`.
+
+    The buffers are opened with `np.load(mmap_mode='r')` and copied into
+    memory. Checkpoints in the older per-attribute gzip format are still
+    readable.
+
+    Args:
+      checkpoint_dir: str, directory where to read the numpy checkpointed files
+        from.
+      suffix: str, suffix to use in numpy checkpoint files.
+
+    Raises:
+      NotFoundError: if all expected files are not found in directory, or if
+        the snapshot was overwritten or interrupted while being written.
+    """
+    self.wait_for_save()
+    meta_filename = self._snapshot_meta_filename(checkpoint_dir, suffix)
+    if not tf.gfile.Exists(meta_filename):
+      backed_arrays = {}
+      if self._backing_dir is not None:
+        for attr in self._ring_attributes() + ['add_count']:
+          backed_arrays[attr] = self.__dict__[attr]
+      self._load_legacy(checkpoint_dir, suffix)
+      for attr, array in backed_arrays.items():
+        array[...] = self.__dict__[attr]
+        self.__dict__[attr] = array
+      return
+
+    with open(meta_filename, 'rb') as f:
+      meta = pickle.load(f)
+    slot = meta.pop('_slot')
+    if self._read_snapshot_owner(checkpoint_dir, slot) != str(suffix):
+      raise tf.errors.NotFoundError(
+          None, None, 'Replay snapshot {} in {} is incomplete or was '
+          'overwritten'.format(suffix, checkpoint_dir))
+    ring_attrs = self._ring_attributes()
+    for attr in ring_attrs:
+      filename = self._snapshot_filename(checkpoint_dir, attr, slot)
+      if not os.path.exists(filename):
+        raise tf.errors.NotFoundError(None, None,
+                                      'Missing file: {}'.format(filename))
+
+    # Copy in place so that memory-mapped buffers stay attached to their files.
+    for attr in ring_attrs:
+      filename = self._snapshot_filename(checkpoint_dir, attr, slot)
+      self.__dict__[attr][...] = np.load(filename, mmap_mode='r')
+    self.add_count[...] = meta.pop('add_count')
+    self.__dict__.update(meta)
+
+    self._snapshot_dir = checkpoint_dir
+    self._snapshot_slot = slot
+    self._slot_add_counts = {slot: int(self.add_count)}
+
+  def _load_legacy(self, checkpoint_dir, suffix):
+    """Restores the memory from per-attribute gzip checkpoints.
+
+    This is the format written before incremental snapshots were introduced.
 
     Args:
       checkpoint_dir: str, directory where to read the numpy checkpointed files
@@ -420,6 +861,122 @@ class OutOfGraphReplayMemory(object):
             self.__dict__[attr] = np.load(infile, allow_pickle=False)
           else:
             self.__dict__[attr] = pickle.load(infile)
+    # Checkpoints written before observations and legal actions were packed.
+    if self.observations.shape[1] == self._observation_size:
+      self.observations = np.packbits(self.observations != 0, axis=1)
+    if self.legal_actions.ndim == 2:
+      self.legal_actions = pack_legal_actions(self.legal_actions,
+                                              self._num_actions)
+
+
+class BackgroundSampler(object):
+  """Samples transition batches from a replay memory in background threads.
+
+  Threads keep a bounded queue of ready minibatches, so a consumer taking one
+  per training step never waits on sampling as long as the threads keep up.
+  Every access to the memory goes through the sampler and holds its lock.
+
+  Priority updates are not applied by the caller. They are queued and applied
+  in order by whichever thread next touches the memory, before it samples or
+  adds. All operations therefore take effect in the order they were issued,
+  but the caller never blocks on a sampling thread holding the lock.
+  """
+
+  def __init__(self, memory, num_threads=1, queue_size=4):
+    """Initializes the sampler. Threads start with the first `sample` call.
+
+    Args:
+      memory: `OutOfGraphReplayMemory`, the memory sampled from.
+      num_threads: int, number of sampling threads.
+      queue_size: int, maximum number of ready batches.
+    """
+    self.memory = memory
+    self.lock = threading.Lock()
+    self._num_threads = num_threads
+    self._batches = queue.Queue(maxsize=queue_size)
+    self._pending_priorities = collections.deque()
+    self._threads = []
+    self._stop = threading.Event()
+
+  def _apply_pending_priorities(self):
+    # Requires self.lock.
+    while self._pending_priorities:
+      self.memory.set_priority(*self._pending_priorities.popleft())
+
+  def add(self, observation, action, reward, terminal, legal_actions):
+    """Adds a transition, see `OutOfGraphReplayMemory.add`."""
+    with self.lock:
+      self._apply_pending_priorities()
+      self.memory.add(observation, action, reward, terminal, legal_actions)
+
+  def add_episode(self, observations, actions, rewards, terminals,
+                  legal_actions):
+    """Adds transitions, see `OutOfGraphReplayMemory.add_episode`."""
+    with self.lock:
+      self._apply_pending_priorities()
+      self.memory.add_episode(observations, actions, rewards, terminals,
+                              legal_actions)
+
+  def set_priority(self, indices, priorities):
+    """Queues a priority update and returns immediately."""
+    self._pending_priorities.append(
+        (np.array(indices, copy=True), np.array(priorities, copy=True)))
+
+  def get_priority(self, indices):
+    """Returns the priorities of the given indices.
+
+    Reads without the lock, so queued updates are not reflected yet. For a
+    batch taken from `sample` these are the priorities it was sampled with.
+    """
+    return self.memory.get_priority(indices)
+
+  def _sample_loop(self):
+    while not self._stop.is_set():
+      try:
+        with self.lock:
+          self._apply_pending_priorities()
+          # The memory reuses its state arrays between calls.
+          batch = tuple(np.array(element, copy=True)
+                        for element in self.memory.sample_transition_batch())
+      except Exception as e:  # pylint: disable=broad-except
+        # Hand the failure to the consumer instead of dying silently.
+        batch = e
+      while not self._stop.is_set():
+        try:
+          self._batches.put(batch, timeout=0.1)
+          break
+        except queue.Full:
+          pass
+
+  def sample(self):
+    """Returns the next ready batch, as `sample_transition_batch` would."""
+    if not self._threads:
+      for _ in range(self._num_threads):
+        thread = threading.Thread(target=self._sample_loop)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+    batch = self._batches.get()
+    if isinstance(batch, Exception):
+      raise batch
+    return batch
+
+  def discard_batches(self):
+    """Drops the ready batches, e.g. after the memory was reloaded."""
+    while True:
+      try:
+        self._batches.get_nowait()
+      except queue.Empty:
+        return
+
+  def stop(self):
+    """Stops the sampling threads."""
+    self._stop.set()
+    for thread in self._threads:
+      thread.join()
+    self._threads = []
+    self._stop.clear()
+    self.discard_batches()
 
 
 @gin.configurable(denylist=['observation_size', 'stack_size'])
@@ -427,8 +984,7 @@ class WrappedReplayMemory(object):
   """In-graph wrapper for the python replay memory.
 
   Usage:
-    To add a transition:  run the operation add_transition_op
-                          (and feed all the placeholders in add_transition_ph).
+    To add transitions:   call add() or, for a whole episode, add_episode().
 
     To sample a batch:    Construct operations that depend on any of the
                           sampling tensors. Every sess.run using any of these
@@ -438,14 +994,17 @@ class WrappedReplayMemory(object):
                           calling self.prefetch_batch.
 
                           Everytime this op is called a new transition batch
-                          would be prefetched.
+                          would be prefetched. Up to prefetch_depth batches can
+                          be staged.
+
+    With sampler threads: Batches are sampled ahead of time by a
+                          BackgroundSampler, and the sampling op only dequeues
+                          one. Transitions must then be added through add() or
+                          add_episode().
 
   Attributes:
     The following tensors are sampled randomly each sess.run:
       states actions rewards next_states terminals
-    add_transition_op:    tf operation to add a transition to the replay memory.
-    All the following placeholders need to be fed. add_obs_ph add_action_ph
-    add_reward_ph add_terminal_ph
   """
 
   def __init__(self,
@@ -457,7 +1016,11 @@ class WrappedReplayMemory(object):
                batch_size=32,
                update_horizon=1,
                gamma=1.0,
-               wrapped_memory=None):
+               wrapped_memory=None,
+               backing_dir=None,
+               num_sampler_threads=0,
+               sample_queue_size=4,
+               prefetch_depth=1):
     """Initializes a graph wrapper for the python replay memory.
 
     Args:
@@ -472,6 +1035,13 @@ class WrappedReplayMemory(object):
       gamma: int, the discount factor.
       wrapped_memory: The 'inner' memory data structure. Defaults to None, which
         creates the standard DQN replay memory.
+      backing_dir: str, optional local directory for memory-mapped replay
+        buffers. Ignored when wrapped_memory is given.
+      num_sampler_threads: int, number of background threads sampling
+        batches. If 0, batches are sampled when the sampling op runs.
+      sample_queue_size: int, number of batches the sampler threads keep
+        ready.
+      prefetch_depth: int, number of batches the staging area holds.
 
     Raises:
       ValueError: If update_horizon is not positive.
@@ -492,31 +1062,22 @@ class WrappedReplayMemory(object):
     else:
       self.memory = OutOfGraphReplayMemory(
           num_actions, observation_size, stack_size,
-          replay_capacity, batch_size, update_horizon, gamma)
+          replay_capacity, batch_size, update_horizon, gamma,
+          backing_dir=backing_dir)
+
+    self.prefetch_depth = prefetch_depth
+    if num_sampler_threads > 0:
+      self.sampler = BackgroundSampler(self.memory, num_sampler_threads,
+                                       sample_queue_size)
+      sample_fn = self.sampler.sample
+    else:
+      self.sampler = None
+      sample_fn = self.memory.sample_transition_batch
 
     with tf.name_scope('replay'):
-      with tf.name_scope('add_placeholders'):
-        self.add_obs_ph = tf.placeholder(
-            tf.uint8, [observation_size], name='add_obs_ph')
-        self.add_action_ph = tf.placeholder(tf.int32, [], name='add_action_ph')
-        self.add_reward_ph = tf.placeholder(
-            tf.float32, [], name='add_reward_ph')
-        self.add_terminal_ph = tf.placeholder(
-            tf.uint8, [], name='add_terminal_ph')
-        self.add_legal_actions_ph = tf.placeholder(
-            tf.float32, [num_actions], name='add_legal_actions_ph')
-
-      add_transition_ph = [
-          self.add_obs_ph, self.add_action_ph, self.add_reward_ph,
-          self.add_terminal_ph, self.add_legal_actions_ph
-      ]
-
       with tf.device('/cpu:*'):
-        self.add_transition_op = tf.py_func(
-            self.memory.add, add_transition_ph, [], name='replay_add_py_func')
-
         self.transition = tf.py_func(
-            self.memory.sample_transition_batch, [],
+            sample_fn, [],
             [tf.uint8, tf.int32, tf.float32, tf.uint8, tf.uint8, tf.int32,
              tf.float32],
             name='replay_sample_py_func')
@@ -539,7 +1100,7 @@ class WrappedReplayMemory(object):
           # Create the staging area in CPU.
           prefetch_area = tf.contrib.staging.StagingArea(
               [tf.uint8, tf.int32, tf.float32, tf.uint8, tf.uint8, tf.int32,
-               tf.float32])
+               tf.float32], capacity=prefetch_depth)
 
           self.prefetch_batch = prefetch_area.put(
               (states, actions, rewards, next_states, terminals, indices,
@@ -560,6 +1121,23 @@ class WrappedReplayMemory(object):
       self.states.set_shape([None, observation_size, stack_size])
       self.next_states.set_shape([None, observation_size, stack_size])
 
+  def add(self, observation, action, reward, terminal, legal_actions):
+    """Adds a transition outside of the graph, see `OutOfGraphReplayMemory`."""
+    if self.sampler is not None:
+      self.sampler.add(observation, action, reward, terminal, legal_actions)
+    else:
+      self.memory.add(observation, action, reward, terminal, legal_actions)
+
+  def add_episode(self, observations, actions, rewards, terminals,
+                  legal_actions):
+    """Adds transitions outside of the graph, see `OutOfGraphReplayMemory`."""
+    if self.sampler is not None:
+      self.sampler.add_episode(observations, actions, rewards, terminals,
+                               legal_actions)
+    else:
+      self.memory.add_episode(observations, actions, rewards, terminals,
+                              legal_actions)
+
   def save(self, checkpoint_dir, iteration_number):
     """Save the underlying replay memory's contents in a file.
 
@@ -569,7 +1147,15 @@ class WrappedReplayMemory(object):
       iteration_number: int, iteration_number to use as a suffix in naming
         numpy checkpoint files.
     """
-    self.memory.save(checkpoint_dir, iteration_number)
+    if self.sampler is not None:
+      with self.sampler.lock:
+        self.memory.save(checkpoint_dir, iteration_number)
+    else:
+      self.memory.save(checkpoint_dir, iteration_number)
+
+  def wait_for_save(self):
+    """Blocks until the snapshot started by the last `save` is on disk."""
+    self.memory.wait_for_save()
 
   def load(self, checkpoint_dir, suffix):
     """Loads the replay memory's state from a saved file.
@@ -579,4 +1165,10 @@ class WrappedReplayMemory(object):
         files.
       suffix: str, suffix to use in numpy checkpoint files.
     """
-    self.memory.load(checkpoint_dir, suffix)
+    if self.sampler is not None:
+      with self.sampler.lock:
+        self.memory.load(checkpoint_dir, suffix)
+      # Batches sampled before the load refer to the old contents.
+      self.sampler.discard_batches()
+    else:
+      self.memory.load(checkpoint_dir, suffix)
@@ -27,6 +27,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import multiprocessing
+import os
+import queue
 import time
 
 from third_party.dopamine import checkpointer
@@ -36,29 +39,56 @@ import gin.tf
 from hanabi_learning_environment import rl_env
 import numpy as np
 import rainbow_agent
+import replay_memory
 import tensorflow as tf
 
 LENIENT_SCORE = False
 
+# Gin bindings for worker processes that only act (actors, evaluators): they
+# run on the CPU and never store transitions, so their replay memory is kept
+# at a token size.
+WORKER_GIN_BINDINGS = [
+    "DQNAgent.tf_device = '/cpu:*'",
+    "RainbowAgent.tf_device = '/cpu:*'",
+    'WrappedReplayMemory.replay_capacity = 1000',
+    'WrappedPrioritizedReplayMemory.replay_capacity = 1000',
+]
+
 
 class ObservationStacker(object):
-  """Class for stacking agent observations."""
+  """Class for stacking agent observations.
+
+  The stacks live in one preallocated uint8 buffer of shape
+  (num_players, 2 * history_size, observation_size). Each observation is
+  written twice, history_size rows apart, so the last history_size
+  observations of a player are always the contiguous rows
+  [cursor, cursor + history_size), oldest first. Adding an observation thus
+  never allocates, and `get_observation_stack` returns a view.
+  """
 
-  def __init__(self, history_size, observation_size, num_players):
+  def __init__(self, history_size, observation_size, num_players,
+               buffer=None, cursors=None):
     """Initializer for observation stacker.
 
     Args:
       history_size: int, number of time steps to stack.
       observation_size: int, size of observation vector on one time step.
       num_players: int, number of players.
+      buffer: optional uint8 `np.array` of shape
+        (num_players, 2 * history_size, observation_size) to keep the stacks
+        in, e.g. a slice of a `BatchedObservationStacker`.
+      cursors: optional int `np.array` of shape (num_players,), the write
+        positions belonging to buffer.
     """
     self._history_size = history_size
     self._observation_size = observation_size
     self._num_players = num_players
-    self._obs_stacks = list()
-    for _ in range(0, self._num_players):
-      self._obs_stacks.append(np.zeros(self._observation_size *
-                                       self._history_size))
+    if buffer is None:
+      buffer = np.zeros((num_players, 2 * history_size, observation_size),
+                        dtype=np.uint8)
+      cursors = np.zeros(num_players, dtype=np.int64)
+    self._buffer = buffer
+    self._cursors = cursors
 
   def add_observation(self, observation, current_player):
     """Adds observation for the current player.
@@ -67,25 +97,117 @@ class ObservationStacker(object):
       observation: observation vector for current player.
       current_player: int, current player id.
     """
-    self._obs_stacks[current_player] = np.roll(self._obs_stacks[current_player],
-                                               -self._observation_size)
-    self._obs_stacks[current_player][(self._history_size - 1) *
-                                     self._observation_size:] = observation
+    cursor = self._cursors[current_player]
+    stacks = self._buffer[current_player]
+    stacks[cursor] = observation
+    stacks[cursor + self._history_size] = stacks[cursor]
+    self._cursors[current_player] = (cursor + 1) % self._history_size
 
   def get_observation_stack(self, current_player):
     """Returns the stacked observation for current player.
 
+    The result is a view of the stacker's buffer: it is only valid until the
+    next observation of this player is added. Copy it to keep it.
+
     Args:
       current_player: int, current player id.
     """
-
-    return self._obs_stacks[current_player]
+    cursor = self._cursors[current_player]
+    return self._buffer[current_player,
+                        cursor:cursor + self._history_size].reshape(-1)
 
   def reset_stack(self):
     """Resets the observation stacks to all zero."""
+    self._buffer.fill(0)
+    self._cursors.fill(0)
+
+  @property
+  def history_size(self):
+    """Returns number of steps to stack."""
+    return self._history_size
+
+  def observation_size(self):
+    """Returns the size of the observation vector after history stacking."""
+    return self._observation_size * self._history_size
+
+
+class BatchedObservationStacker(object):
+  """Observation stacks of many concurrent games in one buffer.
+
+  `game` returns an `ObservationStacker` for each game, sharing this buffer,
+  so per-game code is unchanged. `get_observation_stacks` gathers the stacks
+  of many games at once, e.g. for one batched forward pass.
+  """
 
-    for i in range(0, self._num_players):
-      self._obs_stacks[i].fill(0.0)
+  def __init__(self, num_games, history_size, observation_size, num_players):
+    """Initializer for a batched observation stacker.
+
+    Args:
+      num_games: int, number of concurrent games.
+      history_size: int, number of time steps to stack.
+      observation_size: int, size of observation vector on one time step.
+      num_players: int, number of players.
+    """
+    self._history_size = history_size
+    self._observation_size = observation_size
+    self._buffer = np.zeros(
+        (num_games, num_players, 2 * history_size, observation_size),
+        dtype=np.uint8)
+    self._cursors = np.zeros((num_games, num_players), dtype=np.int64)
+    self._games = [
+        ObservationStacker(history_size, observation_size, num_players,
+                           buffer=self._buffer[game],
+                           cursors=self._cursors[game])
+        for game in range(num_games)]
+
+  def game(self, index):
+    """Returns the `ObservationStacker` of game index."""
+    return self._games[index]
+
+  def add_observations(self, observations, current_players, games=None):
+    """Adds one observation to each of several games.
+
+    Args:
+      observations: (n, observation_size) observations.
+      current_players: n ints, the player observing in each game.
+      games: n ints, the games. Defaults to all games in order.
+    """
+    if games is None:
+      games = range(len(self._games))
+    for game, observation, player in zip(games, observations,
+                                         current_players):
+      self._games[game].add_observation(observation, player)
+
+  def get_observation_stacks(self, current_players, games=None, out=None):
+    """Returns the stacked observations of several games.
+
+    Args:
+      current_players: n ints, the player whose stack to return in each game.
+      games: n ints, the games. Defaults to all games in order.
+      out: optional uint8 `np.array` of shape (n, stacked observation size) to
+        fill instead of allocating the result.
+
+    Returns:
+      The (n, history_size * observation_size) uint8 stacks.
+    """
+    if games is None:
+      games = range(len(self._games))
+    if out is None:
+      out = np.empty((len(current_players),
+                      self._history_size * self._observation_size),
+                     dtype=np.uint8)
+    for row, (game, player) in enumerate(zip(games, current_players)):
+      out[row] = self._games[game].get_observation_stack(player)
+    return out
+
+  def reset_stack(self, games=None):
+    """Resets the stacks of the given games (all by default) to zero."""
+    if games is None:
+      self._buffer.fill(0)
+      self._cursors.fill(0)
+    else:
+      for game in games:
+        self._games[game].reset_stack()
 
   @property
   def history_size(self):
@@ -163,12 +285,14 @@ def create_agent(environment, obs_stacker, agent_type='DQN'):
   if agent_type == 'DQN':
     return dqn_agent.DQNAgent(observation_size=obs_stacker.observation_size(),
                               num_actions=environment.num_moves(),
-                              num_players=environment.players)
+                              num_players=environment.players,
+                              history_size=obs_stacker.history_size)
   elif agent_type == 'Rainbow':
     return rainbow_agent.RainbowAgent(
         observation_size=obs_stacker.observation_size(),
         num_actions=environment.num_moves(),
-        num_players=environment.players)
+        num_players=environment.players,
+        history_size=obs_stacker.history_size)
   else:
     raise ValueError('Expected valid agent_type, got {}'.format(agent_type))
 
@@ -235,13 +359,20 @@ def format_legal_moves(legal_moves, action_dim):
   Ex: legal_moves = [0, 1, 3], action_dim = 5
       returns [0, 0, -Inf, 0, -Inf]
 
+  legal_moves may also be a legal-move bitmask such as the one returned by
+  HanabiState::LegalMovesMask (bit i set iff action i is legal); for the
+  example above, 0b1011. It is then unpacked with one vectorized lookup.
+
   Args:
-    legal_moves: list of legal actions.
+    legal_moves: list of legal actions, or an integer bitmask.
     action_dim: int, number of actions.
 
   Returns:
     a vector of size action_dim.
   """
+  if isinstance(legal_moves, (int, np.integer)):
+    mask = replay_memory.legal_actions_dtype(action_dim)(legal_moves)
+    return replay_memory.unpack_legal_actions(mask, action_dim)
   new_legal_moves = np.full(action_dim, -float('inf'))
   if legal_moves:
     new_legal_moves[legal_moves] = 0
@@ -336,6 +467,219 @@ def run_one_episode(agent, environment, obs_stacker):
   return step_number, total_reward
 
 
+def _evaluation_worker(gin_config, requests, results):
+  """Plays evaluation games for `AsyncEvaluator` until it receives None.
+
+  Args:
+    gin_config: str, the gin configuration of the training process.
+    requests: `multiprocessing.Queue` of (iteration, online weights,
+      training steps, number of games).
+    results: `multiprocessing.Queue` receiving (iteration, mean episode length,
+      mean episode return).
+  """
+  # Evaluation only needs forward passes; leave the accelerators to training.
+  os.environ['CUDA_VISIBLE_DEVICES'] = ''
+  gin.parse_config(gin_config, skip_unknown=True)
+  gin.parse_config(WORKER_GIN_BINDINGS)
+  environment = create_environment()
+  obs_stacker = create_obs_stacker(environment)
+  agent = create_agent(environment, obs_stacker)
+  agent.eval_mode = True
+
+  while True:
+    request = requests.get()
+    if request is None:
+      return
+    iteration, weights, training_steps, num_games = request
+    agent.set_online_weights(weights)
+    agent.training_steps = training_steps
+    episode_data = [run_one_episode(agent, environment, obs_stacker)
+                    for _ in range(num_games)]
+    eval_episode_length, eval_episode_return = map(np.mean, zip(*episode_data))
+    results.put((iteration, float(eval_episode_length),
+                 float(eval_episode_return)))
+
+
+class AsyncEvaluator(object):
+  """Plays evaluation games in a separate process while training goes on.
+
+  The process builds its own environment and agent from the caller's gin
+  configuration. Each request carries a snapshot of the online weights, so the
+  games evaluate the agent as it was when the request was made.
+  """
+
+  def __init__(self):
+    context = multiprocessing.get_context('spawn')
+    self._requests = context.Queue()
+    self._results = context.Queue()
+    self._num_pending = 0
+    self._process = context.Process(
+        target=_evaluation_worker, name='evaluator',
+        args=(gin.config_str(), self._requests, self._results))
+    self._process.daemon = True
+    self._process.start()
+
+  def submit(self, agent, iteration, num_games):
+    """Queues an evaluation of the agent's current online network."""
+    self._requests.put((iteration, agent.get_online_weights(),
+                        agent.training_steps, num_games))
+    self._num_pending += 1
+
+  def collect(self, block=False):
+    """Returns the finished evaluations.
+
+    Args:
+      block: bool, whether to wait for all pending evaluations.
+
+    Returns:
+      A list of (iteration, mean episode length, mean episode return).
+
+    Raises:
+      RuntimeError: If the evaluation process died with evaluations pending.
+    """
+    results = []
+    while self._num_pending:
+      try:
+        results.append(self._results.get(block=block, timeout=1.))
+      except queue.Empty:
+        if not block:
+          break
+        if not self._process.is_alive():
+          raise RuntimeError('The evaluation process exited with {} '
+                             'evaluations pending.'.format(self._num_pending))
+        continue
+      self._num_pending -= 1
+    return results
+
+  def stop(self):
+    """Ends the evaluation process once the queued evaluations are done."""
+    self._requests.put(None)
+    self._process.join()
+
+
+def record_evaluations(experiment_logger, evaluations):
+  """Writes asynchronous evaluation results into their iterations' logs.
+
+  Args:
+    experiment_logger: A `Logger` object.
+    evaluations: list of (iteration, mean episode length, mean episode return),
+      as returned by `AsyncEvaluator.collect`.
+  """
+  for iteration, eval_episode_length, eval_episode_return in evaluations:
+    tf.logging.info('Iteration %d eval. episode length: %.2f  Return: %.2f',
+                    iteration, eval_episode_length, eval_episode_return)
+    key = 'iter{:d}'.format(iteration)
+    # Iterations skipped by log_every_n have no entry.
+    if key in experiment_logger.data:
+      experiment_logger.data[key]['eval_episode_lengths'] = [
+          eval_episode_length]
+      experiment_logger.data[key]['eval_episode_returns'] = [
+          eval_episode_return]
+
+
+class ParallelGame(object):
+  """State of one of several Hanabi games played concurrently."""
+
+  def __init__(self, environment, obs_stacker):
+    """Initializer for a concurrently played game.
+
+    Args:
+      environment: The Hanabi environment of this game.
+      obs_stacker: Observation stacker object of this game.
+    """
+    self.environment = environment
+    self.obs_stacker = obs_stacker
+    # Per-player transitions, as in DQNAgent.transitions.
+    self.transitions = [[] for _ in range(environment.players)]
+    self.observations = None
+    self.has_played = set()
+    self.reward_since_last_action = np.zeros(environment.players)
+    self.step_number = 0
+    self.total_reward = 0
+
+  def reset(self):
+    """Starts a new game; also called before each phase."""
+    self.obs_stacker.reset_stack()
+    self.observations = self.environment.reset()
+    self.has_played = set()
+    self.reward_since_last_action = np.zeros(self.environment.players)
+    self.step_number = 0
+    self.total_reward = 0
+
+
+def run_parallel_episodes(agent, games, min_steps, statistics, run_mode_str):
+  """Runs several games of Hanabi in lockstep until a number of steps.
+
+  Each move, the current players of all games in flight are sent to the agent
+  as one batch, so that a move of every game costs a single forward pass. Each
+  game records and posts its per-player transitions as in `run_one_episode`.
+  Games still in flight once min_steps is reached are played to the end.
+
+  Args:
+    agent: Agent playing Hanabi.
+    games: list of `ParallelGame`, the games to play concurrently.
+    min_steps: int, minimum number of steps to generate.
+    statistics: `IterationStatistics` object which records the experimental
+      results.
+    run_mode_str: str, describes the run mode for this agent.
+
+  Returns:
+    The number of steps taken, the sum of returns, and the number of episodes
+      performed.
+  """
+  step_count = 0
+  num_episodes = 0
+  sum_returns = 0.
+
+  for game in games:
+    game.reset()
+  active_games = list(games)
+
+  while active_games:
+    current_players, legal_moves, observation_vectors = zip(*[
+        parse_observations(game.observations, game.environment.num_moves(),
+                           game.obs_stacker) for game in active_games])
+    begins = [player not in game.has_played
+              for game, player in zip(active_games, current_players)]
+    rewards = [game.reward_since_last_action[player]
+               for game, player in zip(active_games, current_players)]
+    actions = agent.step_games(rewards, current_players, legal_moves,
+                               observation_vectors, begins,
+                               [game.transitions for game in active_games])
+
+    still_active = []
+    for game, player, action in zip(active_games, current_players, actions):
+      game.has_played.add(player)
+      # Reset this player's reward accumulator.
+      game.reward_since_last_action[player] = 0
+
+      game.observations, reward, is_done, _ = game.environment.step(
+          int(action))
+      modified_reward = max(reward, 0) if LENIENT_SCORE else reward
+      game.total_reward += modified_reward
+      game.reward_since_last_action += modified_reward
+      game.step_number += 1
+      if not is_done:
+        still_active.append(game)
+        continue
+
+      agent.end_game(game.reward_since_last_action, game.transitions)
+      tf.logging.info('EPISODE: %d %g', game.step_number, game.total_reward)
+      statistics.append({
+          '{}_episode_lengths'.format(run_mode_str): game.step_number,
+          '{}_episode_returns'.format(run_mode_str): game.total_reward
+      })
+      step_count += game.step_number
+      sum_returns += game.total_reward
+      num_episodes += 1
+      if step_count < min_steps:
+        game.reset()
+        still_active.append(game)
+    active_games = still_active
+
+  return step_count, sum_returns, num_episodes
+
+
 def run_one_phase(agent, environment, obs_stacker, min_steps, statistics,
                   run_mode_str):
   """Runs the agent/environment loop until a desired number of steps.
@@ -376,7 +720,9 @@ def run_one_phase(agent, environment, obs_stacker, min_steps, statistics,
 def run_one_iteration(agent, environment, obs_stacker,
                       iteration, training_steps,
                       evaluate_every_n=100,
-                      num_evaluation_games=100):
+                      num_evaluation_games=100,
+                      parallel_games=None,
+                      evaluator=None):
   """Runs one iteration of agent/environment interaction.
 
   An iteration involves running several episodes until a certain number of
@@ -390,6 +736,11 @@ def run_one_iteration(agent, environment, obs_stacker,
     training_steps: int, the number of training steps to perform.
     evaluate_every_n: int, frequency of evaluation.
     num_evaluation_games: int, number of games per evaluation.
+    parallel_games: list of `ParallelGame`. If given, the training phase plays
+      these games concurrently instead of one game at a time.
+    evaluator: `AsyncEvaluator`. If given, evaluations are handed to it and
+      this iteration reports -1 until `record_evaluations` fills in the
+      results.
 
   Returns:
     A dict containing summary statistics for this iteration.
@@ -400,9 +751,14 @@ def run_one_iteration(agent, environment, obs_stacker,
 
   # First perform the training phase, during which the agent learns.
   agent.eval_mode = False
-  number_steps, sum_returns, num_episodes = (
-      run_one_phase(agent, environment, obs_stacker, training_steps, statistics,
-                    'train'))
+  if parallel_games:
+    number_steps, sum_returns, num_episodes = (
+        run_parallel_episodes(agent, parallel_games, training_steps,
+                              statistics, 'train'))
+  else:
+    number_steps, sum_returns, num_episodes = (
+        run_one_phase(agent, environment, obs_stacker, training_steps,
+                      statistics, 'train'))
   time_delta = time.time() - start_time
   tf.logging.info('Average training steps per second: %.2f',
                   number_steps / time_delta)
@@ -412,7 +768,10 @@ def run_one_iteration(agent, environment, obs_stacker,
   statistics.append({'average_return': average_return})
 
   # Also run an evaluation phase if desired.
-  if evaluate_every_n is not None and iteration % evaluate_every_n == 0:
+  evaluate = evaluate_every_n is not None and iteration % evaluate_every_n == 0
+  if evaluate and evaluator is not None:
+    evaluator.submit(agent, iteration, num_evaluation_games)
+  if evaluate and evaluator is None:
     episode_data = []
     agent.eval_mode = True
     # Collect episode data for all games.
@@ -484,23 +843,50 @@ def run_experiment(agent,
                    training_steps=5000,
                    logging_file_prefix='log',
                    log_every_n=1,
-                   checkpoint_every_n=1):
-  """Runs a full experiment, spread over multiple iterations."""
+                   checkpoint_every_n=1,
+                   num_parallel_games=1,
+                   async_evaluation=False):
+  """Runs a full experiment, spread over multiple iterations.
+
+  With num_parallel_games > 1, training plays that many games concurrently and
+  selects the actions of all of them with one forward pass per move.
+
+  With async_evaluation, evaluation games are played by an `AsyncEvaluator`
+  process on a snapshot of the weights, so training does not pause for them.
+  Their results are written into the logs of their iterations as they arrive.
+  """
   tf.logging.info('Beginning training...')
   if num_iterations <= start_iteration:
     tf.logging.warning('num_iterations (%d) < start_iteration(%d)',
                        num_iterations, start_iteration)
     return
 
+  parallel_games = None
+  if num_parallel_games > 1:
+    # The games keep their observation stacks in one shared buffer.
+    stackers = BatchedObservationStacker(
+        num_parallel_games, obs_stacker.history_size,
+        environment.vectorized_observation_shape()[0], environment.players)
+    parallel_games = [ParallelGame(environment, stackers.game(0))]
+    for game in range(1, num_parallel_games):
+      parallel_games.append(
+          ParallelGame(create_environment(), stackers.game(game)))
+
+  evaluator = AsyncEvaluator() if async_evaluation else None
+
   for iteration in range(start_iteration, num_iterations):
     start_time = time.time()
     statistics = run_one_iteration(agent, environment, obs_stacker, iteration,
-                                   training_steps)
+                                   training_steps,
+                                   parallel_games=parallel_games,
+                                   evaluator=evaluator)
     tf.logging.info('Iteration %d took %d seconds', iteration,
                     time.time() - start_time)
     start_time = time.time()
     log_experiment(experiment_logger, iteration, statistics,
                    logging_file_prefix, log_every_n)
+    if evaluator is not None:
+      record_evaluations(experiment_logger, evaluator.collect())
     tf.logging.info('Logging iteration %d took %d seconds', iteration,
                     time.time() - start_time)
     start_time = time.time()
@@ -508,3 +894,9 @@ def run_experiment(agent,
                           iteration, checkpoint_dir, checkpoint_every_n)
     tf.logging.info('Checkpointing iteration %d took %d seconds', iteration,
                     time.time() - start_time)
+
+  if evaluator is not None:
+    # Wait for the last evaluations and write them out.
+    record_evaluations(experiment_logger, evaluator.collect(block=True))
+    experiment_logger.log_to_file(logging_file_prefix, iteration)
+    evaluator.stop()
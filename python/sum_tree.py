@@ -0,0 +1,256 @@
+# coding=utf-8
+# Copyright 2018 The Dopamine Authors and Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+#
+# This file is a fork of the original Dopamine code incorporating changes for
+# the multiplayer setting and the Hanabi Learning Environment.
+#
+"""A sum tree data structure backed by NumPy arrays.
+
+Used for prioritized experience replay. See prioritized_replay_memory.py for
+details.
+
+Unlike the original Dopamine sum tree, every operation is batched: `set`, `get`
+and the sampling methods accept arrays of indices or query values and walk the
+tree one level at a time, so a batch of B elements costs O(B log N) NumPy work
+and no Python-level per-element loop.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+
+import numpy as np
+
+
+class SumTree(object):
+  """A sum tree data structure for storing replay priorities.
+
+  A sum tree is a complete binary tree whose leaves contain values called
+  priorities. Internal nodes maintain the sum of the priorities of all leaf
+  nodes in their subtree.
+
+  For capacity = 4, the tree may look like this:
+
+               +---+
+               |2.5|
+               +-+-+
+                 |
+         +-------+--------+
+         |                |
+       +-+-+            +-+-+
+       |1.5|            |1.0|
+       +-+-+            +-+-+
+         |                |
+    +----+----+      +----+----+
+    |         |      |         |
+  +-+-+     +-+-+  +-+-+     +-+-+
+  |0.5|     |1.0|  |0.5|     |0.5|
+  +---+     +---+  +---+     +---+
+
+  This is stored as a list of NumPy arrays, one per level:
+    self.nodes = [ [2.5], [1.5, 1.0], [0.5, 1.0, 0.5, 0.5] ]
+
+  For conciseness, we allocate arrays as powers of two, and pad the excess
+  elements with zero values.
+
+  This is similar to the usual array-based representation of a complete binary
+  tree, but is a little more user-friendly.
+  """
+
+  def __init__(self, capacity):
+    """Creates the sum tree data structure for the given replay capacity.
+
+    Args:
+      capacity: int, the maximum number of elements that can be stored in this
+        data structure.
+
+    Raises:
+      ValueError: If requested capacity is not positive.
+    """
+    assert isinstance(capacity, int)
+    if capacity <= 0:
+      raise ValueError('Sum tree capacity should be positive. Got: {}'.
+                       format(capacity))
+
+    self.nodes = []
+    self.depth = int(math.ceil(np.log2(capacity)))
+    level_size = 1
+    for _ in range(self.depth + 1):
+      self.nodes.append(np.zeros(level_size, dtype=np.float64))
+      level_size *= 2
+
+    self.capacity = capacity
+    self.max_recorded_priority = 1.0
+
+  def total_priority(self):
+    """Returns the sum of all priorities stored in this sum tree.
+
+    Returns:
+      float, sum of priorities stored in this sum tree.
+    """
+    return self.nodes[0][0]
+
+  def _find_leaves(self, query_values):
+    """Descends the tree for a batch of query values.
+
+    Args:
+      query_values: `np.array` of floats in [0, total_priority).
+
+    Returns:
+      `np.array` of int32, the leaf index reached by each query value.
+    """
+    query_values = np.array(query_values, dtype=np.float64)
+    node_indices = np.zeros(query_values.shape, dtype=np.int64)
+    # Traverse the sum tree, one level for the whole batch at a time.
+    for nodes_at_this_depth in self.nodes[1:]:
+      left_children = 2 * node_indices
+      left_sums = nodes_at_this_depth[left_children]
+      right_sums = nodes_at_this_depth[left_children + 1]
+      # Go right when the value exceeds the left subtree, unless rounding error
+      # would land us in an empty right subtree.
+      go_right = (query_values >= left_sums) & (right_sums > 0)
+      query_values = np.where(go_right, query_values - left_sums,
+                              query_values)
+      node_indices = left_children + go_right
+    return node_indices.astype(np.int32)
+
+  def sample(self, query_value=None, size=None):
+    """Samples elements from the sum tree.
+
+    Each element has probability p_i / sum_j p_j of being picked, where p_i is
+    the (positive) value associated with node i (possibly unnormalized).
+
+    Args:
+      query_value: float or `np.array` of floats in [0, 1], used as the random
+        value to select samples. If None, it is drawn uniformly at random.
+      size: int, number of samples to draw when query_value is None. If None,
+        a single index is returned.
+
+    Returns:
+      int, or `np.array` of int32, the index of the sampled element(s).
+
+    Raises:
+      Exception: If the sum tree is empty (i.e. its node values sum to 0).
+      ValueError: If the supplied query_value is outside [0, 1].
+    """
+    if self.total_priority() == 0.0:
+      raise Exception('Cannot sample from an empty sum tree.')
+
+    if query_value is None:
+      query_value = np.random.random(size)
+    query_value = np.asarray(query_value, dtype=np.float64)
+    if np.any((query_value < 0.) | (query_value > 1.)):
+      raise ValueError('query_value must be in [0, 1].')
+
+    leaves = self._find_leaves(query_value * self.total_priority())
+    if leaves.ndim == 0:
+      return int(leaves)
+    return leaves
+
+  def stratified_sample(self, batch_size):
+    """Performs stratified sampling using the sum tree.
+
+    Let R be the value at the root (total value of sum tree). This method will
+    divide [0, R) into batch_size segments, pick a random number from each of
+    those segments, and use that random number to sample from the sum_tree.
+    This is as specified in Schaul et al. (2015).
+
+    Args:
+      batch_size: int, the number of strata to use.
+
+    Returns:
+      `np.array` of int32, batch_size indices sampled from the sum tree.
+
+    Raises:
+      Exception: If the sum tree is empty (i.e. its node values sum to 0).
+    """
+    if self.total_priority() == 0.0:
+      raise Exception('Cannot sample from an empty sum tree.')
+
+    bounds = np.linspace(0., 1., batch_size + 1)
+    assert len(bounds) == batch_size + 1
+    query_values = bounds[:-1] + (
+        np.random.random(batch_size) * (bounds[1:] - bounds[:-1]))
+    return self._find_leaves(query_values * self.total_priority())
+
+  def get(self, node_index):
+    """Returns the value of the leaf node(s) corresponding to the index.
+
+    Args:
+      node_index: int or `np.array` of ints, the index of the leaf node(s).
+
+    Returns:
+      float or `np.array` of floats, the value of the leaf node(s).
+    """
+    return self.nodes[-1][node_index]
+
+  def set(self, node_index, value):
+    """Sets the value of leaf node(s) and updates the internal nodes.
+
+    The affected ancestors are recomputed from their children one level at a
+    time, so updating a batch of leaves costs O(B log N). If an index appears
+    several times, the last value wins.
+
+    Args:
+      node_index: int or `np.array` of ints, the index of the leaf node(s) to
+        be updated.
+      value: float or `np.array` of floats, the value(s) which we assign to the
+        node(s). This value must be nonnegative. Setting value = 0 will cause
+        the element to never be sampled.
+
+    Raises:
+      ValueError: If the given value is negative.
+    """
+    node_index = np.atleast_1d(np.asarray(node_index, dtype=np.int64))
+    value = np.broadcast_to(np.asarray(value, dtype=np.float64),
+                            node_index.shape)
+    if np.any(value < 0.0):
+      raise ValueError('Sum tree values should be nonnegative. Got {}'.
+                       format(value[value < 0.0]))
+    if node_index.size == 0:
+      return
+
+    self.max_recorded_priority = max(float(value.max()),
+                                     self.max_recorded_priority)
+
+    # Keep the last occurrence of each index so duplicates behave like
+    # sequential assignments.
+    reversed_indices = node_index[::-1]
+    node_index, first_in_reversed = np.unique(reversed_indices,
+                                              return_index=True)
+    self.nodes[-1][node_index] = value[::-1][first_in_reversed]
+
+    # Recompute the sums of all affected ancestors, bottom-up.
+    for nodes_at_this_depth, children in zip(reversed(self.nodes[:-1]),
+                                             reversed(self.nodes[1:])):
+      node_index = np.unique(node_index // 2)
+      nodes_at_this_depth[node_index] = (children[2 * node_index] +
+                                         children[2 * node_index + 1])
+
+  def rebuild(self):
+    """Recomputes the internal nodes from the leaf values.
+
+    Used when the leaves were filled externally, e.g. from a memory-mapped
+    file.
+    """
+    for nodes_at_this_depth, children in zip(reversed(self.nodes[:-1]),
+                                             reversed(self.nodes[1:])):
+      nodes_at_this_depth[:] = children[0::2] + children[1::2]
+    self.max_recorded_priority = max(float(self.nodes[-1].max()),
+                                     self.max_recorded_priority)
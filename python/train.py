@@ -29,6 +29,7 @@ from absl import flags
 
 from third_party.dopamine import logger
 
+import distributed
 import run_experiment
 
 FLAGS = flags.FLAGS
@@ -55,6 +56,10 @@ flags.DEFINE_string('logging_dir', '',
                     'no checkpoints will be saved.')
 flags.DEFINE_string('logging_file_prefix', 'log',
                     'Prefix to use for the log files.')
+flags.DEFINE_integer('num_actors', 0,
+                     'Number of actor processes generating games for the '
+                     'learner. If 0, the agent acts and learns in this '
+                     'process.')
 
 
 def launch_experiment():
@@ -88,6 +93,14 @@ def launch_experiment():
                                               checkpoint_dir,
                                               FLAGS.checkpoint_file_prefix))
 
+  if FLAGS.num_actors > 0:
+    distributed.run_distributed_experiment(
+        agent, environment, start_iteration, obs_stacker, experiment_logger,
+        experiment_checkpointer, checkpoint_dir, FLAGS.num_actors,
+        FLAGS.gin_files, FLAGS.gin_bindings,
+        logging_file_prefix=FLAGS.logging_file_prefix)
+    return
+
   run_experiment.run_experiment(agent, environment, start_iteration,
                                 obs_stacker,
                                 experiment_logger, experiment_checkpointer,
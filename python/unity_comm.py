@@ -1,14 +1,21 @@
 import socket
 import json
+import collections
+import threading
+import time
+import gin
 import numpy as np
 
+UNITY_HOST = "192.168.0.11"
+UNITY_PORT = 8052
+
 def send_to_unity(observation, legal_actions, action):
     try:
         # NumPy 配列を Python の list に変換
         # 念のため NumPy 配列に変換しておく（重複しても問題なし）
         observation = np.array(observation)
         legal_actions = np.array(legal_actions)
-        
+
         message = {
             "observation": observation.tolist(),
             "legal_actions": legal_actions.tolist(),
@@ -18,10 +25,136 @@ def send_to_unity(observation, legal_actions, action):
         json_message = json.dumps(message)
 
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect(("192.168.0.11", 8052))  # Unity 側のポートとIPに合わせて
+            s.connect((UNITY_HOST, UNITY_PORT))  # Unity 側のポートとIPに合わせて
             s.sendall(json_message.encode('utf-8'))
 
             print("Unityに送信成功: action =", action)
 
     except Exception as e:
         print("送信エラー:", e)
+
+
+class GameStateTelemetry(object):
+    """学習/評価ループを止めずに盤面を Unity（またはファイル）へ流すテレメトリ。
+
+    - publish() は sample_every 回に 1 回だけ観測をコピーしてキューに積むだけ（ソケット I/O なし）
+    - キューは上限付きで、溢れたら古いものから捨てる
+    - 送信はバックグラウンドスレッドが担当し、接続は使い回す（切れたら一定間隔で再接続）
+    - path を指定すると TCP ではなく JSON Lines ファイルに追記する
+    """
+
+    def __init__(self, host=UNITY_HOST, port=UNITY_PORT, path=None,
+                 sample_every=1, max_queue=1024, reconnect_interval=5.0):
+        self._host = host
+        self._port = port
+        self._path = path
+        self._sample_every = max(1, int(sample_every))
+        self._reconnect_interval = reconnect_interval
+        self._queue = collections.deque(maxlen=max(1, int(max_queue)))
+        self._cond = threading.Condition()
+        self._closed = False
+        self._published = 0
+        self.dropped = 0
+        self.sent = 0
+        self._sock = None
+        self._file = None
+        self._next_connect = 0.0
+        self._thread = threading.Thread(target=self._run, name="unity-telemetry", daemon=True)
+        self._thread.start()
+
+    def publish(self, observation, legal_actions, action):
+        """1 手分の (観測, 合法手, 行動) を送信キューへ。呼び出し側はブロックしない。"""
+        self._published += 1
+        if self._published % self._sample_every:
+            return
+        # 呼び出し元のバッファは次の手で書き換わるのでここでコピーする
+        item = (np.array(observation, dtype=np.uint8), np.array(legal_actions, dtype=np.float32), int(action))
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(item)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=1.0)
+        self._disconnect()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                observation, legal_actions, action = self._queue.popleft()
+            line = json.dumps({
+                "observation": observation.tolist(),
+                "legal_actions": legal_actions.tolist(),
+                "action": action
+            }) + "\n"
+            self._write(line.encode('utf-8'))
+
+    def _write(self, payload):
+        if self._path is not None:
+            if self._file is None:
+                self._file = open(self._path, "ab")
+            self._file.write(payload)
+            self._file.flush()
+            self.sent += 1
+            return
+
+        if self._sock is None and not self._connect():
+            self.dropped += 1
+            return
+        try:
+            self._sock.sendall(payload)
+            self.sent += 1
+        except OSError as e:
+            print("テレメトリ送信エラー:", e)
+            self._disconnect()
+            self.dropped += 1
+
+    def _connect(self):
+        now = time.monotonic()
+        if now < self._next_connect:
+            return False
+        try:
+            self._sock = socket.create_connection((self._host, self._port), timeout=1.0)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            print(f"テレメトリ接続: {self._host}:{self._port}")
+            return True
+        except OSError as e:
+            print("テレメトリ接続エラー:", e)
+            self._sock = None
+            self._next_connect = now + self._reconnect_interval
+            return False
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+            self._next_connect = time.monotonic() + self._reconnect_interval
+
+
+@gin.configurable
+def create_telemetry_sink(enabled=False, host=UNITY_HOST, port=UNITY_PORT,
+                          path=None, sample_every=1, max_queue=1024):
+    """gin から有効化するテレメトリ。既定は無効（None を返し、学習ループには一切触れない）。
+
+    例（gin）:
+      create_telemetry_sink.enabled = True
+      create_telemetry_sink.sample_every = 10
+    """
+    if not enabled:
+        return None
+    return GameStateTelemetry(host=host, port=port, path=path,
+                              sample_every=sample_every, max_queue=max_queue)
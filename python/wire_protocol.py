@@ -0,0 +1,131 @@
+# wire_protocol.py（Unity ⇔ Python 推論サーバのバイナリ形式）
+#
+# JSON（観測 658 個の数値文字列）の代わりに使う、バージョン付きの固定レイアウト。
+# Unity 側の実装は "python script/HanabiWireProtocol.cs"。数値はすべてビッグエンディアン。
+#
+#   フレーム = 長さ u32（以降のバイト数） + 本体
+#   本体     = ヘッダ 8 バイト + ペイロード
+#     ヘッダ : magic u8 (0xB5) / version u8 / type u8 / flags u8 (0) / request_id u32
+#   type=1 OBSERVATION : num_bits u16 / num_actions u8 / 観測ビット列（先頭ビットが MSB）/ 合法手 u32
+#                        （合法手は bit i が 1 なら行動 i が合法）
+#   type=2 ACTION      : action i16
+#   type=3 ERROR       : UTF-8 のエラーメッセージ
+#
+# 長さプレフィックスは async サーバの FRAMING=length と同じ形式なので、同じ接続で
+# JSON 本体とバイナリ本体を混在できる（本体の先頭が MAGIC ならバイナリ、'{' なら JSON）。
+# 658 ビットの観測 + 20 手のマスクは 4 + 8 + 3 + 83 + 4 = 102 バイト。
+import struct
+
+import numpy as np
+
+MAGIC = 0xB5
+VERSION = 1
+
+MSG_OBSERVATION = 1
+MSG_ACTION = 2
+MSG_ERROR = 3
+
+LENGTH = struct.Struct(">I")
+HEADER = struct.Struct(">BBBBI")
+OBSERVATION_PREFIX = struct.Struct(">HB")
+LEGAL_MASK = struct.Struct(">I")
+ACTION = struct.Struct(">h")
+
+
+class WireProtocolError(ValueError):
+    """形式・バージョンが不正なフレーム。"""
+
+
+def is_binary(body):
+    """本体（長さプレフィックスを除いた bytes）がバイナリ形式か。"""
+    return len(body) > 0 and body[0] == MAGIC
+
+
+def is_binary_frame(data):
+    """長さプレフィックス付きの受信データがバイナリ形式で始まっているか。"""
+    return len(data) > LENGTH.size and data[LENGTH.size] == MAGIC
+
+
+def frame_size(data):
+    """受信データ先頭のフレーム全体のバイト数（長さフィールドが揃っていなければ None）。"""
+    if len(data) < LENGTH.size:
+        return None
+    return LENGTH.size + LENGTH.unpack_from(data)[0]
+
+
+def frame(body):
+    """本体に長さプレフィックスを付ける。"""
+    return LENGTH.pack(len(body)) + body
+
+
+def _header(msg_type, request_id):
+    return HEADER.pack(MAGIC, VERSION, msg_type, 0, request_id & 0xFFFFFFFF)
+
+
+def encode_observation(observation, legal_actions, request_id=0, num_actions=None):
+    """観測（0/1）と合法手（0/1 配列、または bit i = 行動 i のビットマスク int）→ 本体。
+
+    ビットマスク int では最上位の合法手しか分からないので、行動数 num_actions の指定が必須。
+    """
+    bits = np.asarray(observation).reshape(-1) != 0
+    if isinstance(legal_actions, (int, np.integer)):
+        if num_actions is None:
+            raise WireProtocolError("num_actions is required when legal_actions is a bitmask")
+        mask = int(legal_actions)
+        if mask >> num_actions:
+            raise WireProtocolError(f"legal mask 0x{mask:X} has bits beyond {num_actions} actions")
+    else:
+        legal = np.asarray(legal_actions).reshape(-1) > 0.5
+        if num_actions is not None and num_actions != legal.size:
+            raise WireProtocolError(f"legal_actions has {legal.size} entries, expected {num_actions}")
+        num_actions = legal.size
+        mask = sum(1 << int(i) for i in np.flatnonzero(legal))
+    if num_actions > 32:
+        raise WireProtocolError(f"legal mask holds at most 32 actions, got {num_actions}")
+    return (_header(MSG_OBSERVATION, request_id)
+            + OBSERVATION_PREFIX.pack(bits.size, num_actions)
+            + np.packbits(bits).tobytes()
+            + LEGAL_MASK.pack(mask))
+
+
+def encode_action(action, request_id=0):
+    return _header(MSG_ACTION, request_id) + ACTION.pack(int(action))
+
+
+def encode_error(message, request_id=0):
+    return _header(MSG_ERROR, request_id) + str(message).encode("utf-8")
+
+
+def decode(body):
+    """本体 → (type, request_id, 内容)。
+
+    内容は OBSERVATION なら (observation uint8 配列, legal_actions float32 0/1 配列)、
+    ACTION なら行動 ID、ERROR ならメッセージ文字列。
+    """
+    if len(body) < HEADER.size:
+        raise WireProtocolError(f"frame too short: {len(body)} bytes")
+    magic, version, msg_type, _, request_id = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise WireProtocolError(f"bad magic: 0x{magic:02X}")
+    if version != VERSION:
+        raise WireProtocolError(f"unsupported version: {version}")
+    offset = HEADER.size
+
+    if msg_type == MSG_OBSERVATION:
+        num_bits, num_actions = OBSERVATION_PREFIX.unpack_from(body, offset)
+        offset += OBSERVATION_PREFIX.size
+        num_bytes = (num_bits + 7) // 8
+        if len(body) != offset + num_bytes + LEGAL_MASK.size:
+            raise WireProtocolError(f"observation frame has {len(body)} bytes, "
+                                    f"expected {offset + num_bytes + LEGAL_MASK.size}")
+        packed = np.frombuffer(body, dtype=np.uint8, count=num_bytes, offset=offset)
+        observation = np.unpackbits(packed)[:num_bits]
+        (mask,) = LEGAL_MASK.unpack_from(body, offset + num_bytes)
+        legal = ((mask >> np.arange(num_actions, dtype=np.uint32)) & 1).astype(np.float32)
+        return msg_type, request_id, (observation, legal)
+    if msg_type == MSG_ACTION:
+        (action,) = ACTION.unpack_from(body, offset)
+        return msg_type, request_id, action
+    if msg_type == MSG_ERROR:
+        return msg_type, request_id, body[offset:].decode("utf-8", errors="replace")
+    raise WireProtocolError(f"unknown message type: {msg_type}")